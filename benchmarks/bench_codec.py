@@ -0,0 +1,45 @@
+import sys
+import timeit
+
+from common.codec import CODECS, decode
+
+"""
+Compare encode/decode throughput of the wire codecs on typical messages.
+
+Run from the repository root:
+    python -m benchmarks.bench_codec [iterations]
+"""
+
+MESSAGES = {
+    'feed_1_field': {
+        'query': 'MARKET_DATA_FEED',
+        'data': {'value': 101.25},
+        'id': 123456
+    },
+    'feed_5_fields': {
+        'query': 'MARKET_DATA_FEED',
+        'data': {'bid': 101.25, 'ask': 101.5, 'last': 101.375, 'volume': 1520.0, 'timestamp': 1700000000.123},
+        'id': 123456
+    },
+    'lifecycle': {
+        'query': 'INIT',
+        'data': {'resources': 1000},
+        'id': 7
+    }
+}
+
+
+def bench(iterations):
+    print('%-15s %-8s %8s %14s %14s' % ('message', 'codec', 'bytes', 'encode msg/s', 'decode msg/s'))
+    for msg_name, msg in MESSAGES.items():
+        for codec_name, codec in CODECS.items():
+            data = codec.encode(msg)
+            assert decode(data) == msg
+            encode_time = timeit.timeit(lambda: codec.encode(msg), number=iterations)
+            decode_time = timeit.timeit(lambda: decode(data), number=iterations)
+            print('%-15s %-8s %8d %14.0f %14.0f' % (msg_name, codec_name, len(data),
+                                                   iterations / encode_time, iterations / decode_time))
+
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
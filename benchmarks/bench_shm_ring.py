@@ -0,0 +1,93 @@
+import os
+import sys
+import time
+import socket
+import struct
+import multiprocessing
+
+from common.framing import send_frame, recv_frame
+from common.shm_ring import ShmRing
+
+"""
+Compare the one-way latency of feed messages sent between two processes on the same host,
+through a shared memory ring and through a local TCP socket.
+
+Run from the repository root:
+    python -m benchmarks.bench_shm_ring [messages]
+"""
+
+# message: send timestamp, in perf_counter nanoseconds, padded to a typical feed size
+MESSAGE = struct.Struct('!q56x')
+# seconds between messages, so that the latency measured is not the one of a backlog
+INTERVAL = 0.0001
+
+CONTEXT = multiprocessing.get_context('fork')
+
+
+def write_ring(ring, messages, ready):
+    # the forked writer inherits the mapping of the ring
+    ready.wait()
+    for _ in range(messages):
+        ring.write(MESSAGE.pack(time.perf_counter_ns()))
+        time.sleep(INTERVAL)
+
+
+def write_socket(port, messages, ready):
+    sock = socket.create_connection(('localhost', port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    ready.wait()
+    for _ in range(messages):
+        send_frame(sock, MESSAGE.pack(time.perf_counter_ns()))
+        time.sleep(INTERVAL)
+    sock.close()
+
+
+def report(name, latencies):
+    latencies.sort()
+    print('%-8s median %8.1f us   p99 %8.1f us   max %8.1f us' % (name,
+                                                              latencies[len(latencies) // 2] / 1000,
+                                                              latencies[int(len(latencies) * 0.99)] / 1000,
+                                                              latencies[-1] / 1000))
+
+
+def bench_ring(messages):
+    ring = ShmRing('hydra_bench_%d' % os.getpid(), create=True, slots=1024, slot_size=MESSAGE.size)
+    ready = CONTEXT.Event()
+    writer = CONTEXT.Process(target=write_ring, args=(ring, messages, ready))
+    writer.start()
+    ready.set()
+
+    latencies = []
+    while len(latencies) < messages:
+        # the forked writer has its own copy of the ring state, the parent reads through the original
+        for payload in ring.read_available():
+            latencies.append(time.perf_counter_ns() - MESSAGE.unpack(payload)[0])
+    writer.join()
+    ring.close()
+    report('shm', latencies)
+
+
+def bench_socket(messages):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('localhost', 0))
+    server.listen(1)
+    ready = CONTEXT.Event()
+    writer = CONTEXT.Process(target=write_socket, args=(server.getsockname()[1], messages, ready))
+    writer.start()
+    sock, _ = server.accept()
+    ready.set()
+
+    latencies = []
+    while len(latencies) < messages:
+        payload = recv_frame(sock)
+        latencies.append(time.perf_counter_ns() - MESSAGE.unpack(payload)[0])
+    writer.join()
+    sock.close()
+    server.close()
+    report('tcp', latencies)
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    bench_ring(n)
+    bench_socket(n)
@@ -0,0 +1,86 @@
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+import numpy as np
+
+from market_interface.tick_storage import TickStorage
+
+"""
+Measure the write throughput and the range scan speed of the persistent tick storage,
+before and after compaction.
+
+Run from the repository root:
+    python -m benchmarks.bench_tick_storage [ticks]
+"""
+
+# midnight of 2021-01-01, UTC
+T0 = 1609459200.0
+# seconds between ticks, so that the benchmark spans a few days
+TICK_INTERVAL = 0.5
+SCANS = 1000
+
+
+def bench_append(storage, ticks):
+    start = time.perf_counter()
+    for i in range(ticks):
+        storage.append('BENCH', {'bid': 100.0 + i % 7, 'ask': 100.5 + i % 7}, T0 + i * TICK_INTERVAL)
+    storage.close()
+    elapsed = time.perf_counter() - start
+    print('append        %10.0f ticks/s' % (ticks / elapsed))
+
+
+def bench_write(storage, ticks):
+    timestamps = T0 + np.arange(ticks) * TICK_INTERVAL + 0.25
+    columns = {'timestamp': timestamps, 'bid': np.full(ticks, 100.0), 'ask': np.full(ticks, 100.5)}
+    start = time.perf_counter()
+    storage.write('BENCH', columns)
+    elapsed = time.perf_counter() - start
+    print('bulk write    %10.0f ticks/s' % (ticks / elapsed))
+
+
+def bench_scan(storage, span, name):
+    ranges = []
+    for _ in range(SCANS):
+        start = T0 + random.random() * span
+        ranges.append((start, start + random.random() * 3600))
+
+    returned = 0
+    start = time.perf_counter()
+    for lo, hi in ranges:
+        for part in storage.scan('BENCH', lo, hi):
+            returned += len(part['timestamp'])
+    elapsed = time.perf_counter() - start
+    print('%-13s %10.1f us/scan  (%.0f ticks/scan)' % (name, elapsed / SCANS * 1e6, returned / SCANS))
+
+    total = 0
+    start = time.perf_counter()
+    for part in storage.scan('BENCH'):
+        part['bid'].sum()
+        total += len(part['bid'])
+    elapsed = time.perf_counter() - start
+    print('%-13s %10.0f ticks/s' % ('full scan', total / elapsed))
+
+
+def bench_compact(storage):
+    start = time.perf_counter()
+    days = storage.compact_all()
+    print('compaction    %10.3f s for %d days' % (time.perf_counter() - start, days))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    root = tempfile.mkdtemp(prefix='hydra_bench_')
+    try:
+        storage = TickStorage(root)
+        bench_append(storage, n)
+        bench_scan(storage, n * TICK_INTERVAL, 'range scan')
+        # interleaved ticks, the days overlap until compacted
+        bench_write(storage, n)
+        bench_scan(storage, n * TICK_INTERVAL, 'overlapping')
+        bench_compact(storage)
+        bench_scan(storage, n * TICK_INTERVAL, 'compacted')
+    finally:
+        shutil.rmtree(root)
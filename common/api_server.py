@@ -1,28 +1,60 @@
 import abc
+import queue
 import socket
 import logging
+import selectors
 import threading
 
+from common.worker_pool import WorkerPool
+from common.async_api_server import AsyncApiServer
+
 
 MAX_CONNECTION_QUEUE_LEN = 5
 
+# server modes
+THREAD_MODE = 'thread'
+EXECUTOR_MODE = 'executor'
+ASYNCIO_MODE = 'asyncio'
+
+# executor mode defaults
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_QUEUE_LEN = 128
+# seconds given to a client to send the request we are refusing
+REJECT_READ_TIMEOUT = 1
+# seconds a worker waits on a client sending a request, or reading the response, before closing it
+REQUEST_TIMEOUT = 10
+
+BUSY_MESSAGE = 'busy'
+
 
 class ApiServer(threading.Thread):
     """
     Server for incoming requests to the specified address.
-    Listens on the specified port, and spawns a request handler in a
-    separate thread to handle incoming requests.
+    Listens on the specified port, and serves incoming connections in one of three modes:
+        thread: spawns a request handler in a separate thread for each incoming connection.
+            Connections are long-lived, the handler keeps serving requests on it until the
+            other end closes it.
+        executor: a single thread watches all the connections, and hands each incoming request
+            to a fixed pool of workers through a bounded queue. When the queue is full the request
+            is refused right away with a FAIL 'busy' response.
+        asyncio: all the connections are served by a single asyncio event loop, see AsyncApiServer.
+            Coroutine query handlers run on the loop, the others on max_workers threads.
     """
 
     __metaclass__ = abc.ABCMeta
 
-    def __init__(self, host, port):
+    def __init__(self, host, port, mode=THREAD_MODE, max_workers=DEFAULT_MAX_WORKERS,
+                 max_queue_len=DEFAULT_MAX_QUEUE_LEN, backlog=MAX_CONNECTION_QUEUE_LEN):
         """
         Generic API server used by the various components of the system to receive and
         handle incoming queries
 
         :param host: address of the server
         :param port: port of the server
+        :param mode: thread, executor or asyncio, see class description
+        :param max_workers: number of workers handling requests, executor and asyncio modes only
+        :param max_queue_len: maximum number of requests waiting for a worker, executor mode only
+        :param backlog: maximum number of connections waiting to be accepted
         """
         threading.Thread.__init__(self)
 
@@ -30,23 +62,155 @@ class ApiServer(threading.Thread):
 
         self.HOST = host
         self.PORT = port
+        self.MODE = mode
+
+        if self.MODE not in (THREAD_MODE, EXECUTOR_MODE, ASYNCIO_MODE):
+            raise ValueError('Unknown server mode %s' % self.MODE)
+
+        # executor and asyncio mode state
+        self.async_server = None
+        self.workers = None
+        self.selector = None
+        self.connections = 0
+        self.connections_lock = threading.Lock()
+        if self.MODE == EXECUTOR_MODE:
+            self.workers = WorkerPool('api_server_%d' % port, max_workers, max_queue_len)
+            # connections served by a worker, to be watched again by the selector
+            self.rearm_queue = queue.SimpleQueue()
+            self.wakeup_recv, self.wakeup_send = socket.socketpair()
+            # connections whose request is refused, the refusal is sent by its own thread
+            # so that a slow client does not hold up the selector
+            self.reject_queue = queue.SimpleQueue()
 
         # create socket and start listening
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.socket.bind((self.HOST, self.PORT))
-        self.socket.listen(MAX_CONNECTION_QUEUE_LEN)
+        self.socket.listen(backlog)
+
+        if self.MODE == ASYNCIO_MODE:
+            self.async_server = AsyncApiServer(self.socket, self.get_handler, executor_workers=max_workers)
 
     def run(self):
         """
-        Listen for incoming requests and handle them in a separate thread
+        Listen for incoming connections and serve them according to the server mode
+        """
+        if self.MODE == EXECUTOR_MODE:
+            self._run_executor()
+        elif self.MODE == ASYNCIO_MODE:
+            self.async_server.run()
+        else:
+            self._run_threaded()
+
+    def _accept(self):
+        (client_socket, address) = self.socket.accept()
+        self.logger.info('Accepted connection: %r' % (address,))
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return client_socket
+
+    def _run_threaded(self):
+        """
+        Listen for incoming connections and handle them in a separate thread
         """
         while True:
-            (client_socket, address) = self.socket.accept()
-            self.logger.info('Accepted connection: %r' % (address,))
+            client_socket = self._accept()
             handler = self.get_handler(client_socket)
             handler.start()
 
+    def _run_executor(self):
+        """
+        Watch the listening socket and all the open connections, and hand every readable
+        connection to the worker pool.
+        A connection is not watched while a worker is serving it, so its requests are
+        still handled one at a time and in order.
+        """
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.socket, selectors.EVENT_READ, None)
+        self.selector.register(self.wakeup_recv, selectors.EVENT_READ, None)
+        threading.Thread(target=self._reject_loop, name='api_server_%d_rejecter' % self.PORT, daemon=True).start()
+
+        while True:
+            for key, _ in self.selector.select():
+                if key.fileobj is self.socket:
+                    client_socket = self._accept()
+                    with self.connections_lock:
+                        self.connections += 1
+                    self.selector.register(client_socket, selectors.EVENT_READ, self.get_handler(client_socket))
+                elif key.fileobj is self.wakeup_recv:
+                    self.wakeup_recv.recv(4096)
+                    while not self.rearm_queue.empty():
+                        handler = self.rearm_queue.get()
+                        self.selector.register(handler.socket, selectors.EVENT_READ, handler)
+                else:
+                    handler = key.data
+                    self.selector.unregister(handler.socket)
+                    if not self.workers.submit(self._serve_request, handler):
+                        self.reject_queue.put(handler)
+
+    def _serve_request(self, handler):
+        """
+        Worker task: serve the request waiting on the connection, then give it back to the selector.
+        A connection that stalls or fails is closed, so that it never stays out of the selector.
+        """
+        handler.socket.settimeout(REQUEST_TIMEOUT)
+        try:
+            still_open = handler.serve_one()
+        except Exception as e:
+            self.logger.exception('Could not serve request: %s' % e)
+            still_open = False
+        finally:
+            handler.socket.settimeout(None)
+        if still_open:
+            self._rearm(handler)
+        else:
+            self._close(handler)
+
+    def _reject_loop(self):
+        while True:
+            self._reject_request(self.reject_queue.get())
+
+    def _reject_request(self, handler):
+        """
+        Refuse the request waiting on the connection, since no worker is available,
+        then give the connection back to the selector
+        """
+        handler.socket.settimeout(REJECT_READ_TIMEOUT)
+        try:
+            still_open = handler.reject_one(BUSY_MESSAGE)
+        except OSError as e:
+            self.logger.error('Could not refuse request: %s' % e)
+            still_open = False
+        finally:
+            handler.socket.settimeout(None)
+        if still_open:
+            self._rearm(handler)
+        else:
+            self._close(handler)
+
+    def _rearm(self, handler):
+        self.rearm_queue.put(handler)
+        self.wakeup_send.send(b'\0')
+
+    def _close(self, handler):
+        handler.socket.close()
+        with self.connections_lock:
+            self.connections -= 1
+
+    def get_metrics(self):
+        """
+        :return: dict with the current load of the server. In executor mode it contains
+                the queue depth and number of active workers.
+        """
+        metrics = {
+            'mode': self.MODE
+        }
+        if self.MODE == EXECUTOR_MODE:
+            metrics['connections'] = self.connections
+            metrics.update(self.workers.metrics())
+        elif self.MODE == ASYNCIO_MODE:
+            metrics.update(self.async_server.metrics())
+        return metrics
+
     @abc.abstractmethod
     def get_handler(self, client_socket):
         """
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import inspect
+import concurrent.futures
+
+from common.framing import read_frame, write_frame
+from common.codec import detect_codec
+from common.messaging import stream_responses
+
+
+# number of threads running the synchronous query handlers
+DEFAULT_EXECUTOR_WORKERS = 8
+
+
+class AsyncApiServer:
+    """
+    asyncio-based server, alternative to the thread-based serving modes of ApiServer.
+
+    Every connection is served by a coroutine on a single event loop, so a component receiving
+    messages on many connections (e.g. a strategy with dozens of feed subscriptions) does not
+    need a thread per connection or per message.
+    Query handlers can be coroutines, in which case they run directly on the event loop, or
+    plain functions, which are run in a bounded thread pool so they can't block the loop.
+    Requests coming from the same connection are handled one at a time, in order. A handler that
+    fails gets its request answered with a FAIL, and the connection keeps being served.
+    Generator handlers stream their response, each message is produced in the thread pool.
+    """
+    def __init__(self, server_socket, handler_factory, executor_workers=DEFAULT_EXECUTOR_WORKERS):
+        """
+        Initialize server on an already bound and listening socket.
+
+        :param server_socket: listening socket
+        :param handler_factory: called with the socket of each new connection, must return the
+                RequestHandler whose query_handlers serve that connection. The handler thread
+                itself is never started.
+        :param executor_workers: number of threads running synchronous query handlers
+        """
+        self.logger = logging.getLogger('async_api_server')
+
+        self.socket = server_socket
+        self.handler_factory = handler_factory
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=executor_workers,
+                                                              thread_name_prefix='async_api_server')
+
+        self.loop = None
+        self.connections = 0
+
+    def run(self):
+        """Run the event loop, serving connections until the process exits"""
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self._serve_connection, sock=self.socket)
+        async with server:
+            await server.serve_forever()
+
+    async def _serve_connection(self, reader, writer):
+        address = writer.get_extra_info('peername')
+        self.logger.info('Accepted connection: %r' % (address,))
+        self.connections += 1
+        handler = self.handler_factory(writer.get_extra_info('socket'))
+
+        try:
+            while True:
+                try:
+                    frame = await read_frame(reader)
+                    codec = detect_codec(frame)
+                    request = codec.decode(frame)
+                except ConnectionError as e:
+                    self.logger.debug('Connection closed: %s' % e)
+                    break
+                except ValueError as e:
+                    self.logger.error('Could not decode request: %s' % e)
+                    continue
+
+                try:
+                    response = await self.dispatch(handler.query_handlers, request)
+                except Exception as e:
+                    # the other requests of the connection are still served
+                    self.logger.exception('Could not handle %s: %s' % (request.get('query'), e))
+                    response = {
+                        'status': 'FAIL',
+                        'message': 'Could not handle request: %s' % e
+                    }
+                if inspect.isgenerator(response):
+                    await self._stream(writer, codec, request, response)
+                elif response is not None:
+                    if 'id' in request:
+                        response = dict(response, id=request['id'])
+                    await write_frame(writer, codec.encode(response))
+        except OSError as e:
+            self.logger.error('Connection with %r failed: %s' % (address, e))
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _stream(self, writer, codec, request, chunks):
+        """Send the messages of a streamed response, waiting for each one to be written"""
+        messages = stream_responses(chunks, self.logger)
+        while True:
+            message = await self.loop.run_in_executor(self.executor, next, messages, None)
+            if message is None:
+                break
+            if 'id' in request:
+                message = dict(message, id=request['id'])
+            await write_frame(writer, codec.encode(message))
+
+    async def dispatch(self, query_handlers, request):
+        """
+        Call the handler of the request.
+
+        :param query_handlers: dict of query handlers of the connection
+        :param request: decoded request
+        :return: the response to send back, None if there is none
+        """
+        self.logger.debug('Received %r' % request)
+
+        query = request.get('query')
+        if query not in query_handlers:
+            self.logger.error('Unknown request: %s' % query)
+            return {
+                'status': 'FAIL',
+                'message': 'API query not defined'
+            }
+
+        self.logger.info('Handling %s' % query)
+        query_handler = query_handlers[query]
+        if inspect.iscoroutinefunction(query_handler):
+            return await query_handler(request['data'])
+
+        response = await self.loop.run_in_executor(self.executor, query_handler, request['data'])
+        # the handler may still hand back a coroutine, e.g. a lambda wrapping an async method
+        if inspect.isawaitable(response):
+            response = await response
+        return response
+
+    def metrics(self):
+        return {
+            'connections': self.connections
+        }
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import itertools
+
+from common.framing import read_frame, write_frame
+from common.codec import JSON_CODEC, decode
+from common.messaging import RESPONSE_TIMEOUT
+
+
+class AsyncMessageSender:
+    """
+    asyncio counterpart of common.messaging.Connection.
+
+    Keeps a persistent connection to another component, tags every request with a correlation ID
+    and lets any number of coroutines have requests in flight on it at the same time.
+    A reader task resolves the future of each request when its response arrives.
+    Returns the same response dicts as the synchronous senders, instead of calling a callback.
+    """
+    def __init__(self, address, port, response_timeout=RESPONSE_TIMEOUT):
+        """
+        Initialize sender, without connecting yet.
+
+        :param address: address of the other component
+        :param port: port of the other component
+        :param response_timeout: seconds to wait for a response before giving up on it
+        """
+        self.address, self.port = address, port
+        self.descriptor = '%s:%d' % (address, port)
+        self.logger = logging.getLogger('async_message_sender_%s' % self.descriptor)
+        self.response_timeout = response_timeout
+
+        # codec used for outgoing messages
+        self.codec = JSON_CODEC
+
+        self.reader = None
+        self.writer = None
+        self.reader_task = None
+        self.connected = False
+
+        # futures of the requests waiting for a response, indexed by ID
+        self.pending = {}
+        self.request_ids = itertools.count(1)
+
+        self.connect_lock = asyncio.Lock()
+        self.send_lock = asyncio.Lock()
+
+    async def _connect(self):
+        async with self.connect_lock:
+            if self.connected:
+                return {'status': 'SUCCESS'}
+            try:
+                self.reader, self.writer = await asyncio.open_connection(self.address, self.port)
+            except OSError as e:
+                self.logger.error('Could not connect to %s: %s' % (self.descriptor, e))
+                return {
+                    'status': 'FAIL',
+                    'message': 'Could not connect to %s' % self.descriptor
+                }
+            self.connected = True
+            self.reader_task = asyncio.create_task(self._read_responses(self.reader))
+            return {'status': 'SUCCESS'}
+
+    async def _read_responses(self, reader):
+        while True:
+            try:
+                resp = decode(await read_frame(reader))
+            except (OSError, ConnectionError) as e:
+                self.logger.debug('Connection with %s closed: %s' % (self.descriptor, e))
+                break
+            except ValueError as e:
+                self.logger.error('Could not decode response from %s: %s' % (self.descriptor, e))
+                continue
+
+            future = self.pending.pop(resp.pop('id', None), None)
+            if future is None:
+                self.logger.debug('Discarding response %r' % resp)
+            elif not future.done():
+                future.set_result(resp)
+
+        if self.reader is reader:
+            self._drop()
+
+    def _drop(self):
+        """Mark the connection as dead, and fail all the requests still waiting on it"""
+        self.connected = False
+        if self.writer is not None:
+            self.writer.close()
+        self.reader, self.writer = None, None
+        pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_result(None)
+
+    async def send_message(self, payload, expect_response):
+        """
+        Send message, and wait for its response if one is expected.
+
+        :param payload: body of the request
+        :param expect_response: True if a response is expected from dest
+        :return: response dict, status can be FAIL (message contains error message)
+                or SUCCESS (data contain requested data)
+        """
+        if not self.connected:
+            conn_res = await self._connect()
+            if conn_res['status'] == 'FAIL':
+                return conn_res
+
+        request_id = next(self.request_ids)
+        future = None
+        if expect_response:
+            future = asyncio.get_running_loop().create_future()
+            self.pending[request_id] = future
+
+        try:
+            async with self.send_lock:
+                if self.writer is None:
+                    raise ConnectionError('connection dropped')
+                await write_frame(self.writer, self.codec.encode(dict(payload, id=request_id)))
+        except OSError as e:
+            self.logger.error('Connection failed with %s during request: %s' % (self.descriptor, e))
+            self.pending.pop(request_id, None)
+            self._drop()
+            return {
+                'status': 'FAIL',
+                'message': 'Connection failed with %s during communication' % self.descriptor
+            }
+
+        if not expect_response:
+            return {'status': 'SUCCESS'}
+
+        try:
+            resp = await asyncio.wait_for(future, self.response_timeout)
+        except asyncio.TimeoutError:
+            self.pending.pop(request_id, None)
+            self.logger.error('Request to %s timed out' % self.descriptor)
+            return {
+                'status': 'FAIL',
+                'message': 'Connection timed out with %s during request' % self.descriptor
+            }
+        if resp is None:
+            return {
+                'status': 'FAIL',
+                'message': 'Connection lost with %s before response' % self.descriptor
+            }
+        return {'status': 'SUCCESS',
+                'data': resp}
+
+    async def close(self):
+        if self.writer is not None:
+            writer = self.writer
+            self._drop()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+        if self.reader_task is not None:
+            self.reader_task.cancel()
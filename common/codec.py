@@ -0,0 +1,300 @@
+import json
+import zlib
+import struct
+import functools
+
+from common.framing import MAX_FRAME_SIZE
+
+
+"""
+Wire codecs, turning messages into frame payloads and back.
+
+JSON is the default, and is understood by every component. The binary codec packs
+MARKET_DATA_FEED messages carrying flat numeric data into a fixed struct layout, which is
+much cheaper to produce and parse than JSON, and falls back to JSON for everything else.
+
+Batch messages carry a list of messages that were already encoded on their own, so they can
+be built by joining the encoded messages instead of encoding everything again.
+
+Any encoded frame can be compressed with zlib, compressed frames are recognized by their tag
+and decompressed before being decoded.
+
+The codec of an incoming frame is recognized by its first byte, so a receiver can always
+decode a frame regardless of the codec negotiated with the sender: JSON objects start with
+'{', binary frames start with a tag byte that is not valid JSON.
+"""
+
+JSON = 'json'
+BINARY = 'binary'
+
+# binary frame tags
+FEED_TAG = 0x01
+BATCH_TAG = 0x02
+ZLIB_TAG = 0x03
+
+# binary feed message layout:
+#   header: tag, request ID (0 if none), number of fields, length of the names block
+#   names block: for each field, name length, utf-8 encoded name and type code of the value
+#   values: one per field, of its type
+FEED_HEADER = struct.Struct('!BQBH')
+NAME_LEN = struct.Struct('!B')
+# value type codes, struct formats: 64 bit signed integers and doubles
+INT_TYPE = b'q'
+FLOAT_TYPE = b'd'
+VALUE_TYPES = (INT_TYPE, FLOAT_TYPE)
+# layouts of distinct field sets cached by the binary codec, least recently used ones are dropped
+MAX_LAYOUTS = 1024
+
+# binary feed batch layout:
+#   header: tag, number of messages
+#   messages: for each message, its length and the message encoded with the binary codec
+BATCH_HEADER = struct.Struct('!BI')
+MESSAGE_LEN = struct.Struct('!I')
+
+
+class Codec:
+    """Base class of the wire codecs"""
+    name = None
+
+    def encode(self, message):
+        """
+        :param message: message dict
+        :return: bytes to send as frame payload
+        """
+        raise NotImplementedError
+
+    def decode(self, data):
+        """
+        :param data: frame payload
+        :return: decoded message dict
+        """
+        raise NotImplementedError
+
+    def encode_batch(self, query, messages):
+        """
+        :param query: query of the batch message
+        :param messages: list of messages already encoded with this codec
+        :return: bytes to send as frame payload, decoded as a message whose data is the list
+                of the batched messages
+        """
+        return b''.join([b'{"query": ', json.dumps(query).encode(),
+                         b', "data": [', b', '.join(messages), b']}'])
+
+
+class JsonCodec (Codec):
+    name = JSON
+
+    def encode(self, message):
+        return json.dumps(message).encode()
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class BinaryCodec (Codec):
+    """
+    Compact codec for feed messages.
+    Only MARKET_DATA_FEED messages whose data is a dict of numbers are packed, the layout of
+    every distinct set of field names and value types is computed once, and the last
+    MAX_LAYOUTS of them are cached.
+    Integers travel as 64 bit integers and floats as doubles, so both come back as they were
+    sent, messages with integers out of range fall back to JSON.
+    """
+    name = BINARY
+
+    def __init__(self):
+        # (field names, value types) -> (names block, values struct), used when encoding
+        self.encode_layout = functools.lru_cache(MAX_LAYOUTS)(self._encode_layout)
+        # names block -> (field names, values struct), used when decoding
+        self.decode_layout = functools.lru_cache(MAX_LAYOUTS)(self._decode_layout)
+
+    def encode(self, message):
+        data = message.get('data')
+        if message.get('query') != 'MARKET_DATA_FEED' or not self._packable(data):
+            return json.dumps(message).encode()
+
+        names_block, values = self.encode_layout(tuple(data), tuple(type(value) is int for value in data.values()))
+        try:
+            packed = values.pack(*data.values())
+        except struct.error:
+            # integer out of range
+            return json.dumps(message).encode()
+
+        return (FEED_HEADER.pack(FEED_TAG, message.get('id', 0), len(data), len(names_block))
+                + names_block
+                + packed)
+
+    @staticmethod
+    def _encode_layout(names, ints):
+        types = [INT_TYPE if is_int else FLOAT_TYPE for is_int in ints]
+        names_block = b''.join(NAME_LEN.pack(len(name)) + name + value_type
+                               for name, value_type in zip((name.encode() for name in names), types))
+        return names_block, struct.Struct('!' + b''.join(types).decode())
+
+    @staticmethod
+    def _decode_layout(names_block, n_fields):
+        names, types, offset = [], [], 0
+        for _ in range(n_fields):
+            (name_len,) = NAME_LEN.unpack_from(names_block, offset)
+            offset += NAME_LEN.size
+            names.append(names_block[offset:offset + name_len].decode())
+            offset += name_len
+            value_type = names_block[offset:offset + 1]
+            if value_type not in VALUE_TYPES:
+                raise struct.error('unknown value type %r' % value_type)
+            types.append(value_type)
+            offset += 1
+        return tuple(names), struct.Struct('!' + b''.join(types).decode())
+
+    @staticmethod
+    def _packable(data):
+        if not isinstance(data, dict) or len(data) > 255:
+            return False
+        for name, value in data.items():
+            if type(value) not in (float, int) or len(name) > 255:
+                return False
+        return True
+
+    def encode_batch(self, query, messages):
+        if query != 'MARKET_DATA_FEED_BATCH':
+            return super().encode_batch(query, messages)
+        # messages that fell back to JSON are recognized by their first byte when decoding
+        parts = [BATCH_HEADER.pack(BATCH_TAG, len(messages))]
+        for message in messages:
+            parts.append(MESSAGE_LEN.pack(len(message)))
+            parts.append(message)
+        return b''.join(parts)
+
+    def decode(self, data):
+        if data and data[0] == BATCH_TAG:
+            return self._decode_batch(data)
+        if not data or data[0] != FEED_TAG:
+            return json.loads(data)
+
+        try:
+            _, request_id, n_fields, names_len = FEED_HEADER.unpack_from(data)
+            names_block = bytes(data[FEED_HEADER.size:FEED_HEADER.size + names_len])
+            names, values = self.decode_layout(names_block, n_fields)
+            message = {
+                'query': 'MARKET_DATA_FEED',
+                'data': dict(zip(names, values.unpack_from(data, FEED_HEADER.size + names_len)))
+            }
+        except (struct.error, UnicodeDecodeError) as e:
+            raise ValueError('Malformed binary frame: %s' % e)
+
+        if request_id:
+            message['id'] = request_id
+        return message
+
+    def _decode_batch(self, data):
+        try:
+            _, count = BATCH_HEADER.unpack_from(data)
+            messages, offset = [], BATCH_HEADER.size
+            for _ in range(count):
+                (message_len,) = MESSAGE_LEN.unpack_from(data, offset)
+                offset += MESSAGE_LEN.size
+                if offset + message_len > len(data):
+                    raise struct.error('truncated message')
+                messages.append(self.decode(data[offset:offset + message_len]))
+                offset += message_len
+        except struct.error as e:
+            raise ValueError('Malformed binary frame: %s' % e)
+        return {
+            'query': 'MARKET_DATA_FEED_BATCH',
+            'data': messages
+        }
+
+
+class ZlibCodec (Codec):
+    """
+    Compressed frames, wrapping frames produced by any other codec.
+    Only recognized when decoding, it is never negotiated: messages encoded with it are
+    compressed JSON.
+    """
+    name = 'zlib'
+
+    def encode(self, message):
+        return compress(JSON_CODEC.encode(message))
+
+    def decode(self, data):
+        return decode(decompress(data))
+
+
+JSON_CODEC = JsonCodec()
+BINARY_CODEC = BinaryCodec()
+ZLIB_CODEC = ZlibCodec()
+
+CODECS = {
+    JSON: JSON_CODEC,
+    BINARY: BINARY_CODEC
+}
+
+# codecs offered during registration, in order of preference
+SUPPORTED_CODECS = [BINARY, JSON]
+
+
+def get_codec(name):
+    """
+    :param name: name of the codec
+    :return: the codec, JSON if the name is unknown
+    """
+    return CODECS.get(name, JSON_CODEC)
+
+
+def detect_codec(data):
+    """
+    :param data: frame payload
+    :return: codec able to decode it
+    """
+    if data and data[0] in (FEED_TAG, BATCH_TAG):
+        return BINARY_CODEC
+    if data and data[0] == ZLIB_TAG:
+        return ZLIB_CODEC
+    return JSON_CODEC
+
+
+def decode(data):
+    """
+    Decode a frame payload, whatever codec produced it.
+
+    :param data: frame payload
+    :return: decoded message dict
+    """
+    return detect_codec(data).decode(data)
+
+
+def compress(data):
+    """
+    :param data: encoded frame payload
+    :return: compressed frame payload
+    """
+    return bytes([ZLIB_TAG]) + zlib.compress(data)
+
+
+def decompress(data):
+    """
+    :param data: compressed frame payload
+    :return: the original frame payload
+    """
+    decompressor = zlib.decompressobj()
+    try:
+        # refuse to inflate past the maximum frame size
+        payload = decompressor.decompress(memoryview(data)[1:], MAX_FRAME_SIZE)
+    except zlib.error as e:
+        raise ValueError('Malformed compressed frame: %s' % e)
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError('Malformed or oversized compressed frame')
+    return payload
+
+
+def negotiate(offered):
+    """
+    Pick the codec to use with a component.
+
+    :param offered: codec names supported by the component, in order of preference
+    :return: name of the first offered codec supported here, JSON if there is none
+    """
+    for name in offered:
+        if name in CODECS:
+            return name
+    return JSON
@@ -0,0 +1,91 @@
+import struct
+import asyncio
+
+
+"""
+Framing layer used on every socket between Hydra components.
+
+Each message travels as a single frame, composed of a fixed size header holding the
+length of the payload, followed by the payload itself. This way messages of any size
+can be sent over a stream socket, and the receiver knows exactly how much to read.
+"""
+
+# frame header: payload length, unsigned 32 bit big endian
+HEADER = struct.Struct('!I')
+
+# refuse frames bigger than this, a bogus header would otherwise make us allocate gigabytes
+MAX_FRAME_SIZE = 64 * 1024 * 1024
+
+
+def send_frame(sock, payload):
+    """
+    Send the payload as a single frame, blocking until all of it has been handed to the kernel.
+
+    :param sock: connected socket
+    :param payload: bytes-like object to send
+    """
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ValueError('Frame of %d bytes exceeds maximum size of %d' % (len(payload), MAX_FRAME_SIZE))
+    sock.sendall(HEADER.pack(len(payload)) + payload)
+
+
+def recv_exactly(sock, size):
+    """
+    Read exactly size bytes from the socket, looping over partial reads.
+    The whole read is done in a single preallocated buffer.
+
+    :param sock: connected socket
+    :param size: number of bytes to read
+    :return: bytearray containing the data
+    """
+    buf = bytearray(size)
+    view = memoryview(buf)
+    read = 0
+    while read < size:
+        n = sock.recv_into(view[read:], size - read)
+        if n == 0:
+            raise ConnectionError('Connection closed by peer')
+        read += n
+    return buf
+
+
+def recv_frame(sock):
+    """
+    Read a whole frame from the socket.
+
+    :param sock: connected socket
+    :return: bytearray with the frame payload
+    """
+    (size,) = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    if size > MAX_FRAME_SIZE:
+        raise ConnectionError('Incoming frame of %d bytes exceeds maximum size of %d' % (size, MAX_FRAME_SIZE))
+    return recv_exactly(sock, size)
+
+
+async def read_frame(reader):
+    """
+    Read a whole frame from an asyncio stream.
+
+    :param reader: asyncio.StreamReader
+    :return: bytes with the frame payload
+    """
+    try:
+        (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+        if size > MAX_FRAME_SIZE:
+            raise ConnectionError('Incoming frame of %d bytes exceeds maximum size of %d' % (size, MAX_FRAME_SIZE))
+        return await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        raise ConnectionError('Connection closed by peer')
+
+
+async def write_frame(writer, payload):
+    """
+    Write the payload as a single frame to an asyncio stream, waiting for the buffer to drain.
+
+    :param writer: asyncio.StreamWriter
+    :param payload: bytes-like object to send
+    """
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ValueError('Frame of %d bytes exceeds maximum size of %d' % (len(payload), MAX_FRAME_SIZE))
+    writer.write(HEADER.pack(len(payload)) + payload)
+    await writer.drain()
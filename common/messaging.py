@@ -1,8 +1,28 @@
-import json
+import time
+import queue
 import socket
 import logging
+import itertools
+import threading
+import collections
 
-BUFFER_SIZE = 1024
+from common.framing import send_frame, recv_frame
+from common.codec import JSON_CODEC, decode
+
+# seconds to wait for the response to a request sent over a persistent connection
+RESPONSE_TIMEOUT = 30
+# responses of a streamed request buffered before the reader thread waits for the consumer
+STREAM_QUEUE_LEN = 16
+
+# connection pool defaults
+POOL_MAX_SIZE = 64
+# seconds a connection can sit unused before it gets closed
+POOL_IDLE_TIMEOUT = 300
+# seconds between health checks of idle connections
+POOL_HEALTH_CHECK_INTERVAL = 30
+# reconnection backoff: the delay doubles after each failed attempt, up to the max
+RECONNECT_BACKOFF_BASE = 0.5
+RECONNECT_BACKOFF_MAX = 30
 
 
 def log_result(r, logger):
@@ -17,9 +37,10 @@ def log_result(r, logger):
 
 
 class MessageSender:
-    def __init__(self, address, port, sock=None):
+    def __init__(self, address, port, sock=None, codec=JSON_CODEC):
         self.address, self.port = address, port
         self.descriptor = '%s:%d' % (address, port)
+        self.codec = codec
         self.connected = False
         self.logger = logging.getLogger('message_sender_%s' % self.descriptor)
         if sock is None:
@@ -41,7 +62,7 @@ class MessageSender:
 
     def _send_payload(self, payload):
         try:
-            self.socket.send(json.dumps(payload).encode())
+            send_frame(self.socket, self.codec.encode(payload))
             return {'status': 'SUCCESS'}
         except socket.timeout:
             self.logger.error('Connection timed out with %s during request' % self.descriptor)
@@ -64,7 +85,7 @@ class MessageSender:
 
     def _get_response(self):
         try:
-            resp = json.loads(self.socket.recv(BUFFER_SIZE).decode())
+            resp = decode(recv_frame(self.socket))
             return {'status': 'SUCCESS',
                     'data': resp}
         except socket.error as e:
@@ -73,7 +94,7 @@ class MessageSender:
                 'status': 'FAIL',
                 'message': 'Could not get response from %s: %s' % (self.descriptor, e)
             }
-        except json.JSONDecodeError as e:
+        except ValueError as e:
             self.logger.error('Could not decode response from %s: %s' % (self.descriptor, e))
             return {
                 'status': 'FAIL',
@@ -112,3 +133,654 @@ class MessageSender:
     def close(self):
         self.socket.close()
         self.connected = False
+
+
+class PendingRequest:
+    """Request sent over a persistent connection, waiting for its response"""
+    def __init__(self):
+        self.event = threading.Event()
+        self.response = None
+
+    def set_response(self, response):
+        self.response = response
+        self.event.set()
+
+
+class StreamingRequest:
+    """
+    Request sent over a persistent connection, whose response is streamed back in many messages.
+    At most max_len messages are buffered: when the consumer falls behind, the reader thread
+    waits for it, and TCP flow control slows down the sender.
+    Since that holds up every other response on the connection, streams are sent over a connection
+    of their own, see ConnectionPool.stream_message.
+    """
+    def __init__(self, max_len=STREAM_QUEUE_LEN):
+        self.queue = queue.Queue(max_len)
+        self.closed = False
+
+    def set_response(self, response):
+        while not self.closed:
+            try:
+                self.queue.put(response, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        """Stop accepting messages, releasing the reader thread if it is waiting"""
+        self.closed = True
+
+
+def stream_responses(chunks, logger):
+    """
+    Turn the chunks yielded by a streaming query handler into the messages sent back to the requester.
+    Every chunk is sent with more set to True, and the stream is closed by an empty message with more
+    set to False. A FAIL chunk, or an error in the handler, also closes the stream.
+
+    :param chunks: iterable of response dicts
+    :param logger: logger of the handler
+    :return: generator of the response messages
+    """
+    try:
+        for chunk in chunks:
+            if chunk.get('status') == 'FAIL':
+                yield dict(chunk, more=False)
+                return
+            yield dict(chunk, more=True)
+    except Exception as e:
+        logger.error('Streamed response failed: %s' % e)
+        yield {
+            'status': 'FAIL',
+            'message': 'Streamed response failed: %s' % e,
+            'more': False
+        }
+        return
+    yield {
+        'status': 'SUCCESS',
+        'data': {},
+        'more': False
+    }
+
+
+class Connection:
+    """
+    Long-lived connection to another component.
+
+    Every request is tagged with a correlation ID, which the other end copies into its response.
+    This way many requests can be in flight at the same time over the same socket, issued by
+    any number of threads, and a single reader thread hands each response to the request waiting for it.
+    Messages are encoded with the codec negotiated with the other component, JSON until then.
+    The connection is (re)opened lazily when a message has to be sent. After a failed attempt,
+    new attempts are refused until the backoff delay has expired, so that an unreachable
+    component does not get hammered with connection attempts.
+    """
+    def __init__(self, address, port, response_timeout=RESPONSE_TIMEOUT,
+                 backoff_base=RECONNECT_BACKOFF_BASE, backoff_max=RECONNECT_BACKOFF_MAX,
+                 read_responses=True, send_timeout=None):
+        """
+        Initialize connection, without connecting yet.
+
+        :param address: address of the other component
+        :param port: port of the other component
+        :param response_timeout: seconds to wait for a response before giving up on it
+        :param backoff_base: seconds to wait before reconnecting after the first failed attempt
+        :param backoff_max: maximum seconds to wait between reconnection attempts
+        :param read_responses: False for a connection only sending messages without response, e.g. feeds,
+                which has no reader thread
+        :param send_timeout: seconds a send can block when the other end does not read, None to wait forever.
+                Only for connections not reading responses, the socket timeout would apply to the reads too
+        """
+        if read_responses and send_timeout is not None:
+            raise ValueError('Send timeout on a connection reading responses')
+        self.address, self.port = address, port
+        self.descriptor = '%s:%d' % (address, port)
+        self.logger = logging.getLogger('connection_%s' % self.descriptor)
+        self.response_timeout = response_timeout
+        self.read_responses = read_responses
+        self.send_timeout = send_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        # codec used for outgoing messages
+        self.codec = JSON_CODEC
+
+        self.socket = None
+        self.connected = False
+
+        # reconnection state
+        self.failed_attempts = 0
+        self.retry_at = 0
+        self.ever_connected = False
+        self.reconnects = 0
+
+        # usage tracking, used by the pool to find idle connections
+        self.last_used = time.monotonic()
+        self.active = 0
+        self.usage_lock = threading.Lock()
+
+        # requests waiting for a response, indexed by ID
+        self.pending = {}
+        self.request_ids = itertools.count(1)
+
+        self.connect_lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.pending_lock = threading.Lock()
+
+    def _connect_socket(self):
+        with self.connect_lock:
+            if self.connected:
+                return {'status': 'SUCCESS'}
+            if time.monotonic() < self.retry_at:
+                return {
+                    'status': 'FAIL',
+                    'message': 'Could not connect to %s, retrying in %.1fs' % (self.descriptor,
+                                                                               self.retry_at - time.monotonic())
+                }
+            try:
+                sock = socket.create_connection((self.address, self.port))
+            except OSError as e:
+                self.failed_attempts += 1
+                delay = min(self.backoff_base * 2 ** (self.failed_attempts - 1), self.backoff_max)
+                self.retry_at = time.monotonic() + delay
+                self.logger.error('Could not connect to %s: %s, retrying in %.1fs' % (self.descriptor, e, delay))
+                return {
+                    'status': 'FAIL',
+                    'message': 'Could not connect to %s' % self.descriptor
+                }
+            if self.ever_connected:
+                self.reconnects += 1
+            self.ever_connected = True
+            self.failed_attempts = 0
+            self.retry_at = 0
+            # frames are small and latency sensitive, don't wait to coalesce them
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.socket = sock
+            self.connected = True
+            if self.read_responses:
+                reader = threading.Thread(target=self._read_responses, args=(sock,), daemon=True)
+                reader.start()
+            else:
+                # nothing is read from the socket, its timeout only applies to the sends
+                sock.settimeout(self.send_timeout)
+            return {'status': 'SUCCESS'}
+
+    def _read_responses(self, sock):
+        """
+        Reader thread body: route every incoming response to the request waiting for it,
+        until the connection drops.
+        """
+        while True:
+            try:
+                resp = decode(recv_frame(sock))
+            except (OSError, ConnectionError) as e:
+                self.logger.debug('Connection with %s closed: %s' % (self.descriptor, e))
+                break
+            except ValueError as e:
+                self.logger.error('Could not decode response from %s: %s' % (self.descriptor, e))
+                continue
+
+            request_id = resp.pop('id', None)
+            with self.pending_lock:
+                pending = self.pending.get(request_id)
+                # streamed responses keep the request pending until their last message
+                if pending is not None and not resp.get('more'):
+                    del self.pending[request_id]
+            if pending is None:
+                self.logger.debug('Discarding response to request %r: %r' % (request_id, resp))
+            else:
+                pending.set_response(resp)
+
+        self._drop(sock)
+
+    def _drop(self, sock):
+        """Mark the connection as dead, and fail all the requests still waiting on it"""
+        with self.connect_lock:
+            current = self.socket is sock
+            if current:
+                self.connected = False
+                self.socket = None
+        sock.close()
+        # an old socket going away must not fail the requests sent on the new one
+        if not current:
+            return
+        with self.pending_lock:
+            pending, self.pending = self.pending, {}
+        for request in pending.values():
+            request.set_response(None)
+
+    def acquire(self):
+        """Mark the connection as in use, so that the pool does not close it"""
+        with self.usage_lock:
+            self.active += 1
+
+    def release(self):
+        """Undo an acquire, once done with the connection"""
+        with self.usage_lock:
+            self.active -= 1
+            self.last_used = time.monotonic()
+
+    @property
+    def busy(self):
+        """True if some thread is using the connection"""
+        return self.active > 0
+
+    def is_healthy(self):
+        """
+        Check that the connection is still usable, without blocking.
+        A closed connection is detected by the reader thread, but a peek on the socket
+        also catches one whose close has not been processed yet.
+        """
+        sock = self.socket
+        if not self.connected or sock is None:
+            return False
+        try:
+            return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) != b''
+        except BlockingIOError:
+            # nothing to read, but still open
+            return True
+        except OSError:
+            return False
+
+    def send_message(self, payload, expect_response, callback):
+        """
+        Send message, and execute the callback with the response.
+        Safe to call from multiple threads at the same time.
+
+        :param payload: body of the request
+        :param expect_response: True if a response is expected from dest
+        :param callback: callback, called with response dict,
+                status can be FAIL (message contains error message) or SUCCESS (data contain requested data)
+        """
+        self.acquire()
+        try:
+            self._send_message(payload, expect_response, callback)
+        finally:
+            self.release()
+
+    def send_encoded(self, data, callback):
+        """
+        Send a message that was already encoded with the codec of this connection, without waiting
+        for a response. Used to send the same payload to many destinations while encoding it once.
+        Safe to call from multiple threads at the same time.
+
+        :param data: encoded message
+        :param callback: callback, called with the result dict
+        """
+        self.acquire()
+        try:
+            if not self.connected:
+                conn_res = self._connect_socket()
+                if conn_res['status'] == 'FAIL':
+                    callback(conn_res)
+                    return
+            callback(self._write(data) or {'status': 'SUCCESS'})
+        finally:
+            self.release()
+
+    def _write(self, data):
+        """
+        Write a frame on the socket, dropping the connection if it fails.
+
+        :param data: frame payload
+        :return: FAIL dict if the write failed, None otherwise
+        """
+        sock = self.socket
+        try:
+            if sock is None:
+                raise ConnectionError('connection dropped')
+            with self.send_lock:
+                send_frame(sock, data)
+        except OSError as e:
+            self.logger.error('Connection failed with %s during request: %s' % (self.descriptor, e))
+            if sock is not None:
+                self._drop(sock)
+            return {
+                'status': 'FAIL',
+                'message': 'Connection failed with %s during communication' % self.descriptor
+            }
+        return None
+
+    def _send_message(self, payload, expect_response, callback):
+        if not self.connected:
+            conn_res = self._connect_socket()
+            if conn_res['status'] == 'FAIL':
+                callback(conn_res)
+                return
+
+        request_id = next(self.request_ids)
+        request = dict(payload, id=request_id)
+
+        # register before sending, the response could come back before send returns
+        pending = None
+        if expect_response:
+            pending = PendingRequest()
+            with self.pending_lock:
+                self.pending[request_id] = pending
+
+        write_res = self._write(self.codec.encode(request))
+        if write_res is not None:
+            with self.pending_lock:
+                self.pending.pop(request_id, None)
+            callback(write_res)
+            return
+
+        if not expect_response:
+            callback({'status': 'SUCCESS'})
+            return
+
+        if not pending.event.wait(self.response_timeout):
+            with self.pending_lock:
+                self.pending.pop(request_id, None)
+            self.logger.error('Request to %s timed out' % self.descriptor)
+            callback({
+                'status': 'FAIL',
+                'message': 'Connection timed out with %s during request' % self.descriptor
+            })
+        elif pending.response is None:
+            callback({
+                'status': 'FAIL',
+                'message': 'Connection lost with %s before response' % self.descriptor
+            })
+        else:
+            callback({'status': 'SUCCESS',
+                      'data': pending.response})
+
+    def stream_message(self, payload):
+        """
+        Send a request whose response is streamed back in many messages, and yield them as they arrive.
+        Only a bounded number of messages is buffered, so the memory used does not depend on the size
+        of the whole response. Closing the generator early abandons the rest of the stream.
+
+        :param payload: body of the request
+        :return: generator of response dicts, in the same format as the callback argument of send_message.
+                It stops after the last message of the stream, or after a FAIL.
+        """
+        self.acquire()
+        request_id = None
+        stream = StreamingRequest()
+        try:
+            if not self.connected:
+                conn_res = self._connect_socket()
+                if conn_res['status'] == 'FAIL':
+                    yield conn_res
+                    return
+
+            request_id = next(self.request_ids)
+            with self.pending_lock:
+                self.pending[request_id] = stream
+
+            write_res = self._write(self.codec.encode(dict(payload, id=request_id)))
+            if write_res is not None:
+                yield write_res
+                return
+
+            while True:
+                try:
+                    resp = stream.queue.get(timeout=self.response_timeout)
+                except queue.Empty:
+                    self.logger.error('Streamed request to %s timed out' % self.descriptor)
+                    yield {
+                        'status': 'FAIL',
+                        'message': 'Connection timed out with %s during request' % self.descriptor
+                    }
+                    return
+                if resp is None:
+                    yield {
+                        'status': 'FAIL',
+                        'message': 'Connection lost with %s before end of response' % self.descriptor
+                    }
+                    return
+
+                # more is missing if the other end answered with a single, normal response,
+                # the stream ends with an empty SUCCESS or with a FAIL
+                more = resp.pop('more', None)
+                if more is False and resp.get('status') == 'SUCCESS':
+                    return
+                yield {'status': 'SUCCESS',
+                       'data': resp}
+                if not more:
+                    return
+        finally:
+            stream.close()
+            if request_id is not None:
+                with self.pending_lock:
+                    self.pending.pop(request_id, None)
+            self.release()
+
+    def close(self):
+        sock = self.socket
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._drop(sock)
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of persistent connections to the other components, indexed by (address, port).
+
+    Since connections are multiplexed, a single connection per destination is enough, and it is
+    shared by all the threads talking to it.
+    The pool holds at most max_size connections: when it is full, the least recently used idle
+    connection is closed to make room. Idle connections are periodically checked, and dropped if
+    they are dead or have not been used for idle_timeout seconds.
+    """
+    def __init__(self, max_size=POOL_MAX_SIZE, idle_timeout=POOL_IDLE_TIMEOUT,
+                 health_check_interval=POOL_HEALTH_CHECK_INTERVAL,
+                 backoff_base=RECONNECT_BACKOFF_BASE, backoff_max=RECONNECT_BACKOFF_MAX):
+        """
+        Initialize pool.
+
+        :param max_size: maximum number of connections held by the pool
+        :param idle_timeout: seconds after which an unused connection is closed
+        :param health_check_interval: seconds between health checks of idle connections
+        :param backoff_base: initial reconnection delay of the pooled connections
+        :param backoff_max: maximum reconnection delay of the pooled connections
+        """
+        self.logger = logging.getLogger('connection_pool')
+
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        # connections ordered from least to most recently used
+        self.connections = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.health_checker = None
+
+    def get(self, address, port):
+        """
+        Get the connection to the specified address, creating it if needed.
+        The connection is marked as in use before the lock is released, so it can't be evicted
+        or dropped by a health check until it is given back with release.
+
+        :param address: address of the destination
+        :param port: port of the destination
+        :return: Connection shared by all the users of that destination
+        """
+        key = (address, port)
+        with self.lock:
+            connection = self.connections.get(key)
+            if connection is not None:
+                self.hits += 1
+                self.connections.move_to_end(key)
+                connection.acquire()
+                return connection
+
+            self.misses += 1
+            if len(self.connections) >= self.max_size:
+                self._evict_lru()
+            connection = Connection(address, port,
+                                    backoff_base=self.backoff_base,
+                                    backoff_max=self.backoff_max)
+            self.connections[key] = connection
+            connection.acquire()
+            self._start_health_checker()
+            return connection
+
+    def release(self, connection):
+        """
+        Give back a connection obtained with get.
+
+        :param connection: connection returned by get
+        """
+        connection.release()
+
+    def send_message(self, address, port, payload, expect_response, callback):
+        """
+        Send a message over the pooled connection to the specified address.
+        Same parameters as Connection.send_message.
+        """
+        connection = self.get(address, port)
+        try:
+            connection.send_message(payload, expect_response, callback)
+        finally:
+            self.release(connection)
+
+    def stream_message(self, address, port, payload):
+        """
+        Send a request with a streamed response to the specified address.
+        The reader thread of a stream waits for the consumer when it falls behind, so the request is
+        not sent over the pooled connection, whose other responses would be held up, but over a new
+        connection, using the same codec, closed at the end of the stream.
+        Same parameters and result as Connection.stream_message.
+        """
+        pooled = self.get(address, port)
+        self.release(pooled)
+        connection = Connection(address, port, backoff_base=self.backoff_base, backoff_max=self.backoff_max)
+        connection.codec = pooled.codec
+        try:
+            yield from connection.stream_message(payload)
+        finally:
+            connection.close()
+
+    def _evict_lru(self):
+        """Close the least recently used idle connection. Must hold the lock."""
+        for key, connection in self.connections.items():
+            if not connection.busy:
+                self._evict(key)
+                return
+        # every connection is in use, let the pool grow rather than breaking requests in flight
+        self.logger.warning('Connection pool full (%d) and all connections busy' % len(self.connections))
+
+    def _evict(self, key):
+        """Remove a connection from the pool and close it. Must hold the lock."""
+        connection = self.connections.pop(key)
+        connection.close()
+        self.evictions += 1
+        self.logger.debug('Evicted connection to %s' % connection.descriptor)
+
+    def health_check(self):
+        """
+        Check idle connections, dropping dead and expired ones.
+        Connections waiting for their reconnection backoff to expire stay in the pool, so the backoff
+        is not reset by the check.
+        """
+        now = time.monotonic()
+        with self.lock:
+            for key, connection in list(self.connections.items()):
+                if connection.busy:
+                    continue
+                idle_time = now - connection.last_used
+                if idle_time > self.idle_timeout:
+                    self._evict(key)
+                elif now >= connection.retry_at and not connection.is_healthy():
+                    self.logger.info('Connection to %s is dead, dropping it' % connection.descriptor)
+                    self._evict(key)
+
+    def _start_health_checker(self):
+        """Start the health check thread, if not running yet. Must hold the lock."""
+        if self.health_checker is None:
+            self.health_checker = threading.Thread(target=self._health_check_loop, daemon=True)
+            self.health_checker.start()
+
+    def _health_check_loop(self):
+        while True:
+            time.sleep(self.health_check_interval)
+            self.health_check()
+
+    def stats(self):
+        """
+        :return: dict with the pool counters
+        """
+        with self.lock:
+            return {
+                'size': len(self.connections),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'reconnects': sum(c.reconnects for c in self.connections.values())
+            }
+
+    def close_all(self):
+        with self.lock:
+            for key in list(self.connections):
+                self._evict(key)
+
+
+# pool used for all the communication between components
+connection_pool = ConnectionPool()
+
+
+def get_connection(address, port):
+    """
+    Get the pooled connection to the specified address, to read or change its settings, e.g. the codec.
+    The connection is not kept in use: to send over it, use the pool get and release.
+
+    :param address: address of the destination
+    :param port: port of the destination
+    :return: Connection shared by all the users of that destination
+    """
+    connection = connection_pool.get(address, port)
+    connection_pool.release(connection)
+    return connection
+
+
+def message_to_address(address, port, payload, expect_response, callback):
+    """
+    Send a message to the specified address, over the pooled connection to it.
+
+    :param address: address of the destination
+    :param port: port of the destination
+    :param payload: body of the request
+    :param expect_response: True if a response is expected from dest
+    :param callback: callback, called with the response dict
+    """
+    connection_pool.send_message(address, port, payload, expect_response, callback)
+
+
+def stream_from_address(address, port, payload):
+    """
+    Send a request whose response is streamed back, over a dedicated connection to the specified address.
+
+    :param address: address of the destination
+    :param port: port of the destination
+    :param payload: body of the request
+    :return: generator of response dicts, see Connection.stream_message
+    """
+    return connection_pool.stream_message(address, port, payload)
+
+
+def message_to_socket(sock, descriptor, payload, expect_response, callback, codec=JSON_CODEC):
+    """
+    Send a single message over an already connected socket, which is left open.
+
+    :param sock: connected socket
+    :param descriptor: name of the other end, used for logging
+    :param payload: body of the message
+    :param expect_response: True if a response is expected from the other end
+    :param callback: callback, called with the response dict
+    :param codec: codec used to encode the message
+    """
+    message_sender = MessageSender(descriptor, 0, sock, codec)
+    message_sender.connected = True
+    message_sender.send_message(payload, expect_response, callback)
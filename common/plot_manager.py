@@ -1,12 +1,179 @@
+import time
 import logging
+import threading
+import collections
+
+import numpy as np
 import matplotlib.pyplot as plt
 
+# render modes: every change is drawn right away, in the thread making it, or changes only mark
+# the plot dirty, and a timer of the GUI thread draws them at most max_fps times per second
+SYNC_RENDER = 'sync'
+DEFERRED_RENDER = 'deferred'
+DEFAULT_MAX_FPS = 20
+# share of the visible x range added past the latest point when the plot scrolls, and of the
+# y range around the data when it grows out of the limits, so that most frames can be blitted
+X_HEADROOM = 0.25
+Y_HEADROOM = 0.1
+
+
+class LineBuffer:
+    """
+    Latest points of a plot line, at most capacity of them, with x increasing.
+    The points are kept twice in arrays of size 2 * capacity, so that the window is always a
+    contiguous view, and appending is O(1) with no copies.
+    The minimum and maximum y in the window are tracked with monotonic deques, also in O(1).
+    The latest point only joins the deques when the next one is appended, so that its y can be updated
+    in O(1), as bars being built are.
+    """
+    def __init__(self, capacity):
+        """
+        :param capacity: maximum number of points kept
+        """
+        if capacity < 1:
+            raise ValueError('Invalid capacity %r' % capacity)
+        self.capacity = capacity
+        self.xs = np.zeros(2 * capacity)
+        self.ys = np.zeros(2 * capacity)
+        # start of the window in the arrays, and number of points in it
+        self.start = 0
+        self.size = 0
+        # total number of points appended, the sequence number of the next one
+        self.count = 0
+        # (sequence number, y) candidates for the minimum and the maximum of the window without the latest point
+        self.min_candidates = collections.deque()
+        self.max_candidates = collections.deque()
+        self.latest_y = None
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def x(self):
+        """x of the points in the window, oldest first, as a view"""
+        return self.xs[self.start:self.start + self.size]
+
+    @property
+    def y(self):
+        """y of the points in the window, oldest first, as a view"""
+        return self.ys[self.start:self.start + self.size]
+
+    @property
+    def latest(self):
+        """x of the latest point, None if there are none"""
+        return self.xs[self.start + self.size - 1] if self.size else None
+
+    def min(self):
+        if not self.size:
+            return None
+        return min(self.min_candidates[0][1], self.latest_y) if self.min_candidates else self.latest_y
+
+    def max(self):
+        if not self.size:
+            return None
+        return max(self.max_candidates[0][1], self.latest_y) if self.max_candidates else self.latest_y
+
+    def append(self, x, y):
+        """
+        Add a point after the latest one, the oldest point is dropped if the buffer is full.
+
+        :param x: x of the point, greater than the latest one
+        :param y: y of the point
+        """
+        if self.size:
+            self._track(self.count - 1, self.latest_y)
+        if self.size == self.capacity:
+            self.start = (self.start + 1) % self.capacity
+        else:
+            self.size += 1
+        pos = (self.start + self.size - 1) % self.capacity
+        self.xs[pos] = self.xs[pos + self.capacity] = x
+        self.ys[pos] = self.ys[pos + self.capacity] = y
+
+        self.latest_y = y
+        self.count += 1
+        oldest = self.count - self.size
+        for candidates in (self.min_candidates, self.max_candidates):
+            if candidates and candidates[0][0] < oldest:
+                candidates.popleft()
+
+    def _track(self, seq, y):
+        # values beaten by the new one can never be the extreme of the window again
+        while self.min_candidates and self.min_candidates[-1][1] >= y:
+            self.min_candidates.pop()
+        while self.max_candidates and self.max_candidates[-1][1] <= y:
+            self.max_candidates.pop()
+        self.min_candidates.append((seq, y))
+        self.max_candidates.append((seq, y))
+
+    def extend(self, xs, ys):
+        for x, y in zip(xs, ys):
+            self.append(x, y)
+
+    def update(self, x, y):
+        """
+        Set the y of a point in the window, inserting the point if there is none at x.
+        Appending a point or updating the latest one is O(1), otherwise the point is found in O(log n)
+        and the window is rebuilt in O(n).
+
+        :param x: x of the point, not older than the window
+        :param y: new y of the point
+        :return: False if x is older than the window, True otherwise
+        """
+        if not self.size or x > self.latest:
+            self.append(x, y)
+            return True
+        if x == self.latest:
+            pos = (self.start + self.size - 1) % self.capacity
+            self.ys[pos] = self.ys[pos + self.capacity] = y
+            self.latest_y = y
+            return True
+        xs = self.x
+        i = int(np.searchsorted(xs, x))
+        if i == 0 and x < xs[0]:
+            return False
+        if xs[i] == x:
+            pos = (self.start + i) % self.capacity
+            self.ys[pos] = self.ys[pos + self.capacity] = y
+            self._reset(xs.copy(), self.y.copy())
+        else:
+            self._reset(np.insert(xs, i, x), np.insert(self.y, i, y))
+        return True
+
+    def _reset(self, xs, ys):
+        self.start = 0
+        self.size = 0
+        self.min_candidates.clear()
+        self.max_candidates.clear()
+        self.latest_y = None
+        self.extend(xs[-self.capacity:].tolist(), ys[-self.capacity:].tolist())
+
 
 class PlotManager:
-    def __init__(self, max_elements, enabled=True   ):
+    """
+    Live plots of strategy data.
+
+    In SYNC_RENDER mode every change is drawn right away, and waits for the GUI.
+    In DEFERRED_RENDER mode adding data only updates the line buffers and marks the lines dirty,
+    so it never waits for drawing, and can be done from any thread: a timer of the figure canvas draws
+    the changes at most max_fps times per second, with blitting, i.e. redrawing only the lines of the
+    subplots that changed over a saved background. The whole figure is redrawn only when the axes
+    limits, the titles or the texts change.
+    The timer runs in the GUI event loop, see run_gui, in the main thread as GUI toolkits require:
+    the data must be handled by another thread, so that drawing never holds it up.
+    Lines, subplots and texts are meant to be created during setup, they wait for the current frame.
+    """
+    def __init__(self, max_elements, enabled=True, render_mode=SYNC_RENDER, max_fps=DEFAULT_MAX_FPS):
+        """
+        :param max_elements: maximum number of points kept and shown for each line
+        :param enabled: False to disable plotting, all the calls are ignored
+        :param render_mode: SYNC_RENDER or DEFERRED_RENDER, see class description
+        :param max_fps: maximum frames per second drawn in deferred mode
+        """
         self.logger = logging.getLogger('plot_manager')
 
         self.is_enabled = enabled
+        self.deferred = render_mode == DEFERRED_RENDER
 
         self.plot_lines = {}
         self.plot_data = {}
@@ -17,14 +184,36 @@ class PlotManager:
         else:
             plt.ioff()
 
+        # points kept for each line, older ones are dropped
         self.max_elements = max_elements
-        self.latest_tick = {}
 
         self.subplots = {}
         self.subplot_lines = {}
 
         self.texts = {}
 
+        # deferred rendering state
+        # data_lock guards the buffers and the dirty state, figure_lock the matplotlib objects
+        self.data_lock = threading.Lock()
+        self.figure_lock = threading.RLock()
+        self.dirty_lines = set()
+        self.dirty_texts = {}
+        self.full_redraw = True
+        self.dirty = threading.Event()
+        # backgrounds of the subplots, without the lines, for blitting
+        self.backgrounds = {}
+        # subplots whose limits were set by the renderer, instead of matplotlib autoscaling
+        self.scaled = set()
+        self.frame_interval = 1 / max_fps
+        self.frames = 0
+        self.full_redraws = 0
+        # canvas timer drawing the frames
+        self.renderer = None
+
+        if self.is_enabled and self.deferred:
+            self.fig.canvas.mpl_connect('resize_event', lambda event: self.mark_full_redraw())
+            self.start_renderer()
+
         self.logger.debug("Plot manager initialized")
 
     def add_line(self, subplot_id, line_id, x_data=[], y_data=[], line_width=1):
@@ -36,14 +225,23 @@ class PlotManager:
         if subplot_id not in self.subplots:
             self.logger.warning('Subplot %s does not exist' % subplot_id)
             return
-        self.plot_data[line_id] = [x_data, y_data]
-        self.plot_lines[line_id], = self.subplots[subplot_id].plot(
-            x_data,
-            y_data,
-            linewidth=line_width
-        )
-        self.subplot_lines[subplot_id].append(line_id)
-        self.latest_tick[line_id] = max(x_data)
+        data = LineBuffer(self.max_elements)
+        data.extend(x_data, y_data)
+        with self.figure_lock:
+            line, = self.subplots[subplot_id].plot(
+                data.x,
+                data.y,
+                linewidth=line_width,
+                # drawn over the background by the renderer
+                animated=self.deferred
+            )
+            with self.data_lock:
+                self.plot_data[line_id] = data
+                self.plot_lines[line_id] = line
+                self.subplot_lines[subplot_id].append(line_id)
+        if self.deferred:
+            self.mark_full_redraw()
+            return
         self.update_lims()
         self.refresh()
 
@@ -56,16 +254,18 @@ class PlotManager:
         if x_val < 0:
             self.logger.error('Invalid x value: %d' % x_val)
             return
-        if x_val not in self.plot_data[line_id][0]:
-            x_data = self.plot_data[line_id][0]
-            for i in range(0, x_data):
-                if x_data[i] < x_val:
-                    continue
-                x_data = x_data[:i] + x_val + x_data[i:]
-                break
-            self.plot_data[line_id][0] = x_data
-        self.plot_data[line_id][1][self.plot_data[line_id][0].index(x_val)] = new_y_val
-        self.plot_lines[line_id].set_ydata(self.plot_data[line_id][1])
+        data = self.plot_data[line_id]
+        with self.data_lock:
+            updated = data.update(x_val, new_y_val)
+            if updated and self.deferred:
+                self.dirty_lines.add(line_id)
+                self.dirty.set()
+        if not updated:
+            self.logger.error('x value %r is older than the plotted data' % x_val)
+            return
+        if self.deferred:
+            return
+        self.plot_lines[line_id].set_data(data.x, data.y)
         self.update_lims()
         self.refresh()
 
@@ -73,21 +273,32 @@ class PlotManager:
         if not self.is_enabled:
             return
         for subplot_id in self.subplots:
-            ymin, ymax = 1e10, -1
+            ymin, ymax = None, None
             for line_id in self.subplot_lines[subplot_id]:
+                data = self.plot_data[line_id]
+                if not len(data):
+                    continue
                 self.subplots[subplot_id].set_xlim([
-                    max(0, self.latest_tick[line_id]-self.max_elements),
-                    max(self.subplots[subplot_id].get_xlim()[1], self.latest_tick[line_id])
+                    max(0, data.latest-self.max_elements),
+                    max(self.subplots[subplot_id].get_xlim()[1], data.latest)
                 ])
-                ymin = min(ymin, min(self.plot_data[line_id][1][-self.max_elements:]))
-                ymax = max(ymax, max(self.plot_data[line_id][1][-self.max_elements:]))
-            self.subplots[subplot_id].set_ylim([ymin, ymax])
+                # extremes of the windows are tracked by the buffers
+                ymin = data.min() if ymin is None else min(ymin, data.min())
+                ymax = data.max() if ymax is None else max(ymax, data.max())
+            if ymin is not None:
+                if ymin == ymax:
+                    # flat lines, matplotlib would expand the limits with a warning
+                    ymin, ymax = ymin - 0.5, ymax + 0.5
+                self.subplots[subplot_id].set_ylim([ymin, ymax])
 
     def add_subplot(self, subplot_id, layout):
         if not self.is_enabled:
             return
-        self.subplots[subplot_id] = plt.subplot(layout)
-        self.subplot_lines[subplot_id] = []
+        with self.figure_lock:
+            subplot = plt.subplot(layout)
+            with self.data_lock:
+                self.subplots[subplot_id] = subplot
+                self.subplot_lines[subplot_id] = []
         self.refresh()
 
     def append_datapoint(self, subplot_id, x_value, y_data):
@@ -97,15 +308,20 @@ class PlotManager:
         if subplot_id not in self.subplots:
             self.logger.warning('Subplot %s does not exist' % subplot_id)
             return
-        for line_id in y_data:
-            if x_value <= self.latest_tick[line_id]:
-                self.logger.error('Can only append to the end of data: latest=%d, x=%d' % (self.latest_tick[line_id], x_value))
-                return
-            self.latest_tick[line_id] = x_value
-            self.plot_data[line_id][0].append(x_value)
-            self.plot_data[line_id][1].append(y_data[line_id])
-            self.plot_lines[line_id].set_xdata(self.plot_data[line_id][0])
-            self.plot_lines[line_id].set_ydata(self.plot_data[line_id][1])
+        with self.data_lock:
+            for line_id in y_data:
+                data = self.plot_data[line_id]
+                if len(data) and x_value <= data.latest:
+                    self.logger.error('Can only append to the end of data: latest=%d, x=%d' % (data.latest, x_value))
+                    return
+                data.append(x_value, y_data[line_id])
+                if self.deferred:
+                    self.dirty_lines.add(line_id)
+                else:
+                    self.plot_lines[line_id].set_data(data.x, data.y)
+        if self.deferred:
+            self.dirty.set()
+            return
         self.update_lims()
         self.refresh()
 
@@ -115,12 +331,16 @@ class PlotManager:
         if subplot_id not in self.subplots:
             self.logger.warning('Subplot %s does not exist' % subplot_id)
             return
-        self.subplots[subplot_id].set_title(subplot_title)
+        with self.figure_lock:
+            self.subplots[subplot_id].set_title(subplot_title)
         self.refresh()
 
     def refresh(self):
         if not self.is_enabled:
             return
+        if self.deferred:
+            self.mark_full_redraw()
+            return
         plt.draw()
         plt.pause(0.01)
 
@@ -130,7 +350,10 @@ class PlotManager:
         if text_id in self.texts:
             self.logger.error('Text %s already exists' % text_id)
             return
-        self.texts[text_id] = plt.gcf().text(x, y, text, fontsize=font_size)
+        with self.figure_lock:
+            self.texts[text_id] = self.fig.text(x, y, text, fontsize=font_size)
+        if self.deferred:
+            self.mark_full_redraw()
 
     def update_text(self, text_id, new_text):
         if not self.is_enabled:
@@ -138,9 +361,157 @@ class PlotManager:
         if text_id not in self.texts:
             self.logger.error('Text %s does not exist (list: %r)' % (text_id, [t for t in self.texts]))
             return
+        if self.deferred:
+            with self.data_lock:
+                self.dirty_texts[text_id] = new_text
+            self.dirty.set()
+            return
         self.texts[text_id].set_text(new_text)
 
     def freeze_plot(self):
         if self.is_enabled:
+            self.stop_renderer()
+            if self.deferred:
+                self.render()
             plt.ioff()
             plt.show()
+
+    ##################################
+    #       DEFERRED RENDERING       #
+    ##################################
+
+    def mark_full_redraw(self):
+        """Have the next frame redraw the whole figure"""
+        with self.data_lock:
+            self.full_redraw = True
+        self.dirty.set()
+
+    def start_renderer(self):
+        """Start the canvas timer drawing the frames of the deferred mode, see class description"""
+        if self.renderer is not None:
+            return
+        self.renderer = self.fig.canvas.new_timer(interval=max(1, int(self.frame_interval * 1000)))
+        self.renderer.add_callback(self.render_if_dirty)
+        self.renderer.start()
+
+    def stop_renderer(self):
+        """Stop the canvas timer, changes are not drawn anymore until render is called"""
+        if self.renderer is None:
+            return
+        self.renderer.stop()
+        self.renderer = None
+
+    def run_gui(self, done):
+        """
+        Run the GUI event loop, and with it the canvas timer drawing the frames, until done.
+        Must be called by the main thread, while the data is handled by another one.
+
+        :param done: function returning True when the loop must stop, checked every frame
+        """
+        while not done():
+            if self.is_enabled:
+                self.fig.canvas.start_event_loop(self.frame_interval)
+            else:
+                time.sleep(self.frame_interval)
+
+    def render_if_dirty(self):
+        """Draw a frame if anything changed since the last one, called by the canvas timer"""
+        if not self.dirty.is_set():
+            return
+        try:
+            self.render()
+        except Exception as e:
+            self.logger.error('Could not render plot: %s' % e)
+
+    def _snapshot(self):
+        """
+        Take the changes made since the last frame.
+
+        :return: (full redraw, {line_id: (x, y)} of the dirty lines, {text_id: text}, {subplot_id: (xmin, xmax, ymin, ymax)})
+        """
+        with self.data_lock:
+            self.dirty.clear()
+            full = self.full_redraw
+            line_ids = set(self.plot_data) if full else self.dirty_lines
+            lines = {line_id: (self.plot_data[line_id].x.copy(), self.plot_data[line_id].y.copy())
+                     for line_id in line_ids}
+            texts = self.dirty_texts
+            bounds = {}
+            for subplot_id, line_ids in self.subplot_lines.items():
+                windows = [self.plot_data[line_id] for line_id in line_ids if len(self.plot_data[line_id])]
+                if windows:
+                    bounds[subplot_id] = (min(data.x[0] for data in windows), max(data.latest for data in windows),
+                                          min(data.min() for data in windows), max(data.max() for data in windows))
+            self.full_redraw = False
+            self.dirty_lines = set()
+            self.dirty_texts = {}
+        return full, lines, texts, bounds
+
+    def _rescale(self, subplot_id, bounds):
+        """
+        Move the limits of a subplot if its data does not fit anymore, with headroom.
+
+        :return: True if the limits changed
+        """
+        subplot = self.subplots[subplot_id]
+        xmin, xmax, ymin, ymax = bounds
+        changed = subplot_id not in self.scaled
+        self.scaled.add(subplot_id)
+        left, right = subplot.get_xlim()
+        if changed or xmax > right or xmax < left:
+            span = max(self.max_elements, 1)
+            subplot.set_xlim([max(0, xmax - span), xmax + span * X_HEADROOM])
+            changed = True
+        bottom, top = subplot.get_ylim()
+        if changed or ymin < bottom or ymax > top:
+            pad = (ymax - ymin) * Y_HEADROOM or 0.5
+            subplot.set_ylim([ymin - pad, ymax + pad])
+            changed = True
+        return changed
+
+    def render(self):
+        """
+        Draw the changes made since the last frame, in the GUI thread.
+        Blits the lines of the subplots that changed, unless the whole figure must be redrawn.
+        """
+        full, lines, texts, bounds = self._snapshot()
+        with self.figure_lock:
+            for line_id, (x, y) in lines.items():
+                self.plot_lines[line_id].set_data(x, y)
+            for text_id, text in texts.items():
+                self.texts[text_id].set_text(text)
+            for subplot_id, subplot_bounds in bounds.items():
+                full |= self._rescale(subplot_id, subplot_bounds)
+            full |= bool(texts) or not self.backgrounds
+
+            canvas = self.fig.canvas
+            if full:
+                # background without the lines, which are animated
+                canvas.draw()
+                self.backgrounds = {subplot_id: canvas.copy_from_bbox(subplot.bbox)
+                                    for subplot_id, subplot in self.subplots.items()}
+                changed = list(self.subplots)
+                self.full_redraws += 1
+            else:
+                changed = {subplot_id for subplot_id, line_ids in self.subplot_lines.items()
+                           if any(line_id in lines for line_id in line_ids)}
+                for subplot_id in changed:
+                    canvas.restore_region(self.backgrounds[subplot_id])
+
+            # restoring the background clears every line of the subplot, all of them are redrawn
+            for subplot_id in changed:
+                subplot = self.subplots[subplot_id]
+                for line_id in self.subplot_lines[subplot_id]:
+                    subplot.draw_artist(self.plot_lines[line_id])
+                canvas.blit(subplot.bbox)
+            canvas.flush_events()
+            self.frames += 1
+
+    def render_metrics(self):
+        """
+        :return: dict with the number of frames drawn, and of the ones that redrew the whole figure
+        """
+        return {
+            'frames': self.frames,
+            'full_redraws': self.full_redraws
+        }
@@ -1,24 +1,31 @@
-import json
+import socket
+import asyncio
+import inspect
 import logging
 import threading
 
-from common.messaging import message_to_socket, log_result
-
-BUFFER_SIZE = 1024
+from common.framing import recv_frame
+from common.codec import JSON_CODEC, detect_codec
+from common.messaging import message_to_socket, log_result, stream_responses
 
 
 class RequestHandler (threading.Thread):
     """
-    Handles the assigned incoming request, then exits.
+    Handles the requests coming from a single connection, until the other end closes it.
     Runs in its own thread, to not block other stuff.
 
     Request is composed of:
         query: ID of the request (string)
         data: json object with request-specific data
+        id: optional correlation ID, copied into the response so the requester
+            can match it with the request
 
     Response message status:
         SUCCESS : request executed successfully, has data field
         FAIL : request could not be executed for some reason, specified in message field
+
+    Query handlers returning a generator stream their response: every yielded response is sent
+    as soon as it is produced, flagged with more, see stream_responses.
     """
     def __init__(self, client_socket):
         """
@@ -31,19 +38,90 @@ class RequestHandler (threading.Thread):
         self.logger.info('Handling request!')
 
         self.socket = client_socket
+        self.codec = JSON_CODEC
 
         self.query_handlers = {}
 
     def run(self):
         """
-        Read the request, decide which handler to use, and call it.
-        If a query is not recognized, a FAIL is sent back.
+        Read requests from the connection and handle them in order, until it gets closed.
+        """
+        self.logger.debug('Serving connection')
+
+        while self.serve_one():
+            pass
+
+        self.socket.close()
+
+    def read_request(self):
+        """
+        Read the next request from the connection.
+        Responses are encoded with the same codec as the last request.
+
+        :return: the decoded request, an empty dict if it could not be decoded,
+                None if the connection was closed
+        """
+        try:
+            frame = recv_frame(self.socket)
+            self.codec = detect_codec(frame)
+            return self.codec.decode(frame)
+        except (ConnectionError, socket.timeout) as e:
+            self.logger.debug('Connection closed: %s' % e)
+            return None
+        except ValueError as e:
+            self.logger.error('Could not decode request: %s' % e)
+            return {}
+
+    def serve_one(self):
+        """
+        Read and handle a single request.
+        If the query handler fails, the request is answered with a FAIL and the connection kept.
+
+        :return: False if the connection was closed, or the response could not be sent, True otherwise
+        """
+        request = self.read_request()
+        if request is None:
+            return False
+        if not request:
+            return True
+        try:
+            self.handle_request(request)
+        except Exception as e:
+            self.logger.exception('Could not handle %s: %s' % (request.get('query'), e))
+            try:
+                self.respond(request, {
+                    'status': 'FAIL',
+                    'message': 'Could not handle request: %s' % e
+                })
+            except OSError as e:
+                self.logger.error('Could not respond: %s' % e)
+                return False
+        return True
+
+    def reject_one(self, message):
         """
-        self.logger.debug('Handling request')
+        Read a single request and answer it with a FAIL, without handling it.
 
-        # read request
-        request = json.loads(self.socket.recv(BUFFER_SIZE).decode())
+        :param message: reason of the refusal
+        :return: False if the connection was closed, True otherwise
+        """
+        request = self.read_request()
+        if request is None:
+            return False
+        self.logger.warning('Rejecting %s: %s' % (request.get('query'), message))
+        self.respond(request, {
+            'status': 'FAIL',
+            'message': message
+        })
+        return True
+
+    def handle_request(self, request):
+        """
+        Decide which handler to use for the request, and call it.
+        If a query is not recognized, a FAIL is sent back.
 
+        :param request: decoded request
+        """
         self.logger.debug('Received %r' % request)
 
         # decide which handler function to call
@@ -54,18 +132,37 @@ class RequestHandler (threading.Thread):
                 'status': 'FAIL',
                 'message': 'API query not defined'
             }
-            message_to_socket(self.socket,
-                              'query_origin',
-                              resp,
-                              False,
-                              lambda r: log_result(r))
+            self.respond(request, resp)
         else:
             self.logger.info('Handling %s' % query)
             response = self.query_handlers[query](request['data'])
-            if response is not None:
-                message_to_socket(self.socket,
-                                  'query_origin',
-                                  response,
-                                  False,
-                                  lambda r: log_result(r))
-        self.socket.close()
+            # coroutine handlers, written for the asyncio server, are run to completion here
+            if inspect.isawaitable(response):
+                response = asyncio.run(response)
+            if inspect.isgenerator(response):
+                for message in stream_responses(response, self.logger):
+                    self.respond(request, message)
+            elif response is not None:
+                self.respond(request, response)
+
+    def respond(self, request, response):
+        """
+        Send the response to a request, tagged with the request ID if it had one.
+
+        :param request: request being answered
+        :param response: response to send
+        :raises ConnectionError: if the response could not be sent, the connection is unusable
+        """
+        if 'id' in request:
+            response = dict(response, id=request['id'])
+        results = []
+        message_to_socket(self.socket,
+                          'query_origin',
+                          response,
+                          False,
+                          results.append,
+                          self.codec)
+        log_result(results[0], self.logger)
+        if results[0]['status'] == 'FAIL':
+            # the other end is gone, or got part of the frame only
+            raise ConnectionError(results[0]['message'])
@@ -0,0 +1,184 @@
+import time
+import heapq
+import logging
+import itertools
+import threading
+import collections
+
+
+"""
+Run loop of the main thread of the components.
+
+A single thread runs all the callbacks, one at a time, in order: the ones posted with call_soon,
+from any thread, as soon as possible, and the timers when they are due. In between the thread
+sleeps on a condition, until the next timer is due or a callback is posted, so an idle component
+uses no CPU and reacts to events immediately.
+"""
+
+
+class Timer:
+    """
+    Callback scheduled on a run loop, see RunLoop.call_later and RunLoop.call_every.
+    """
+    def __init__(self, deadline, interval, callback, args):
+        self.deadline = deadline
+        # seconds between the runs of periodic timers, None for one-off timers
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """Stop the timer, it is not run anymore"""
+        self.cancelled = True
+
+
+class RunLoop:
+    """
+    Runs callbacks and timers in the thread calling run, see module description.
+    """
+    def __init__(self, name='run_loop'):
+        """
+        :param name: name of the logger of the loop
+        """
+        self.logger = logging.getLogger(name)
+
+        self.condition = threading.Condition()
+        # callbacks to run as soon as possible, (callback, args)
+        self.ready = collections.deque()
+        # heap of (deadline, sequence number, Timer)
+        self.timers = []
+        self.sequence = itertools.count()
+        # callbacks run when the loop stops
+        self.shutdown_callbacks = []
+
+        self.running = False
+        self.stopping = False
+        self.thread = None
+
+    def call_soon(self, callback, *args):
+        """
+        Run a callback in the loop as soon as possible, after the ones already posted.
+        Safe to call from any thread, wakes the loop up.
+
+        :param callback: function to call
+        :param args: arguments of the call
+        """
+        with self.condition:
+            self.ready.append((callback, args))
+            self.condition.notify()
+
+    def call_later(self, delay, callback, *args):
+        """
+        Run a callback in the loop once, after a delay. Safe to call from any thread.
+
+        :param delay: seconds before the call
+        :param callback: function to call
+        :param args: arguments of the call
+        :return: Timer of the call, to cancel it
+        """
+        return self._schedule(Timer(time.monotonic() + delay, None, callback, args))
+
+    def call_every(self, interval, callback, *args):
+        """
+        Run a callback in the loop periodically, the first time after interval.
+        Runs missed while the loop was busy are skipped, not made up for.
+        Safe to call from any thread.
+
+        :param interval: seconds between the calls
+        :param callback: function to call
+        :param args: arguments of the calls
+        :return: Timer of the calls, to cancel them
+        """
+        return self._schedule(Timer(time.monotonic() + interval, interval, callback, args))
+
+    def _schedule(self, timer):
+        with self.condition:
+            heapq.heappush(self.timers, (timer.deadline, next(self.sequence), timer))
+            self.condition.notify()
+        return timer
+
+    def add_shutdown_callback(self, callback, *args):
+        """
+        Run a callback in the loop thread when the loop stops, e.g. to release resources.
+
+        :param callback: function to call
+        :param args: arguments of the call
+        """
+        self.shutdown_callbacks.append((callback, args))
+
+    def pending(self):
+        """
+        :return: number of callbacks waiting to run, timers excluded
+        """
+        return len(self.ready)
+
+    def _run_callback(self, callback, args):
+        try:
+            callback(*args)
+        except Exception as e:
+            self.logger.error('Error in %s: %s' % (getattr(callback, '__name__', callback), e))
+
+    def run(self):
+        """
+        Run the loop in the calling thread, until stop. The callbacks already posted are run
+        before stopping, then the shutdown callbacks.
+        """
+        self.thread = threading.current_thread()
+        self.running = True
+        try:
+            while True:
+                with self.condition:
+                    while True:
+                        now = time.monotonic()
+                        timer = None
+                        if self.timers and self.timers[0][0] <= now and not self.stopping:
+                            _, _, timer = heapq.heappop(self.timers)
+                        # callbacks posted so far, run before the next timer
+                        batch = len(self.ready)
+                        if timer is not None or batch:
+                            break
+                        if self.stopping:
+                            return
+                        self.condition.wait(self.timers[0][0] - now if self.timers else None)
+
+                # at most one due timer, then the posted callbacks: neither can starve the other
+                if timer is not None and not timer.cancelled:
+                    self._run_callback(timer.callback, timer.args)
+                    if timer.interval is not None and not timer.cancelled:
+                        # runs missed, also while the callback ran, are skipped
+                        timer.deadline = max(timer.deadline + timer.interval, time.monotonic())
+                        self._schedule(timer)
+                for _ in range(batch):
+                    with self.condition:
+                        callback, args = self.ready.popleft()
+                    self._run_callback(callback, args)
+        finally:
+            self.running = False
+            for callback, args in self.shutdown_callbacks:
+                self._run_callback(callback, args)
+
+    def start(self, name=None):
+        """
+        Run the loop in a new thread.
+
+        :param name: name of the thread
+        """
+        self.thread = threading.Thread(target=self.run, name=name)
+        self.thread.start()
+        return self.thread
+
+    def stop(self, wait=False):
+        """
+        Stop the loop, once the callbacks already posted and the running one are done.
+        Timers are not run anymore.
+        Safe to call from any thread, including the loop itself.
+
+        :param wait: True to wait for the loop to stop, ignored in the loop thread
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        thread = self.thread
+        if wait and thread is not None and thread is not threading.current_thread():
+            thread.join()
@@ -0,0 +1,165 @@
+import os
+import sys
+import struct
+import logging
+
+from multiprocessing import shared_memory, resource_tracker
+
+
+"""
+Single writer, many readers ring buffer in shared memory, used to deliver feed messages
+between components running on the same host without going through a socket.
+
+The segment starts with a header holding the number of messages written so far, the
+geometry of the ring and a random ID telling apart the segments created under the same
+name, followed by fixed size slots. Each slot is protected by a seqlock:
+its sequence number is odd while the writer is filling it, and equal to 2 * (index + 1)
+once the message with that index is complete. Readers copy the payload and check that
+the sequence number did not change meanwhile, so they never see torn messages and never
+block the writer. A reader that falls more than a whole ring behind skips the messages
+that were overwritten.
+"""
+
+# header: messages written, number of slots, payload capacity of a slot, ID of the segment
+RING_HEADER = struct.Struct('=QIIQ')
+# first field of the header, the only one that changes
+WRITTEN = struct.Struct('=Q')
+# slot header: sequence number, payload length
+SLOT_HEADER = struct.Struct('=QI')
+
+# ring defaults
+DEFAULT_SLOTS = 4096
+DEFAULT_SLOT_SIZE = 4096
+
+
+class ShmRing:
+    """
+    Shared memory ring buffer, see module description.
+    Created by the writer, readers attach to it by name.
+    """
+    def __init__(self, name, create=False, slots=DEFAULT_SLOTS, slot_size=DEFAULT_SLOT_SIZE):
+        """
+        Create or attach to a ring.
+
+        :param name: name of the shared memory segment
+        :param create: True to create the segment, as the writer
+        :param slots: number of slots, used only when creating
+        :param slot_size: maximum payload size of a message, used only when creating
+        """
+        self.logger = logging.getLogger('shm_ring_%s' % name)
+        self.name = name
+        self.owner = create
+
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True,
+                                                  size=RING_HEADER.size + slots * (SLOT_HEADER.size + slot_size))
+            ring_id = int.from_bytes(os.urandom(8), 'little')
+            RING_HEADER.pack_into(self.shm.buf, 0, 0, slots, slot_size, ring_id)
+        else:
+            # only the writer must unlink the segment, not the tracker of the reader process
+            if sys.version_info >= (3, 13):
+                self.shm = shared_memory.SharedMemory(name=name, track=False)
+            else:
+                self.shm = shared_memory.SharedMemory(name=name)
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+            _, slots, slot_size, ring_id = RING_HEADER.unpack_from(self.shm.buf, 0)
+
+        self.buf = self.shm.buf
+        # differs from the one of a ring with the same name, created after this one was destroyed
+        self.ring_id = ring_id
+        self.slots = slots
+        self.slot_size = slot_size
+        self.stride = SLOT_HEADER.size + slot_size
+
+        # writer: index of the next message, reader: index of the next message to read
+        (self.index,) = WRITTEN.unpack_from(self.buf, 0)
+
+        self.written = 0
+        self.read = 0
+        self.overruns = 0
+
+    def _slot_offset(self, index):
+        return RING_HEADER.size + (index % self.slots) * self.stride
+
+    def write(self, payload):
+        """
+        Write a message, overwriting the oldest one if the ring is full.
+        Must only be called by the writer, from one thread at a time.
+
+        :param payload: bytes-like message
+        :return: False if the message does not fit in a slot, True otherwise
+        """
+        if len(payload) > self.slot_size:
+            return False
+
+        index = self.index
+        offset = self._slot_offset(index)
+        # mark the slot as being written, then fill it and publish it
+        SLOT_HEADER.pack_into(self.buf, offset, 2 * index + 1, len(payload))
+        start = offset + SLOT_HEADER.size
+        self.buf[start:start + len(payload)] = payload
+        SLOT_HEADER.pack_into(self.buf, offset, 2 * (index + 1), len(payload))
+
+        self.index = index + 1
+        WRITTEN.pack_into(self.buf, 0, self.index)
+        self.written += 1
+        return True
+
+    def read_available(self, max_messages=None):
+        """
+        Read the messages written since the last call.
+
+        :param max_messages: maximum number of messages to read, None for all of them
+        :return: list of bytes payloads, in order
+        """
+        messages = []
+        (written,) = WRITTEN.unpack_from(self.buf, 0)
+        while self.index < written and (max_messages is None or len(messages) < max_messages):
+            if written - self.index > self.slots:
+                # overwritten before being read
+                skipped = written - self.slots - self.index
+                self.overruns += skipped
+                self.index = written - self.slots
+
+            payload = self._read_slot(self.index)
+            if payload is None:
+                # overwritten while reading
+                self.overruns += 1
+            else:
+                messages.append(payload)
+            self.index += 1
+
+        self.read += len(messages)
+        return messages
+
+    def _read_slot(self, index):
+        offset = self._slot_offset(index)
+        expected = 2 * (index + 1)
+        seq, length = SLOT_HEADER.unpack_from(self.buf, offset)
+        if seq != expected:
+            return None
+        start = offset + SLOT_HEADER.size
+        payload = bytes(self.buf[start:start + length])
+        if SLOT_HEADER.unpack_from(self.buf, offset)[0] != expected:
+            return None
+        return payload
+
+    def metrics(self):
+        return {
+            'name': self.name,
+            'slots': self.slots,
+            'slot_size': self.slot_size,
+            'written': self.written,
+            'read': self.read,
+            'overruns': self.overruns
+        }
+
+    def close(self):
+        """Detach from the ring, the writer also destroys it"""
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
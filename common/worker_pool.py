@@ -0,0 +1,84 @@
+import queue
+import logging
+import threading
+
+
+class WorkerPool:
+    """
+    Fixed-size pool of worker threads, fed by a bounded queue of tasks.
+
+    Unlike spawning a thread per task, the number of threads never grows with the load:
+    when the queue is full new tasks are refused, and it is up to the caller to tell
+    the requester to back off.
+    """
+    def __init__(self, name, max_workers, max_queue_len):
+        """
+        Initialize the pool and start its workers.
+
+        :param name: name of the pool, used for logging and thread names
+        :param max_workers: number of worker threads
+        :param max_queue_len: maximum number of tasks waiting for a worker
+        """
+        self.logger = logging.getLogger('worker_pool_%s' % name)
+
+        self.max_workers = max_workers
+        self.tasks = queue.Queue(max_queue_len)
+
+        self.lock = threading.Lock()
+        self.active_workers = 0
+        self.completed = 0
+        self.rejected = 0
+
+        self.workers = []
+        for i in range(max_workers):
+            worker = threading.Thread(target=self._work, name='%s_worker_%d' % (name, i), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, fn, *args):
+        """
+        Queue a task for execution, without blocking.
+
+        :param fn: function to call
+        :param args: arguments of the function
+        :return: True if the task was queued, False if the queue is full
+        """
+        try:
+            self.tasks.put_nowait((fn, args))
+            return True
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            return False
+
+    def _work(self):
+        while True:
+            fn, args = self.tasks.get()
+            with self.lock:
+                self.active_workers += 1
+            try:
+                fn(*args)
+            except Exception as e:
+                self.logger.exception('Task failed: %s' % e)
+            finally:
+                with self.lock:
+                    self.active_workers -= 1
+                    self.completed += 1
+
+    @property
+    def queue_depth(self):
+        return self.tasks.qsize()
+
+    def metrics(self):
+        """
+        :return: dict with the current load of the pool
+        """
+        with self.lock:
+            return {
+                'max_workers': self.max_workers,
+                'active_workers': self.active_workers,
+                'queue_depth': self.tasks.qsize(),
+                'max_queue_len': self.tasks.maxsize,
+                'completed': self.completed,
+                'rejected': self.rejected
+            }
@@ -0,0 +1,252 @@
+import time
+import logging
+import threading
+import concurrent.futures
+
+import numpy as np
+
+from market_interface.tick_storage import TIMESTAMP
+
+
+"""
+Backfill of the persistent tick history of a market interface.
+
+The ranges missing from the storage are found by looking for stretches without ticks longer than
+max_gap, that were not already backfilled. They are split in requests of at most max_span seconds,
+fetched concurrently from a Fetcher by a bounded pool of threads, under a shared rate limit, and
+merged into the storage as they complete. Ticks already stored are never written twice, so running
+a backfill again, or over a range that was partly filled meanwhile, is harmless.
+"""
+
+# backfill defaults
+DEFAULT_WORKERS = 4
+# requests per second, and maximum burst of requests, allowed by the rate limiter
+DEFAULT_RATE = 5
+DEFAULT_BURST = 5
+# seconds without ticks considered a gap in the history
+DEFAULT_MAX_GAP = 60
+# maximum seconds of history requested at once
+DEFAULT_MAX_SPAN = 3600
+
+
+class Fetcher:
+    """
+    Source of historical ticks, e.g. the REST API of an exchange.
+    Market interfaces supporting backfill provide their own subclass, see MarketInterface.get_fetcher.
+    """
+    def fetch(self, symbol, start, end):
+        """
+        Get the ticks of a symbol in a time range. Called by many threads at the same time.
+
+        :param symbol: requested symbol
+        :param start: lower bound of the timestamps, included
+        :param end: upper bound of the timestamps, included
+        :return: dict of columns, the timestamps and one for each field, None if the request failed
+        """
+        pass
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter, shared by the fetching threads.
+    """
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        """
+        :param rate: tokens added per second
+        :param burst: maximum number of tokens available at once
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, waiting for one to be available"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def subtract(ranges, covered):
+    """
+    :param ranges: list of (start, end) ranges
+    :param covered: sorted, disjoint list of [start, end] ranges
+    :return: the parts of the ranges not in covered
+    """
+    result = []
+    for start, end in ranges:
+        for lo, hi in covered:
+            if hi <= start or lo >= end:
+                continue
+            if lo > start:
+                result.append((start, lo))
+            start = max(start, hi)
+            if start >= end:
+                break
+        if start < end:
+            result.append((start, end))
+    return result
+
+
+def find_gaps(timestamps, start, end, max_gap, covered=()):
+    """
+    Find the missing parts of a time range.
+
+    :param timestamps: sorted timestamps of the stored ticks in the range
+    :param start: start of the range
+    :param end: end of the range
+    :param max_gap: seconds without ticks considered a gap
+    :param covered: sorted, disjoint [start, end] ranges known to be complete
+    :return: list of (start, end) gaps
+    """
+    edges = np.concatenate([[start], timestamps, [end]])
+    holes = np.flatnonzero(np.diff(edges) > max_gap)
+    return subtract([(float(edges[i]), float(edges[i + 1])) for i in holes], covered)
+
+
+def split(ranges, max_span):
+    """
+    :param ranges: list of (start, end) ranges
+    :param max_span: maximum length of a range
+    :return: the ranges, split in consecutive ranges of at most max_span
+    """
+    result = []
+    for start, end in ranges:
+        while end - start > max_span:
+            result.append((start, start + max_span))
+            start += max_span
+        result.append((start, end))
+    return result
+
+
+class Backfiller:
+    """
+    Fills the gaps of the persistent tick history, see module description.
+    """
+    def __init__(self, storage, fetcher, workers=DEFAULT_WORKERS, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 max_gap=DEFAULT_MAX_GAP, max_span=DEFAULT_MAX_SPAN):
+        """
+        Initialize backfiller.
+
+        :param storage: TickStorage to fill
+        :param fetcher: Fetcher of the missing ticks
+        :param workers: maximum number of concurrent requests
+        :param rate: maximum requests per second
+        :param burst: maximum burst of requests
+        :param max_gap: seconds without ticks considered a gap
+        :param max_span: maximum seconds of history requested at once
+        """
+        self.logger = logging.getLogger('backfill')
+
+        self.storage = storage
+        self.fetcher = fetcher
+        self.limiter = RateLimiter(rate, burst)
+        self.max_gap = max_gap
+        self.max_span = max_span
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='backfill')
+
+        # a symbol is backfilled by one caller at a time, the others wait and find no gaps left
+        self.symbol_locks = {}
+        self.lock = threading.Lock()
+
+        self.requests = 0
+        self.failures = 0
+        self.ticks_written = 0
+        self.dropped = 0
+
+    def gaps(self, symbol, start, end):
+        """
+        :param symbol: symbol to check
+        :param start: start of the time range
+        :param end: end of the time range
+        :return: list of (start, end) ranges to fetch
+        """
+        ticks = self.storage.range(symbol, start, end)
+        timestamps = ticks[TIMESTAMP] if ticks is not None else np.empty(0)
+        return split(find_gaps(timestamps, start, end, self.max_gap, self.storage.coverage(symbol)), self.max_span)
+
+    def _fetch(self, symbol, start, end):
+        self.limiter.acquire()
+        return self.fetcher.fetch(symbol, start, end)
+
+    def backfill(self, symbol, start, end):
+        """
+        Fill the gaps of a symbol in a time range, blocking until done.
+        Ranges whose request failed are left missing, and retried by the next backfill.
+
+        :param symbol: symbol to backfill
+        :param start: start of the time range
+        :param end: end of the time range
+        :return: number of ticks added to the storage
+        """
+        with self.lock:
+            symbol_lock = self.symbol_locks.setdefault(symbol, threading.Lock())
+
+        with symbol_lock:
+            gaps = self.gaps(symbol, start, end)
+            if not gaps:
+                return 0
+            self.logger.info('Backfilling %d ranges of %s' % (len(gaps), symbol))
+
+            futures = {self.executor.submit(self._fetch, symbol, lo, hi): (lo, hi) for lo, hi in gaps}
+            added = 0
+            for future in concurrent.futures.as_completed(futures):
+                lo, hi = futures[future]
+                try:
+                    columns = future.result()
+                except Exception as e:
+                    columns = None
+                    self.logger.error('Could not fetch %s from %f to %f: %s' % (symbol, lo, hi, e))
+                with self.lock:
+                    self.requests += 1
+                    self.failures += columns is None
+                if columns is None:
+                    continue
+                added += self.merge(symbol, lo, hi, columns)
+            return added
+
+    def merge(self, symbol, start, end, columns):
+        """
+        Write the fetched ticks missing from the storage, and mark the range as complete.
+        Ticks with the timestamp of a stored tick, or of another fetched tick, are dropped.
+
+        :param symbol: symbol of the ticks
+        :param start: start of the fetched range
+        :param end: end of the fetched range
+        :param columns: dict of fetched columns
+        :return: number of ticks written
+        """
+        timestamps = np.asarray(columns[TIMESTAMP], dtype=float)
+        keep = np.zeros(len(timestamps), dtype=bool)
+        keep[np.unique(timestamps, return_index=True)[1]] = True
+        keep &= (timestamps >= start) & (timestamps <= end)
+        stored = self.storage.range(symbol, start, end)
+        if stored is not None:
+            keep &= ~np.isin(timestamps, stored[TIMESTAMP])
+
+        written = self.storage.write(symbol, {name: np.asarray(column)[keep] for name, column in columns.items()})
+        self.storage.add_coverage(symbol, start, end)
+        with self.lock:
+            self.ticks_written += written
+            self.dropped += len(timestamps) - written
+        return written
+
+    def metrics(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'failures': self.failures,
+                'ticks_written': self.ticks_written,
+                'dropped': self.dropped
+            }
+
+    def stop(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,121 @@
+import math
+
+
+"""
+Server-side aggregation of ticks into OHLCV bars.
+
+Each bar covers granularity seconds, aligned on multiples of granularity since the epoch.
+Bars are built incrementally, one tick at a time, by a single BarAggregator per symbol and
+granularity, whose bars are shared by all the subscribers to them.
+A bar is complete when the first tick after its end arrives.
+"""
+
+# units accepted in granularities, e.g. '5m'
+GRANULARITY_UNITS = {
+    's': 1,
+    'm': 60,
+    'h': 3600,
+    'd': 86400
+}
+
+# tick fields aggregated by default
+DEFAULT_PRICE_FIELD = 'value'
+DEFAULT_VOLUME_FIELD = 'volume'
+
+
+def parse_granularity(granularity):
+    """
+    :param granularity: seconds, or string with a unit, e.g. 30, '1s', '5m', '1h'
+    :return: granularity in seconds
+    :raise ValueError: if the granularity is not valid
+    """
+    if isinstance(granularity, str) and granularity[-1:] in GRANULARITY_UNITS:
+        seconds = float(granularity[:-1]) * GRANULARITY_UNITS[granularity[-1]]
+    else:
+        seconds = float(granularity)
+    if not seconds > 0 or math.isinf(seconds):
+        raise ValueError('Invalid granularity %r' % granularity)
+    return int(seconds) if seconds == int(seconds) else seconds
+
+
+class BarAggregator:
+    """
+    Builds the OHLCV bars of a symbol over one granularity.
+    Not thread-safe, callers serialize the updates.
+    """
+    def __init__(self, symbol, granularity, price_field=DEFAULT_PRICE_FIELD, volume_field=DEFAULT_VOLUME_FIELD):
+        """
+        Initialize aggregator.
+
+        :param symbol: aggregated symbol
+        :param granularity: seconds covered by each bar
+        :param price_field: tick field holding the price
+        :param volume_field: tick field holding the traded volume, counted as 0 if missing
+        """
+        self.symbol = symbol
+        self.granularity = granularity
+        self.price_field = price_field
+        self.volume_field = volume_field
+
+        # bar being built, and the latest complete one
+        self.current = None
+        self.last = None
+
+    def bar_start(self, timestamp):
+        """
+        :param timestamp: time of a tick
+        :return: start time of the bar containing it
+        """
+        return timestamp - timestamp % self.granularity
+
+    def update(self, timestamp, data):
+        """
+        Add a tick to the bars. Ticks older than the current bar are ignored.
+
+        :param timestamp: time of the tick
+        :param data: dict of tick fields, ticks without the price field are ignored
+        :return: the bar completed by the tick, None if the tick falls in the current bar
+        """
+        price = data.get(self.price_field)
+        if price is None:
+            return None
+        volume = data.get(self.volume_field, 0)
+        start = self.bar_start(timestamp)
+
+        completed = None
+        bar = self.current
+        if bar is not None and start < bar['timestamp']:
+            return None
+        if bar is not None and start > bar['timestamp']:
+            completed = dict(bar, complete=True)
+            self.last = completed
+            bar = None
+
+        if bar is None:
+            self.current = {
+                'symbol': self.symbol,
+                'granularity': self.granularity,
+                'timestamp': start,
+                'open': price,
+                'high': price,
+                'low': price,
+                'close': price,
+                'volume': volume,
+                'count': 1,
+                'complete': False
+            }
+        else:
+            if price > bar['high']:
+                bar['high'] = price
+            if price < bar['low']:
+                bar['low'] = price
+            bar['close'] = price
+            bar['volume'] += volume
+            bar['count'] += 1
+        return completed
+
+    def current_bar(self):
+        """
+        :return: copy of the bar being built, None if there is none
+        """
+        return dict(self.current) if self.current is not None else None
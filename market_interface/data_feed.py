@@ -1,47 +1,803 @@
+import re
+import math
+import functools
 import time
+import heapq
 import logging
+import itertools
+import threading
+import collections
 
-from common.messaging import MessageSender
+from common.codec import compress
+from common.messaging import Connection, get_connection, connection_pool
+from common.shm_ring import ShmRing
+from common.worker_pool import WorkerPool
 
+# feed scheduler defaults
+DEFAULT_SENDER_WORKERS = 4
+DEFAULT_SEND_QUEUE_LEN = 1024
+# shortest interval between two messages of the same feed, in seconds
+MIN_FEED_INTERVAL = 0.001
 
-def feed_callback(interface, sub_handle, resp, logger):
+# feed modes
+# poll: get_symbol_data is sent every frequency seconds
+# event: updates published by the interface are sent right away, at most one every frequency seconds
+POLL_FEED = 'poll'
+EVENT_FEED = 'event'
+FEED_MODES = [POLL_FEED, EVENT_FEED]
+
+# policies of the subscriber queues, applied when a subscriber falls behind
+# conflate: only the latest message of each feed is kept
+# drop_oldest: the oldest message is dropped when the queue is full
+# disconnect: as drop_oldest, and the subscriber is disconnected when lagging more than disconnect_after seconds
+CONFLATE = 'conflate'
+DROP_OLDEST = 'drop_oldest'
+DISCONNECT = 'disconnect'
+QUEUE_POLICIES = [CONFLATE, DROP_OLDEST, DISCONNECT]
+
+# subscriber queue defaults
+DEFAULT_QUEUE_POLICY = CONFLATE
+DEFAULT_QUEUE_LEN = 256
+# seconds of lag, or of failed sends, after which a subscriber is disconnected
+DEFAULT_DISCONNECT_AFTER = 30
+# maximum number of queued messages sent together in a single MARKET_DATA_FEED_BATCH message
+DEFAULT_MAX_BATCH = 64
+# frames bigger than this many bytes are compressed, None to never compress
+DEFAULT_COMPRESS_THRESHOLD = None
+# seconds a send can block on a subscriber that stopped reading, before failing
+DEFAULT_SEND_TIMEOUT = 5
+
+# kinds of feed messages
+# full: the whole data, for normal subscriptions
+# snapshot, delta: messages of the delta stream of a group, for delta subscriptions, see DeltaStream
+FULL_MESSAGE = 'full'
+SNAPSHOT_MESSAGE = 'snapshot'
+DELTA_MESSAGE = 'delta'
+
+# feed transports
+# tcp: messages are queued and sent over a feed connection to the strategy, see FeedScheduler._drain
+# shm: messages are written to a shared memory ring read by the strategy, used when both run on the same host
+TCP_TRANSPORT = 'tcp'
+SHM_TRANSPORT = 'shm'
+
+logger = logging.getLogger('data_feed')
+
+
+def feed_callback(queue, resp, logger, count=1):
     if resp['status'] == 'SUCCESS':
         logger.debug("Pushed feed successfully")
     elif resp['status'] == 'FAIL':
-        logger.error("Could not push feed: %s, cancelling subscription" % resp['message'])
-        del interface.subscriptions[sub_handle]
+        logger.error("Could not push feed to %s: %s" % (queue.descriptor, resp['message']))
+    queue.record_result(resp['status'] == 'SUCCESS', time.monotonic(), count)
 
 
-def push_feed(interface, subscription_handle):
+def send_group_feed(interface, group_key, data=None):
     """
-    Periodically push feed data to the subscriber.
+    Send a feed message to all the subscribers of a feed group.
+    The data is computed once, and encoded once per codec in use by the subscribers,
+    the same bytes are then queued for all of them.
+
+    Subscribers in delta mode get the snapshot or the delta of the group stream instead,
+    see DeltaStream.
 
     :param interface: parent market interface
-    :param subscription_handle: handle of the served subscription
+    :param group_key: (symbol, frequency, mode, granularity) of the group
+    :param data: data to send, if None it is requested to the interface
     """
-    logger = logging.getLogger('data_feed_%s' % subscription_handle)
-
-    strategy_address = interface.subscriptions[subscription_handle]['strategy_address']
-    strategy_port = interface.subscriptions[subscription_handle]['strategy_port']
-    timeout = interface.subscriptions[subscription_handle]['frequency']
-    logger.info("Data sender initialized for subscription %s" % subscription_handle)
+    sub_handles = interface.get_feed_group(group_key)
+    if not sub_handles:
+        return
 
-    message_sender = MessageSender(strategy_address, strategy_port)
-    # push feed data periodically
-    while subscription_handle in interface.subscriptions:
-        # prepare data to be sent
-        query = {
+    # prepare data to be sent
+    if data is None:
+        if group_key[3] is not None:
+            # bar feeds send the bar being built
+            data = interface.get_current_bar(group_key[0], group_key[3])
+        else:
+            data = interface.get_symbol_data(group_key[0], sub_handles[0])
+    messages = {
+        FULL_MESSAGE: {
             'query': 'MARKET_DATA_FEED',
-            'data': interface.get_data(subscription_handle)
+            'data': data
         }
+    }
+
+    # encoded messages, by kind and codec
+    encoded = {}
+
+    def encode(kind, codec):
+        if (kind, codec.name) not in encoded:
+            encoded[(kind, codec.name)] = codec.encode(messages[kind])
+        return encoded[(kind, codec.name)]
+
+    for sub_handle in sub_handles:
+        subscription = interface.subscriptions.get(sub_handle)
+        if subscription is None:
+            continue
+
+        kind = FULL_MESSAGE
+        if subscription.get('delta'):
+            if SNAPSHOT_MESSAGE not in messages:
+                messages[SNAPSHOT_MESSAGE], messages[DELTA_MESSAGE] = \
+                    interface.feed_scheduler.get_stream(group_key).update(data)
+            # needs_snapshot is cleared once the snapshot leaves the subscriber queue
+            if subscription.get('needs_snapshot') or messages[DELTA_MESSAGE] is None:
+                kind = SNAPSHOT_MESSAGE
+            else:
+                kind = DELTA_MESSAGE
+
+        # encoded with the codec negotiated with the strategy, the one of its pooled connection
+        codec = get_connection(subscription['strategy_address'], subscription['strategy_port']).codec
+        snapshot = None
+        if kind != FULL_MESSAGE:
+            # encoded only if the queue has to replace a pending message of the stream
+            snapshot = functools.partial(encode, SNAPSHOT_MESSAGE, codec)
+        interface.feed_scheduler.enqueue(subscription, group_key, encode(kind, codec), kind, snapshot)
+
+
+def shm_ring_name(interface_id, address, port):
+    """
+    :param interface_id: ID of the market interface
+    :param address: address of the strategy server
+    :param port: port of the strategy server
+    :return: name of the shared memory ring used to send feeds to the strategy
+    """
+    return re.sub(r'[^A-Za-z0-9_]', '_', 'hydra_%s_%s_%d' % (interface_id, address, port))
+
+
+def stream_id(interface_id, group_key):
+    """
+    :param interface_id: ID of the market interface
+    :param group_key: (symbol, frequency, mode, granularity) of the feed group
+    :return: ID of the delta stream of the group, unique across interfaces
+    """
+    return '%s:%s:%s:%s' % ((interface_id,) + tuple(group_key))
+
+
+class DeltaStream:
+    """
+    Delta encoding state of a feed group.
+
+    Every update gets a sequence number, and is turned into a snapshot message, carrying the
+    whole data, and a delta message, carrying only the top level fields that changed or were
+    removed since the previous update. Subscribers get a snapshot first, then deltas; when a
+    subscriber sees a gap in the sequence numbers it asks for a resync, and gets a snapshot again.
+    """
+    def __init__(self, stream_id):
+        self.stream_id = stream_id
+        self.seq = 0
+        self.last = None
+
+    def update(self, data):
+        """
+        :param data: new feed data
+        :return: (snapshot message, delta message), the delta is None if the data can't be
+                diffed against the previous update (first update, or data that is not a dict)
+        """
+        self.seq += 1
+        snapshot = {
+            'query': 'MARKET_DATA_DELTA',
+            'data': {
+                'stream': self.stream_id,
+                'seq': self.seq,
+                'snapshot': data
+            }
+        }
+
+        delta = None
+        if isinstance(data, dict) and isinstance(self.last, dict):
+            delta = {
+                'query': 'MARKET_DATA_DELTA',
+                'data': {
+                    'stream': self.stream_id,
+                    'seq': self.seq,
+                    'changed': {k: v for k, v in data.items() if k not in self.last or self.last[k] != v},
+                    'removed': [k for k in self.last if k not in data]
+                }
+            }
+        self.last = dict(data) if isinstance(data, dict) else data
+        return snapshot, delta
+
+
+def next_due_time(due, frequency, now):
+    """
+    Compute when a feed is due next.
+    The schedule is anchored to the previous due time rather than to when the message was
+    actually sent, so slow sends don't make the feed drift.
+
+    :param due: time the feed was last due
+    :param frequency: seconds between feed messages
+    :param now: current time
+    :return: next due time, always in the future
+    """
+    frequency = max(frequency, MIN_FEED_INTERVAL)
+    next_due = due + frequency
+    if next_due <= now:
+        # fell behind by more than an interval, skip the missed ticks instead of sending them in a burst
+        missed = math.floor((now - due) / frequency)
+        next_due = due + (missed + 1) * frequency
+    return next_due
+
+
+class SubscriberQueue:
+    """
+    Bounded queue of the feed messages waiting to be sent to a subscriber (a strategy server).
+    Messages are sent by a single drain task at a time, so a slow subscriber only holds up its own
+    messages, and what happens when it falls behind is decided by the queue policy.
+    When more than one message is waiting, they are sent together in a batch.
+
+    Messages of a delta stream are never just dropped, since the subscriber could not apply the deltas
+    after them: when conflating, a pending message of the stream is replaced by a fresh snapshot,
+    and when one is dropped the subscription is flagged to get a snapshot with its next message.
+    The needs_snapshot flag of a subscription is cleared only when a snapshot is dequeued.
+    """
+    def __init__(self, address, port, policy=DEFAULT_QUEUE_POLICY, max_len=DEFAULT_QUEUE_LEN,
+                 disconnect_after=DEFAULT_DISCONNECT_AFTER, max_batch=DEFAULT_MAX_BATCH,
+                 compress_threshold=DEFAULT_COMPRESS_THRESHOLD, send_timeout=DEFAULT_SEND_TIMEOUT):
+        """
+        Initialize queue.
+
+        :param address: address of the subscriber
+        :param port: port of the subscriber
+        :param policy: one of QUEUE_POLICIES
+        :param max_len: maximum number of queued messages
+        :param disconnect_after: seconds of lag (disconnect policy only) or of continuously failing
+                sends after which the subscriber is disconnected
+        :param max_batch: maximum number of messages sent in a single batch, 1 to disable batching
+        :param compress_threshold: frames bigger than this many bytes are compressed, None to never compress
+        :param send_timeout: seconds a send can block when the subscriber does not read, the send then
+                fails and counts towards disconnect_after
+        """
+        if policy not in QUEUE_POLICIES:
+            raise ValueError('Unknown queue policy %s' % policy)
+
+        self.address, self.port = address, port
+        self.descriptor = '%s:%d' % (address, port)
+        self.policy = policy
+        self.max_len = max_len
+        self.disconnect_after = disconnect_after
+        self.max_batch = max(max_batch, 1)
+        self.compress_threshold = compress_threshold
+        self.send_timeout = send_timeout
+
+        # key -> (encoded message, enqueue time, kind, subscription), the key is the feed group
+        # when conflating, (feed group, DELTA_MESSAGE) for delta streams, a unique counter otherwise.
+        # The subscription is only set for messages of a delta stream
+        self.items = collections.OrderedDict()
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        # True while a drain task is scheduled or running
+        self.draining = False
+        # time of the first of the current streak of failed sends
+        self.failing_since = None
+        # connection the messages are sent over, opened by the first drain task
+        self.connection = None
+
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.conflated = 0
+        # highest time spent in the queue by a message
+        self.max_lag = 0
+
+    def put(self, group_key, data, now, kind=FULL_MESSAGE, subscription=None, snapshot=None):
+        """
+        Queue a message, applying the queue policy.
+
+        :param group_key: feed group of the message
+        :param data: encoded message
+        :param now: current monotonic time
+        :param kind: one of FULL_MESSAGE, SNAPSHOT_MESSAGE, DELTA_MESSAGE
+        :param subscription: subscription entry, for snapshot and delta messages
+        :param snapshot: for snapshot and delta messages, function returning the encoded snapshot
+                of the same update, used to replace a pending message of the stream
+        :return: True if a drain task must be started
+        """
+        stream = kind != FULL_MESSAGE
+        with self.lock:
+            key = (group_key, DELTA_MESSAGE) if stream else group_key
+            if self.policy == CONFLATE and key in self.items:
+                if kind == DELTA_MESSAGE:
+                    # the pending message can't be skipped, the snapshot covers both
+                    data, kind = snapshot(), SNAPSHOT_MESSAGE
+                # keep the position, and the enqueue time, of the replaced message
+                self.items[key] = (data, self.items[key][1], kind, subscription)
+                self.conflated += 1
+            else:
+                if len(self.items) >= self.max_len:
+                    self._discard(self.items.popitem(last=False)[1])
+                    self.dropped += 1
+                if self.policy != CONFLATE:
+                    key = next(self.counter)
+                self.items[key] = (data, now, kind, subscription)
+
+            if self.draining:
+                return False
+            self.draining = True
+            return True
+
+    def lagging(self, now):
+        """
+        :param now: current monotonic time
+        :return: True if the subscriber must be disconnected
+        """
+        with self.lock:
+            if self.failing_since is not None and now - self.failing_since > self.disconnect_after:
+                return True
+            if self.policy != DISCONNECT or not self.items:
+                return False
+            oldest = next(iter(self.items.values()))[1]
+            return now - oldest > self.disconnect_after
+
+    @staticmethod
+    def _discard(item):
+        """A message of a delta stream was dropped, the subscription needs a snapshot to recover"""
+        subscription = item[3]
+        if subscription is not None:
+            subscription['needs_snapshot'] = True
+
+    def pop(self, now):
+        """
+        :param now: current monotonic time
+        :return: list of (key, encoded message, enqueue time, kind, subscription) of the oldest messages,
+                at most max_batch of them. Empty if the queue is empty, in which case the drain task must stop
+        """
+        items = []
+        with self.lock:
+            while self.items and len(items) < self.max_batch:
+                key, (data, enqueued, kind, subscription) = self.items.popitem(last=False)
+                if kind == SNAPSHOT_MESSAGE:
+                    subscription['needs_snapshot'] = False
+                items.append((key, data, enqueued, kind, subscription))
+            if not items:
+                self.draining = False
+            else:
+                self.max_lag = max(self.max_lag, now - items[0][2])
+        return items
+
+    def requeue(self, items):
+        """
+        Put back messages that could not be sent, unless they were superseded in the meantime,
+        and stop draining until the next message is queued.
 
-        message_sender.send_message(query,
-                                    False,
-                                    lambda res: feed_callback(interface,
-                                                                   subscription_handle,
-                                                                   res,
-                                                                   logger))
+        :param items: list of (key, encoded message, enqueue time, kind, subscription), as returned by pop
+        """
+        with self.lock:
+            for key, data, enqueued, kind, subscription in reversed(items):
+                if key not in self.items and len(self.items) < self.max_len:
+                    self.items[key] = (data, enqueued, kind, subscription)
+                    self.items.move_to_end(key, last=False)
+                    if kind == SNAPSHOT_MESSAGE:
+                        # not delivered yet
+                        subscription['needs_snapshot'] = True
+                else:
+                    self._discard((data, enqueued, kind, subscription))
+            self.draining = False
 
-        time.sleep(timeout)
+    def stop_draining(self):
+        with self.lock:
+            self.draining = False
 
-    message_sender.close()
+    def record_result(self, success, now, count=1):
+        with self.lock:
+            if success:
+                self.sent += count
+                self.failing_since = None
+            else:
+                self.failed += count
+                if self.failing_since is None:
+                    self.failing_since = now
+
+    def metrics(self, now):
+        """
+        :param now: current monotonic time
+        :return: dict with the queue counters, lag is in seconds
+        """
+        with self.lock:
+            return {
+                'policy': self.policy,
+                'queued': len(self.items),
+                'lag': now - next(iter(self.items.values()))[1] if self.items else 0,
+                'max_lag': self.max_lag,
+                'sent': self.sent,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'conflated': self.conflated
+            }
+
+
+class FeedScheduler:
+    """
+    Single scheduler for all the data feeds of a market interface.
+
+    Feeds are scheduled by group: all the subscriptions to the same symbol with the same frequency
+    and mode are served together, see send_group_feed.
+    Groups are kept in a heap ordered by the monotonic time at which they are next due.
+    A single thread sleeps until the earliest one is due, and hands the sends to a small pool of
+    sender workers, so the number of threads does not grow with the number of subscriptions.
+    If the previous message of a feed is still being sent when the next one is due, the tick is
+    skipped rather than queued behind it.
+
+    Messages are not sent by the feed sends themselves, but queued in a SubscriberQueue for each
+    subscriber, drained by the same sender workers. Subscribers on the same host get them
+    through a shared memory ring instead, see ShmRing.
+
+    Event feeds are not in the heap until an update is published: the update is sent right away,
+    unless the previous message of the feed was sent less than frequency seconds ago. In that case
+    the feed is scheduled at the end of the interval, and the updates published in the meantime are
+    conflated, only the latest one is sent.
+    """
+    def __init__(self, interface, sender_workers=DEFAULT_SENDER_WORKERS, send_queue_len=DEFAULT_SEND_QUEUE_LEN,
+                 queue_options=None, ring_options=None):
+        """
+        Initialize scheduler.
+
+        :param interface: parent market interface, whose feed groups are served
+        :param sender_workers: number of threads sending feed messages
+        :param send_queue_len: maximum number of sends waiting for a worker
+        :param queue_options: dict of SubscriberQueue options (policy, max_len, disconnect_after)
+        :param ring_options: dict of ShmRing options (slots, slot_size)
+        """
+        self.logger = logging.getLogger('feed_scheduler')
+
+        self.INTERFACE = interface
+
+        # entries: (due time, insertion counter, group key)
+        self.heap = []
+        # groups in the heap
+        self.scheduled = set()
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        # set when the heap changes, so the scheduler thread recomputes its sleep
+        self.changed = False
+
+        self.sender_workers = sender_workers
+        self.send_queue_len = send_queue_len
+        self.workers = None
+
+        # groups with a send in progress
+        self.in_flight = set()
+        self.in_flight_lock = threading.Lock()
+
+        # event feeds: latest unsent update and time of the last send, by group
+        self.latest = {}
+        self.last_sent = {}
+
+        # subscriber queues, indexed by (address, port) of the subscriber
+        self.queue_options = queue_options or {}
+        self.queues = {}
+        self.queues_lock = threading.Lock()
+
+        # delta streams, by group
+        self.streams = {}
+
+        # shared memory rings, indexed by (address, port) of the subscriber
+        self.ring_options = ring_options or {}
+        self.rings = {}
+        # rings have a single writer
+        self.rings_lock = threading.Lock()
+        self.ring_fallbacks = 0
+
+        self.dispatched = 0
+        self.skipped = 0
+        self.conflated = 0
+
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.workers = WorkerPool('feed_senders', self.sender_workers, self.send_queue_len)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='feed_scheduler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        with self.rings_lock:
+            for ring in self.rings.values():
+                ring.close()
+            self.rings = {}
+        with self.queues_lock:
+            for queue in self.queues.values():
+                if queue.connection is not None:
+                    queue.connection.close()
+
+    def add(self, group_key):
+        """
+        Schedule a feed group, its first message is due right away.
+
+        :param group_key: (symbol, frequency, mode, granularity) of the group, must be in the interface feed groups
+        """
+        if group_key[2] == EVENT_FEED:
+            # sent when updates are published
+            return
+        with self.condition:
+            self._schedule(group_key, time.monotonic())
+
+    def _schedule(self, group_key, due):
+        # must hold the condition
+        if group_key in self.scheduled:
+            return
+        self.scheduled.add(group_key)
+        heapq.heappush(self.heap, (due, next(self.counter), group_key))
+        self.changed = True
+        self.condition.notify()
+
+    def publish(self, group_key, data):
+        """
+        Publish an update on an event feed group.
+        It is sent right away if the group is outside its conflation window, otherwise it
+        replaces any update still waiting to be sent.
+
+        :param group_key: (symbol, frequency, mode, granularity) of the group
+        :param data: feed data
+        """
+        now = time.monotonic()
+        with self.condition:
+            if group_key in self.latest:
+                self.conflated += 1
+            self.latest[group_key] = data
+            if group_key in self.scheduled:
+                return
+            due = self.last_sent.get(group_key, now) + group_key[1]
+            if group_key in self.last_sent and due > now:
+                self._schedule(group_key, due)
+                return
+        self._dispatch(group_key)
+
+    def run_pending(self, now):
+        """
+        Dispatch all the feeds due at the specified time, and reschedule them.
+        Groups left without subscribers are dropped from the heap when they come up.
+
+        :param now: current monotonic time
+        :return: seconds until the next feed is due, None if no feed is scheduled
+        """
+        due_groups = []
+        with self.condition:
+            while self.heap and self.heap[0][0] <= now:
+                due, _, group_key = heapq.heappop(self.heap)
+                if not self.INTERFACE.get_feed_group(group_key):
+                    self.scheduled.discard(group_key)
+                    self._forget(group_key)
+                    continue
+                if group_key[2] == EVENT_FEED:
+                    # end of the conflation window, rescheduled by the next update
+                    self.scheduled.discard(group_key)
+                    due_groups.append(group_key)
+                    continue
+                next_due = next_due_time(due, group_key[1], now)
+                heapq.heappush(self.heap, (next_due, next(self.counter), group_key))
+                due_groups.append(group_key)
+            wait = self.heap[0][0] - now if self.heap else None
+
+        for group_key in due_groups:
+            self._dispatch(group_key)
+        return wait
+
+    def get_stream(self, group_key):
+        """
+        :param group_key: (symbol, frequency, mode, granularity) of the feed group
+        :return: DeltaStream of the group, created on first use
+        """
+        with self.condition:
+            stream = self.streams.get(group_key)
+            if stream is None:
+                stream = DeltaStream(stream_id(self.INTERFACE.INTERFACE_ID, group_key))
+                self.streams[group_key] = stream
+            return stream
+
+    def forget(self, group_key):
+        """
+        Drop the state of a feed group left without subscribers.
+
+        :param group_key: (symbol, frequency, mode, granularity) of the feed group
+        """
+        with self.condition:
+            self._forget(group_key)
+
+    def _forget(self, group_key):
+        # must hold the condition
+        self.latest.pop(group_key, None)
+        self.last_sent.pop(group_key, None)
+        self.streams.pop(group_key, None)
+
+    def _dispatch(self, group_key):
+        with self.in_flight_lock:
+            if group_key in self.in_flight:
+                self.skipped += 1
+                return
+            self.in_flight.add(group_key)
+        if self.workers.submit(self._send, group_key):
+            self.dispatched += 1
+        else:
+            self.logger.warning('Send queue full, skipping tick of %r' % (group_key,))
+            with self.in_flight_lock:
+                self.in_flight.discard(group_key)
+                self.skipped += 1
+
+    def _send(self, group_key):
+        if group_key[2] == EVENT_FEED:
+            self._send_event(group_key)
+            return
+        try:
+            send_group_feed(self.INTERFACE, group_key)
+        finally:
+            with self.in_flight_lock:
+                self.in_flight.discard(group_key)
+
+    def _send_event(self, group_key):
+        with self.condition:
+            data = self.latest.pop(group_key, None)
+            if data is not None:
+                self.last_sent[group_key] = time.monotonic()
+        try:
+            if data is not None:
+                send_group_feed(self.INTERFACE, group_key, data)
+        finally:
+            with self.in_flight_lock:
+                self.in_flight.discard(group_key)
+
+        # updates published during the send were not dispatched, since the group was in flight
+        with self.condition:
+            if group_key not in self.latest or group_key in self.scheduled:
+                return
+            due = self.last_sent.get(group_key, 0) + group_key[1]
+            if due > time.monotonic():
+                self._schedule(group_key, due)
+                return
+        self._dispatch(group_key)
+
+    def get_ring(self, address, port):
+        """
+        Get the shared memory ring of a subscriber, creating it on first use.
+
+        :param address: address of the strategy server
+        :param port: port of the strategy server
+        :return: the ring, None if it could not be created
+        """
+        with self.rings_lock:
+            ring = self.rings.get((address, port))
+            if ring is not None:
+                return ring
+            name = shm_ring_name(self.INTERFACE.INTERFACE_ID, address, port)
+            try:
+                try:
+                    ring = ShmRing(name, create=True, **self.ring_options)
+                except FileExistsError:
+                    # left behind by a previous run
+                    ShmRing(name).shm.unlink()
+                    ring = ShmRing(name, create=True, **self.ring_options)
+            except OSError as e:
+                self.logger.error('Could not create shared memory ring %s: %s' % (name, e))
+                return None
+            self.rings[(address, port)] = ring
+            return ring
+
+    def release_ring(self, address, port):
+        """
+        Close and destroy the shared memory ring of a subscriber, once it has no shm subscriptions left.
+
+        :param address: address of the strategy server
+        :param port: port of the strategy server
+        """
+        with self.rings_lock:
+            ring = self.rings.pop((address, port), None)
+            if ring is not None:
+                ring.close()
+
+    def enqueue(self, subscription, group_key, data, kind=FULL_MESSAGE, snapshot=None):
+        """
+        Queue a feed message for a subscriber, and make sure it is being drained.
+        Messages for shared memory subscribers are written to their ring right away, unless
+        they don't fit in a slot.
+
+        :param subscription: subscription entry
+        :param group_key: feed group of the message
+        :param data: message, encoded with the codec of the subscriber
+        :param kind: one of FULL_MESSAGE, SNAPSHOT_MESSAGE, DELTA_MESSAGE
+        :param snapshot: for snapshot and delta messages, function returning the encoded snapshot, see SubscriberQueue.put
+        """
+        subscriber = (subscription['strategy_address'], subscription['strategy_port'])
+        if subscription.get('transport') == SHM_TRANSPORT:
+            with self.rings_lock:
+                ring = self.rings.get(subscriber)
+                if ring is not None and ring.write(data):
+                    if kind == SNAPSHOT_MESSAGE:
+                        subscription['needs_snapshot'] = False
+                    return
+                self.ring_fallbacks += 1
+
+        with self.queues_lock:
+            queue = self.queues.get(subscriber)
+            if queue is None:
+                queue = SubscriberQueue(*subscriber, **self.queue_options)
+                self.queues[subscriber] = queue
+
+        now = time.monotonic()
+        if queue.lagging(now):
+            self.disconnect(queue)
+            return
+        stream_subscription = subscription if kind != FULL_MESSAGE else None
+        if queue.put(group_key, data, now, kind, stream_subscription, snapshot) and \
+                not self.workers.submit(self._drain, queue):
+            # retried with the next message
+            queue.stop_draining()
+
+    def _drain(self, queue):
+        # feeds are sent over a connection of their own, with a send timeout so that a subscriber that
+        # stops reading does not hold the worker forever, without affecting the requests to it
+        if queue.connection is None:
+            queue.connection = Connection(queue.address, queue.port, read_responses=False,
+                                          send_timeout=queue.send_timeout)
+        connection = queue.connection
+        pooled = connection_pool.get(queue.address, queue.port)
+        connection_pool.release(pooled)
+        connection.codec = pooled.codec
+        while True:
+            items = queue.pop(time.monotonic())
+            if not items:
+                return
+            if len(items) == 1:
+                data = items[0][1]
+            else:
+                data = connection.codec.encode_batch('MARKET_DATA_FEED_BATCH', [item[1] for item in items])
+            if queue.compress_threshold is not None and len(data) > queue.compress_threshold:
+                data = compress(data)
+            result = {}
+            connection.send_encoded(data, result.update)
+            feed_callback(queue, result, logger, len(items))
+            if result['status'] == 'FAIL':
+                queue.requeue(items)
+                return
+
+    def disconnect(self, queue):
+        """
+        Cancel all the subscriptions of a subscriber, and drop its queue.
+
+        :param queue: queue of the subscriber
+        """
+        self.logger.error('Subscriber %s is lagging, cancelling its subscriptions' % queue.descriptor)
+        with self.queues_lock:
+            if self.queues.get((queue.address, queue.port)) is queue:
+                del self.queues[(queue.address, queue.port)]
+        for sub_handle, subscription in list(self.INTERFACE.subscriptions.items()):
+            if (subscription['strategy_address'], subscription['strategy_port']) == (queue.address, queue.port):
+                self.INTERFACE.remove_subscription(sub_handle)
+        # releases a drain task blocked sending to it
+        if queue.connection is not None:
+            queue.connection.close()
+        self.release_ring(queue.address, queue.port)
+
+    def _run(self):
+        while self.running:
+            wait = self.run_pending(time.monotonic())
+            with self.condition:
+                if not self.changed and self.running:
+                    self.condition.wait(wait)
+                self.changed = False
+
+    def metrics(self):
+        """
+        :return: dict with the scheduler counters
+        """
+        with self.condition:
+            scheduled = len(self.heap)
+        metrics = {
+            'scheduled': scheduled,
+            'dispatched': self.dispatched,
+            'skipped': self.skipped,
+            'conflated': self.conflated
+        }
+        if self.workers is not None:
+            metrics['senders'] = self.workers.metrics()
+        now = time.monotonic()
+        with self.queues_lock:
+            queues = list(self.queues.values())
+        metrics['subscribers'] = {queue.descriptor: queue.metrics(now) for queue in queues}
+        with self.rings_lock:
+            metrics['rings'] = [ring.metrics() for ring in self.rings.values()]
+            metrics['ring_fallbacks'] = self.ring_fallbacks
+        return metrics
@@ -1,6 +1,5 @@
 import logging
 import random
-import time
 
 from common.logging import setup_logger
 from market_interface.market_interface_template import MarketInterface
@@ -33,24 +32,21 @@ class ExampleMarketInterface (MarketInterface):
 
     def interface_main_cycle(self):
         self.rand_cur_value = 100
-        last_subs = None
-        while True:
-            if last_subs != self.subscriptions:
-                self.logger.info("Subscriptions:")
-                for sub in self.subscriptions:
-                    self.logger.info("%r" % sub)
-                last_subs = self.subscriptions.copy()
-            self.rand_cur_value += 2 * random.random() - 1
-            time.sleep(1)
+        self.run_loop.call_every(1, self.generate_tick)
+
+    def generate_tick(self):
+        self.rand_cur_value += 2 * random.random() - 1
+        # store the new value, feeds are served from the tick store
+        self.record_tick('RANDOM', {'value': self.rand_cur_value})
+
+    def on_subscriptions_change(self):
+        self.logger.info("Subscriptions:")
+        for sub in list(self.subscriptions):
+            self.logger.info("%r" % sub)
 
     def get_data(self, sub_handle):
-        symbol = self.subscriptions[sub_handle]['symbol']
-        if symbol == 'RANDOM':
-            return {
-                'value': self.rand_cur_value
-            }
-        else:
-            return None
+        # no data for symbols other than RANDOM
+        return None
 
 
 test_interface = ExampleMarketInterface()
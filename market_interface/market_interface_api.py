@@ -5,15 +5,16 @@ from market_interface.market_interface_request_handler import MarketInterfaceReq
 
 
 class MarketInterfaceApiServer (ApiServer):
-    def __init__(self, host, port, interface):
+    def __init__(self, host, port, interface, **server_options):
         """
         Initialize the interface server.
 
         :param host: address of the server
         :param port: port of the server
         :param interface: reference to the parent interface, used to modify data in it
+        :param server_options: ApiServer options (mode, max_workers, ...)
         """
-        super().__init__(host, port)
+        super().__init__(host, port, **server_options)
         self.logger = logging.getLogger('interface_api')
 
         self.INTERFACE = interface
@@ -3,8 +3,15 @@ import random
 import logging
 import threading
 
-from market_interface.data_feed import push_feed
+from common.codec import get_codec
+from common.messaging import get_connection
 from common.request_handler import RequestHandler
+from market_interface.data_feed import POLL_FEED, FEED_MODES, SHM_TRANSPORT, TCP_TRANSPORT, stream_id
+from market_interface.bar_aggregator import parse_granularity
+
+# seconds between the keep-alive chunks of a bulk data request waiting for its backfill,
+# well below the response timeout of the requester
+BACKFILL_KEEPALIVE_INTERVAL = 5
 
 
 class MarketInterfaceRequestHandler (RequestHandler):
@@ -23,6 +30,7 @@ class MarketInterfaceRequestHandler (RequestHandler):
         self.query_handlers = {
             'INTERFACE_SUBSCRIBE': self.subscribe,
             'INTERFACE_UNSUBSCRIBE': self.unsubscribe,
+            'INTERFACE_RESYNC': self.resync,
             'BULK_DATA': self.bulk_data_request,
             'ORDER': self.order
         }
@@ -32,18 +40,43 @@ class MarketInterfaceRequestHandler (RequestHandler):
         Subscribe strategy to a data feed, sent with the requested frequency.
 
         Generates a unique subscription handle, inserts the corresponding entry into the interface,
-        and starts the data sender tasked with periodically sending feed data.
+        and schedules it with the feed scheduler of the interface, tasked with periodically sending feed data.
 
         :param req_data: contains the data regarding the request:
             strategy_id: ID of the requesting strategy
             strategy_address: address of the strategy server socket
             strategy_port: port of te strategy server socket
+            codec: wire codec negotiated with the strategy (optional, JSON by default)
             symbol: requested symbol
-            frequency: time elapsed between feed messages, in seconds
+            frequency: time elapsed between feed messages, in seconds. In event mode, minimum time
+                    between feed messages, updates published in the meantime are conflated
+            mode: feed mode, poll (default) or event, see data_feed
+            delta: True to receive a snapshot followed by deltas, see DeltaStream (optional)
+            transport: shm if the strategy is on the same host, tcp otherwise (optional)
+            granularity: seconds covered by each bar, or string like 5m, to receive OHLCV bars
+                    instead of ticks, see bar_aggregator (optional)
         """
-        # TODO: implement data granularity
         self.logger.info("Subscription request received from %s" % req_data['strategy_id'])
 
+        mode = req_data.get('mode', POLL_FEED)
+        if mode not in FEED_MODES:
+            self.logger.error('Unknown feed mode %s' % mode)
+            return {
+                'status': 'FAIL',
+                'message': 'Unknown feed mode %s' % mode
+            }
+
+        granularity = req_data.get('granularity')
+        if granularity is not None:
+            try:
+                granularity = parse_granularity(granularity)
+            except ValueError as e:
+                self.logger.error(str(e))
+                return {
+                    'status': 'FAIL',
+                    'message': str(e)
+                }
+
         # generate handle
         rand_str = ''.join(random.choices(string.ascii_letters + string.digits, k=16))
         sub_handle = "%s_%s_%s:%s" % (self.INTERFACE.INTERFACE_ID,
@@ -51,34 +84,126 @@ class MarketInterfaceRequestHandler (RequestHandler):
                                       req_data['strategy_id'],
                                       rand_str)
 
-        # initialize data sender
-        data_sender = threading.Thread(target=push_feed,
-                                       args=(self.INTERFACE, sub_handle,))
+        # feed messages are encoded with the codec the strategy negotiated with the manager
+        get_connection(req_data['strategy_address'],
+                       req_data['strategy_port']).codec = get_codec(req_data.get('codec'))
+
+        # co-located strategies read feeds from a shared memory ring, if it can be set up
+        ring = None
+        if req_data.get('transport') == SHM_TRANSPORT:
+            ring = self.INTERFACE.feed_scheduler.get_ring(req_data['strategy_address'], req_data['strategy_port'])
 
-        # insert subscription entry
-        self.INTERFACE.subscriptions[sub_handle] = {
+        # insert subscription entry, and start sending feed data
+        subscription = {
             'strategy_address': req_data['strategy_address'],
             'strategy_port': req_data['strategy_port'],
             'symbol': req_data['symbol'],
             'frequency': req_data['frequency'],
-            'sender': data_sender
+            'mode': mode,
+            'granularity': granularity,
+            'delta': bool(req_data.get('delta')),
+            'needs_snapshot': True,
+            'transport': SHM_TRANSPORT if ring is not None else TCP_TRANSPORT
         }
+        self.INTERFACE.add_subscription(sub_handle, subscription)
 
-        # start data sender
-        data_sender.start()
-
+        response_data = {
+            'subscription_handle': sub_handle
+        }
+        if ring is not None:
+            response_data['shm_name'] = ring.name
+        if subscription['delta']:
+            response_data['stream'] = stream_id(self.INTERFACE.INTERFACE_ID,
+                                                self.INTERFACE.group_key(subscription))
         return {
             'status': 'SUCCESS',
-            'data': {
-                'subscription_handle': sub_handle
+            'data': response_data
+        }
+
+    def resync(self, req_data):
+        """
+        Send a full snapshot to a delta subscription with the next feed message,
+        requested by strategies that missed part of the stream.
+
+        :param req_data: contains the data regarding the request:
+            subscription_handle: handle of the subscription
+        """
+        subscription = self.INTERFACE.subscriptions.get(req_data['subscription_handle'])
+        if subscription is None:
+            self.logger.error('Unknown subscription %s' % req_data['subscription_handle'])
+            return {
+                'status': 'FAIL',
+                'message': 'Unknown subscription %s' % req_data['subscription_handle']
             }
+
+        subscription['needs_snapshot'] = True
+        return {
+            'status': 'SUCCESS',
+            'data': {}
         }
 
     def unsubscribe(self, req_data):
         pass
 
     def bulk_data_request(self, req_data):
-        pass
+        """
+        Send the stored history of a symbol, streamed in columnar chunks so that neither end
+        has to hold the whole response in a single message.
+        Missing parts of the range are backfilled first, if the interface supports it. The backfill runs
+        in the background, meanwhile keep-alive chunks, with backfilling set and no columns, are sent.
+
+        :param req_data: contains the data regarding the request:
+            symbol: requested symbol
+            start_time: lower bound of the tick timestamps (optional)
+            end_time: upper bound of the tick timestamps (optional)
+            frequency: requested data granularity, in seconds (optional, currently ignored)
+            chunk_size: maximum number of ticks in each chunk (optional)
+        :return: FAIL if the symbol is unknown, otherwise a generator of responses,
+                each one with a chunk of timestamp and field columns
+        """
+        # fill the gaps of the requested range first, so it is fetched once for all the strategies
+        if req_data.get('start_time') is not None and self.INTERFACE.backfiller is not None:
+            return self._backfill_and_send(req_data)
+        return self._send_bulk_data(req_data)
+
+    def _backfill_and_send(self, req_data):
+        symbol = req_data['symbol']
+        done = threading.Event()
+
+        def backfill():
+            try:
+                self.INTERFACE.backfill(symbol, req_data['start_time'], req_data.get('end_time'))
+            except Exception as e:
+                self.logger.error('Backfill of %s failed: %s' % (symbol, e))
+            finally:
+                done.set()
+
+        threading.Thread(target=backfill, name='backfill_%s' % symbol, daemon=True).start()
+        keepalive = {'status': 'SUCCESS', 'data': {'symbol': symbol, 'backfilling': True}}
+        yield keepalive
+        while not done.wait(BACKFILL_KEEPALIVE_INTERVAL):
+            yield keepalive
+
+        response = self._send_bulk_data(req_data)
+        if isinstance(response, dict):
+            yield response
+        else:
+            yield from response
+
+    def _send_bulk_data(self, req_data):
+        symbol = req_data['symbol']
+        if not self.INTERFACE.has_history(symbol):
+            self.logger.error('No data for symbol %s' % symbol)
+            return {
+                'status': 'FAIL',
+                'message': 'No data for symbol %s' % symbol
+            }
+
+        chunks = self.INTERFACE.iter_bulk_data(symbol,
+                                               req_data.get('start_time'),
+                                               req_data.get('end_time'),
+                                               req_data.get('chunk_size'))
+        return ({'status': 'SUCCESS', 'data': dict(chunk, symbol=symbol)} for chunk in chunks)
 
     def order(self, req_data):
         pass
@@ -1,9 +1,22 @@
 import sys
 import json
+import time
+import socket
 import logging
+import threading
 
-from common.messaging import message_to_address
+from common.codec import SUPPORTED_CODECS, get_codec
+from common.messaging import message_to_address, get_connection
+from common.run_loop import RunLoop
+from market_interface.data_feed import FeedScheduler, DEFAULT_SENDER_WORKERS, POLL_FEED, EVENT_FEED, SHM_TRANSPORT
 from market_interface.market_interface_api import MarketInterfaceApiServer
+from market_interface.tick_store import TickStore, DEFAULT_CAPACITY
+from market_interface.tick_storage import TickStorage
+from market_interface.backfill import Backfiller
+from market_interface.bar_aggregator import BarAggregator, DEFAULT_PRICE_FIELD, DEFAULT_VOLUME_FIELD
+
+# ticks sent in each message of a bulk data response
+DEFAULT_BULK_CHUNK_SIZE = 5000
 
 
 class MarketInterface:
@@ -31,28 +44,94 @@ class MarketInterface:
         self.MANAGER_ADDRESS = self.config['manager_address']
         self.MANAGER_PORT = self.config['manager_port']
         self.BUFFER_SIZE = self.config['buffer_size']
+        # wire codecs offered to the other components, in order of preference
+        self.CODECS = self.config.get('codecs', SUPPORTED_CODECS)
+        # optional settings of the interface server, see ApiServer
+        self.SERVER_OPTIONS = self.config.get('api_server', {})
+        # host reported to the manager, strategies on the same host get feeds through shared memory
+        self.HOSTNAME = socket.gethostname() if self.config.get('shm_transport', True) else None
 
         # active subscriptions, indexed by their unique handle
         self.subscriptions = {}
+        # handles of the subscriptions to the same feed, indexed by (symbol, frequency, mode, granularity)
+        self.feed_groups = {}
+        # keys of the event feed groups, indexed by symbol
+        self.event_groups = {}
+        self.subscriptions_lock = threading.Lock()
+
+        # bar aggregators shared by the subscriptions to bars, indexed by symbol and granularity
+        self.bar_aggregators = {}
+        self.bars_lock = threading.Lock()
+        # number of subscriptions to the bars of each (symbol, granularity), under the subscriptions lock
+        self.bar_refs = {}
+        # tick fields aggregated into bars
+        self.BAR_PRICE_FIELD = self.config.get('bar_price_field', DEFAULT_PRICE_FIELD)
+        self.BAR_VOLUME_FIELD = self.config.get('bar_volume_field', DEFAULT_VOLUME_FIELD)
+
+        # history of the latest ticks of each symbol
+        self.tick_store = TickStore(self.config.get('tick_store_capacity', DEFAULT_CAPACITY))
+        self.BULK_CHUNK_SIZE = self.config.get('bulk_chunk_size', DEFAULT_BULK_CHUNK_SIZE)
+        # persistent history, optional tick_storage settings: path, flush_size, index_stride, see TickStorage
+        storage_options = self.config.get('tick_storage')
+        self.tick_storage = TickStorage(**storage_options) if storage_options else None
+        # optional backfill settings: symbols and lookback (seconds) backfilled on boot,
+        # workers, rate, burst, max_gap, max_span, see Backfiller
+        self.BACKFILL_OPTIONS = dict(self.config.get('backfill', {}))
+        self.backfiller = None
+
+        # sends feed data of all the subscriptions
+        # optional feed_queue settings: policy, max_len, disconnect_after, max_batch, compress_threshold,
+        # see SubscriberQueue
+        self.feed_scheduler = FeedScheduler(self,
+                                            self.config.get('feed_sender_workers', DEFAULT_SENDER_WORKERS),
+                                            queue_options=self.config.get('feed_queue'),
+                                            ring_options=self.config.get('shm_ring'))
 
         self.interface_server = None
 
+        # runs the main cycle and the timers of the interface, in the main thread
+        self.run_loop = RunLoop('interface_loop')
+
     def boot(self):
         """
         Start all the processes and do all the things needed to start rollin'
         """
         self.register()
 
+        # start feed scheduler, before the server can accept subscriptions
+        self.feed_scheduler.start()
+
         # start interface server
-        interface_server = MarketInterfaceApiServer(self.HOST, self.PORT, self)
+        interface_server = MarketInterfaceApiServer(self.HOST, self.PORT, self, **self.SERVER_OPTIONS)
         interface_server.start()
 
-        # start interface main cycle
-        self.interface_main_cycle()
+        # merge the segments left by previous runs, and fill the history missed while down
+        if self.tick_storage is not None:
+            self.tick_storage.compact_all()
+            self.start_backfill()
+
+        self.run_loop.add_shutdown_callback(self.feed_scheduler.stop)
+        if self.tick_storage is not None:
+            self.run_loop.add_shutdown_callback(self.tick_storage.close)
+
+        # start interface main cycle, and run its timers until shutdown
+        self.run_loop.call_soon(self.interface_main_cycle)
+        self.run_loop.run()
+
+    def shutdown(self):
+        """
+        Stop the interface main cycle, and the feeds. Safe to call from any thread.
+        """
+        if self.backfiller is not None:
+            self.backfiller.stop()
+        self.run_loop.stop()
 
     def register_callback(self, resp):
         if resp['status'] == 'SUCCESS':
-            self.logger.info('Interface registered')
+            # talk to the manager with the negotiated codec from now on
+            codec = get_codec(resp['data'].get('data', {}).get('codec'))
+            get_connection(self.MANAGER_ADDRESS, self.MANAGER_PORT).codec = codec
+            self.logger.info('Interface registered, using %s codec' % codec.name)
         else:
             self.logger.error('Could not register interface: %s', resp['message'])
             sys.exit(1)
@@ -65,6 +144,8 @@ class MarketInterface:
                 'market_interface_id': self.INTERFACE_ID,
                 'market_interface_address': self.HOST,
                 'market_interface_port': self.PORT,
+                'codecs': self.CODECS,
+                'hostname': self.HOSTNAME,
             }
         }
 
@@ -75,12 +156,286 @@ class MarketInterface:
                            True,
                            self.register_callback)
 
+    def add_subscription(self, sub_handle, subscription):
+        """
+        Insert a subscription, and start serving its feed.
+
+        :param sub_handle: unique handle of the subscription
+        :param subscription: subscription entry, containing at least symbol and frequency,
+                the feed mode (poll if missing) and the bar granularity (ticks if missing)
+        """
+        group_key = self.group_key(subscription)
+        with self.subscriptions_lock:
+            if group_key[3] is not None:
+                bars = (group_key[0], group_key[3])
+                self.bar_refs[bars] = self.bar_refs.get(bars, 0) + 1
+                if self.bar_refs[bars] == 1:
+                    self.add_bar_aggregator(*bars)
+            self.subscriptions[sub_handle] = subscription
+            self.feed_groups.setdefault(group_key, set()).add(sub_handle)
+            if group_key[2] == EVENT_FEED:
+                self.event_groups.setdefault(group_key[0], set()).add(group_key)
+        self.feed_scheduler.add(group_key)
+        self.run_loop.call_soon(self.on_subscriptions_change)
+
+    def remove_subscription(self, sub_handle):
+        """
+        Remove a subscription, its feed stops being served.
+
+        :param sub_handle: unique handle of the subscription
+        :return: the removed subscription entry, None if it did not exist
+        """
+        with self.subscriptions_lock:
+            subscription = self.subscriptions.pop(sub_handle, None)
+            if subscription is None:
+                return None
+            group_key = self.group_key(subscription)
+            group = self.feed_groups.get(group_key)
+            if group is not None:
+                group.discard(sub_handle)
+                if not group:
+                    del self.feed_groups[group_key]
+                    self.feed_scheduler.forget(group_key)
+                    symbol_groups = self.event_groups.get(group_key[0], set())
+                    symbol_groups.discard(group_key)
+                    if not symbol_groups:
+                        self.event_groups.pop(group_key[0], None)
+            # bars nobody subscribes to anymore are not built
+            if group_key[3] is not None:
+                bars = (group_key[0], group_key[3])
+                self.bar_refs[bars] -= 1
+                if not self.bar_refs[bars]:
+                    del self.bar_refs[bars]
+                    with self.bars_lock:
+                        self.bar_aggregators.get(group_key[0], {}).pop(group_key[3], None)
+            # neither is the shared memory ring of a subscriber left without shm subscriptions
+            subscriber = (subscription.get('strategy_address'), subscription.get('strategy_port'))
+            ring_used = subscription.get('transport') != SHM_TRANSPORT or any(
+                other.get('transport') == SHM_TRANSPORT and
+                (other['strategy_address'], other['strategy_port']) == subscriber
+                for other in self.subscriptions.values())
+        if not ring_used:
+            self.feed_scheduler.release_ring(*subscriber)
+        self.run_loop.call_soon(self.on_subscriptions_change)
+        return subscription
+
+    @staticmethod
+    def group_key(subscription):
+        """
+        :param subscription: subscription entry
+        :return: key of the feed group of the subscription, (symbol, frequency, mode, granularity),
+                granularity is None for tick feeds
+        """
+        return (subscription['symbol'], subscription['frequency'], subscription.get('mode', POLL_FEED),
+                subscription.get('granularity'))
+
+    def get_feed_group(self, group_key):
+        """
+        :param group_key: (symbol, frequency, mode, granularity) of the feed group
+        :return: list of handles of the subscriptions in the group
+        """
+        with self.subscriptions_lock:
+            return list(self.feed_groups.get(group_key, ()))
+
+    def publish(self, symbol, data, granularity=None):
+        """
+        Publish an update of a symbol to its event feed subscribers, e.g. from on_websocket_recv
+        or interface_main_cycle. Poll feed subscribers are not affected.
+
+        :param symbol: updated symbol
+        :param data: feed data, sent as is to all the subscribers
+        :param granularity: granularity of the subscribers, if data is a bar, None for ticks
+        """
+        with self.subscriptions_lock:
+            group_keys = [key for key in self.event_groups.get(symbol, ()) if key[3] == granularity]
+        for group_key in group_keys:
+            self.feed_scheduler.publish(group_key, data)
+
+    def add_bar_aggregator(self, symbol, granularity):
+        """
+        Start building the bars of a symbol, if not already doing so.
+        The current bar is rebuilt from the ticks in the tick store.
+        Called by add_subscription, under the subscriptions lock, for the first subscription to the bars.
+
+        :param symbol: aggregated symbol
+        :param granularity: seconds covered by each bar
+        """
+        with self.bars_lock:
+            aggregators = self.bar_aggregators.setdefault(symbol, {})
+            if granularity in aggregators:
+                return
+            aggregator = BarAggregator(symbol, granularity, self.BAR_PRICE_FIELD, self.BAR_VOLUME_FIELD)
+            ticks = self.tick_store.range(symbol, aggregator.bar_start(time.time()))
+            if ticks is not None:
+                fields = [field for field in ticks if field != 'timestamp']
+                for i, timestamp in enumerate(ticks['timestamp'].tolist()):
+                    aggregator.update(timestamp, {field: float(ticks[field][i]) for field in fields})
+            aggregators[granularity] = aggregator
+
+    def update_bars(self, symbol, data, timestamp):
+        """
+        Add a tick to the bars of its symbol.
+
+        :param symbol: symbol of the tick
+        :param data: dict of tick fields
+        :param timestamp: time of the tick
+        :return: list of the bars completed by the tick
+        """
+        with self.bars_lock:
+            return self._update_bars(symbol, data, timestamp)
+
+    def _update_bars(self, symbol, data, timestamp):
+        # under the bars lock
+        aggregators = self.bar_aggregators.get(symbol)
+        if not aggregators:
+            return []
+        completed = [aggregator.update(timestamp, data) for aggregator in aggregators.values()]
+        return [bar for bar in completed if bar is not None]
+
+    def get_current_bar(self, symbol, granularity):
+        """
+        :param symbol: requested symbol
+        :param granularity: seconds covered by each bar
+        :return: copy of the bar being built, None if there is none
+        """
+        with self.bars_lock:
+            aggregator = self.bar_aggregators.get(symbol, {}).get(granularity)
+            return aggregator.current_bar() if aggregator is not None else None
+
+    def record_tick(self, symbol, data, timestamp=None):
+        """
+        Store a tick in the tick store and in the persistent storage, and publish it to the event feed subscribers.
+        Bars completed by the tick are published to the event feed subscribers to them.
+        Feeds, current data and bulk data requests are then served from the stores.
+
+        :param symbol: symbol of the tick
+        :param data: dict of numeric field values
+        :param timestamp: time of the tick, now if None
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.bars_lock:
+            # stored and aggregated at once, an aggregator added in between would count the tick twice,
+            # rebuilding its bar from the tick store and then being updated with it
+            self.tick_store.append(symbol, data, timestamp)
+            bars = self._update_bars(symbol, data, timestamp)
+        if self.tick_storage is not None:
+            try:
+                self.tick_storage.append(symbol, data, timestamp)
+            except (ValueError, OSError) as e:
+                # the tick is still published, only its history is missing
+                self.logger.error('Could not store tick of %s: %s' % (symbol, e))
+        self.publish(symbol, data)
+        for bar in bars:
+            self.publish(symbol, bar, bar['granularity'])
+
+    def get_current_data(self, symbol):
+        """
+        :param symbol: requested symbol
+        :return: dict with the timestamp and fields of the latest tick of the symbol, None if unknown
+        """
+        return self.tick_store.latest(symbol)
+
+    def start_backfill(self):
+        """
+        Set up the backfill of the persistent storage, if the interface has a fetcher, and backfill
+        the configured symbols in the background.
+        """
+        fetcher = self.get_fetcher()
+        if fetcher is None:
+            return
+        options = dict(self.BACKFILL_OPTIONS)
+        symbols = options.pop('symbols', [])
+        lookback = options.pop('lookback', 86400)
+        self.backfiller = Backfiller(self.tick_storage, fetcher, **options)
+
+        def backfill_symbols():
+            now = time.time()
+            for symbol in symbols:
+                added = self.backfill(symbol, now - lookback, now)
+                self.logger.info('Backfilled %d ticks of %s' % (added, symbol))
+
+        threading.Thread(target=backfill_symbols, name='backfill_boot', daemon=True).start()
+
+    def backfill(self, symbol, start_time, end_time=None):
+        """
+        Fill the gaps of the persistent history of a symbol, blocking until done.
+
+        :param symbol: symbol to backfill
+        :param start_time: start of the time range
+        :param end_time: end of the time range, now if None
+        :return: number of ticks added, 0 if backfill is not available
+        """
+        if self.backfiller is None:
+            return 0
+        return self.backfiller.backfill(symbol, start_time, time.time() if end_time is None else end_time)
+
+    def has_history(self, symbol):
+        """
+        :param symbol: requested symbol
+        :return: True if there are stored ticks of the symbol
+        """
+        if symbol in self.tick_store.symbols():
+            return True
+        return self.tick_storage is not None and symbol in self.tick_storage.symbols()
+
+    def _history(self, symbol, start_time, end_time):
+        # the persistent storage holds the whole history, the tick store only the latest ticks
+        if self.tick_storage is not None:
+            return self.tick_storage.scan(symbol, start_time, end_time)
+        ticks = self.tick_store.range(symbol, start_time, end_time)
+        return [ticks] if ticks is not None else []
+
+    def get_bulk_data(self, symbol, start_time=None, end_time=None):
+        """
+        :param symbol: requested symbol
+        :param start_time: lower bound of the tick timestamps, None for no bound
+        :param end_time: upper bound of the tick timestamps, None for no bound
+        :return: dict of lists, the timestamps and one for each field, None if the symbol is unknown
+        """
+        if not self.has_history(symbol):
+            return None
+        ticks = {}
+        for part in self._history(symbol, start_time, end_time):
+            for field, column in part.items():
+                ticks.setdefault(field, []).extend(column.tolist())
+        return ticks
+
+    def iter_bulk_data(self, symbol, start_time=None, end_time=None, chunk_size=None):
+        """
+        Same as get_bulk_data, but split in chunks of consecutive ticks, converted one at a time.
+        Ticks read from the persistent storage are memory-mapped, only the chunk being converted is loaded.
+
+        :param symbol: requested symbol
+        :param start_time: lower bound of the tick timestamps, None for no bound
+        :param end_time: upper bound of the tick timestamps, None for no bound
+        :param chunk_size: maximum number of ticks in a chunk, BULK_CHUNK_SIZE if None
+        :return: generator of dicts of lists, the timestamps and one for each field
+        """
+        chunk_size = chunk_size or self.BULK_CHUNK_SIZE
+        for ticks in self._history(symbol, start_time, end_time):
+            for start in range(0, len(ticks['timestamp']), chunk_size):
+                yield {field: column[start:start + chunk_size].tolist() for field, column in ticks.items()}
+
     def interface_main_cycle(self):
+        """
+        Main body of the interface, called in the run loop once the interface is booted.
+        Should not block: periodic work, e.g. polling an exchange, is scheduled with run_loop.call_every.
+        """
+        pass
+
+    def on_subscriptions_change(self):
+        """Called in the run loop after subscriptions are added or removed"""
         pass
 
     def make_rest_request(self):
         pass
 
+    def get_fetcher(self):
+        """
+        :return: backfill.Fetcher of the historical ticks of the interface, None if not supported
+        """
+        pass
+
     def create_websocket_stream(self):
         pass
 
@@ -92,3 +447,17 @@ class MarketInterface:
 
     def get_data(self, sub_handle):
         pass
+
+    def get_symbol_data(self, symbol, sub_handle):
+        """
+        Feed data for a symbol, sent as is to all the subscribers to it.
+        By default the latest tick in the tick store, or if there is none the result of get_data
+        on one of the subscriptions to the symbol.
+
+        :param symbol: requested symbol
+        :param sub_handle: handle of one of the subscriptions to the symbol
+        """
+        tick = self.tick_store.latest(symbol)
+        if tick is not None:
+            return tick
+        return self.get_data(sub_handle)
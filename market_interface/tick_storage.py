@@ -0,0 +1,570 @@
+import os
+import json
+import time
+import logging
+import calendar
+import threading
+
+import numpy as np
+
+
+"""
+Persistent tick history of a market interface.
+
+Ticks are stored column-wise, in append-only segments grouped by symbol and (UTC) day:
+
+    <root>/<symbol>/fields.json                 names of the numeric fields of the symbol
+    <root>/<symbol>/coverage.json               time ranges known to be complete, see add_coverage
+    <root>/<symbol>/<YYYY-MM-DD>/<n>.timestamp  timestamps of segment n, one little-endian float64 per tick
+    <root>/<symbol>/<YYYY-MM-DD>/<n>.<field>    values of a field, same layout
+    <root>/<symbol>/<YYYY-MM-DD>/<n>.index      time index, written when the segment is sealed
+
+The directory of a symbol is its name, with the path separators and '%' percent-encoded, so that
+symbols like BTC/USD can be stored, see symbol_directory.
+Ticks are sorted by timestamp within a segment. Live ticks are appended to one open segment per
+symbol, data written in bulk (e.g. backfill) goes to new segments, which may overlap the others
+until the day is compacted into a single sorted segment.
+Reads memory-map the column files, so range queries are a few binary searches and return views
+on the files, without parsing or copying anything.
+"""
+
+# on-disk type of all the columns
+DTYPE = np.dtype('<f8')
+TIMESTAMP = 'timestamp'
+INDEX = 'index'
+FIELDS_FILE = 'fields.json'
+COVERAGE_FILE = 'coverage.json'
+DAY_FORMAT = '%Y-%m-%d'
+
+# storage defaults
+# ticks buffered in memory by the writer of a symbol before being written to disk
+DEFAULT_FLUSH_SIZE = 4096
+# one timestamp out of index_stride is kept in the index of a segment
+DEFAULT_INDEX_STRIDE = 4096
+
+# index layout: number of ticks, first and last timestamp, stride, then the sampled timestamps
+INDEX_HEADER = 4
+# characters of the symbols escaped in their directory names, '%' first
+ESCAPED = ['%', '/', '\\']
+
+
+def day_of(timestamp):
+    """
+    :param timestamp: unix time
+    :return: UTC day of the timestamp, as YYYY-MM-DD
+    """
+    return time.strftime(DAY_FORMAT, time.gmtime(timestamp))
+
+
+def day_bounds(day):
+    """
+    :param day: day as YYYY-MM-DD
+    :return: (start, end) unix times of the day, end excluded
+    """
+    start = calendar.timegm(time.strptime(day, DAY_FORMAT))
+    return start, start + 86400
+
+
+def symbol_directory(symbol):
+    """
+    :param symbol: symbol name
+    :return: name of the directory of the symbol, without path separators
+    """
+    if symbol in ('', '.', '..'):
+        raise ValueError('Invalid symbol %r' % symbol)
+    for char in ESCAPED:
+        symbol = symbol.replace(char, '%%%02X' % ord(char))
+    return symbol
+
+
+def directory_symbol(name):
+    """
+    :param name: name of the directory of a symbol
+    :return: the symbol, see symbol_directory
+    """
+    for char in reversed(ESCAPED):
+        name = name.replace('%%%02X' % ord(char), char)
+    return name
+
+
+class Segment:
+    """
+    Read-only view of a segment, its columns are memory-mapped.
+    Rows missing from some of the columns, left by an interrupted write, are ignored.
+    """
+    def __init__(self, prefix, fields):
+        """
+        Map segment.
+
+        :param prefix: path of the segment files, without extension
+        :param fields: names of the fields of the symbol
+        """
+        self.prefix = prefix
+        self.fields = fields
+        self.number = int(os.path.basename(prefix))
+
+        columns = {}
+        for column in (TIMESTAMP,) + fields:
+            path = '%s.%s' % (prefix, column)
+            size = os.path.getsize(path) // DTYPE.itemsize if os.path.exists(path) else 0
+            # empty files can't be mapped
+            columns[column] = np.memmap(path, dtype=DTYPE, mode='r', shape=(size,)) if size else np.empty(0, DTYPE)
+        count = min(len(column) for column in columns.values())
+        self.columns = {name: column[:count] for name, column in columns.items()}
+
+        index_path = '%s.%s' % (prefix, INDEX)
+        self.index = np.fromfile(index_path, dtype=DTYPE) if os.path.exists(index_path) else None
+
+    @property
+    def sealed(self):
+        return self.index is not None
+
+    def __len__(self):
+        return len(self.columns[TIMESTAMP])
+
+    def bounds(self):
+        """
+        :return: (first, last) timestamps of the segment, None if empty
+        """
+        if self.index is not None:
+            return float(self.index[1]), float(self.index[2])
+        timestamps = self.columns[TIMESTAMP]
+        if not len(timestamps):
+            return None
+        return float(timestamps[0]), float(timestamps[-1])
+
+    def _search(self, value, side):
+        # the index narrows the search to one stride, so only a few pages of the column are touched
+        timestamps = self.columns[TIMESTAMP]
+        lo, hi = 0, len(timestamps)
+        if self.index is not None:
+            stride = int(self.index[3])
+            j = int(np.searchsorted(self.index[INDEX_HEADER:], value, side=side))
+            lo, hi = max(j - 1, 0) * stride, min(j * stride, hi)
+        return lo + int(np.searchsorted(timestamps[lo:hi], value, side=side))
+
+    def slice(self, start=None, end=None):
+        """
+        :param start: lower bound of the timestamps, included, None for no bound
+        :param end: upper bound of the timestamps, included, None for no bound
+        :return: dict of views on the columns, for the ticks in the range
+        """
+        lo = 0 if start is None else self._search(start, 'left')
+        hi = len(self) if end is None else self._search(end, 'right')
+        return {name: column[lo:hi] for name, column in self.columns.items()}
+
+
+def write_index(prefix, timestamps, stride):
+    """
+    Write the time index of a segment, which seals it.
+
+    :param prefix: path of the segment files, without extension
+    :param timestamps: sorted timestamps of the segment
+    :param stride: one timestamp out of stride is kept
+    """
+    if len(timestamps):
+        header = [len(timestamps), timestamps[0], timestamps[-1], stride]
+    else:
+        header = [0, np.inf, -np.inf, stride]
+    index = np.concatenate([np.array(header, dtype=DTYPE), np.asarray(timestamps[::stride], dtype=DTYPE)])
+    # written aside and renamed, a segment is either sealed with a complete index or not sealed
+    path = '%s.%s' % (prefix, INDEX)
+    index.tofile(path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def write_segment(prefix, fields, columns, stride):
+    """
+    Write a whole sealed segment at once.
+
+    :param prefix: path of the segment files, without extension
+    :param fields: names of the fields of the symbol
+    :param columns: dict of sorted columns, the timestamps and one for each field
+    :param stride: stride of the time index
+    """
+    for column in (TIMESTAMP,) + fields:
+        np.asarray(columns[column], dtype=DTYPE).tofile('%s.%s' % (prefix, column))
+    write_index(prefix, columns[TIMESTAMP], stride)
+
+
+class SegmentWriter:
+    """
+    Appends ticks to the open segment of a symbol.
+    Ticks are buffered in memory, and written to the column files every flush_size ticks.
+    """
+    def __init__(self, prefix, day, fields, flush_size=DEFAULT_FLUSH_SIZE, index_stride=DEFAULT_INDEX_STRIDE):
+        """
+        Open segment for writing.
+
+        :param prefix: path of the segment files, without extension
+        :param day: day of the ticks of the segment
+        :param fields: names of the fields of the symbol
+        :param flush_size: ticks buffered before being written
+        :param index_stride: stride of the time index, written when the segment is sealed
+        """
+        self.prefix = prefix
+        self.day = day
+        self.fields = fields
+        self.index_stride = index_stride
+
+        self.columns = (TIMESTAMP,) + fields
+        self.files = [open('%s.%s' % (prefix, column), 'ab') for column in self.columns]
+        # one row per column, so the ticks of a column are contiguous
+        self.buffer = np.empty((len(self.columns), flush_size), dtype=DTYPE)
+        self.buffered = 0
+        self.last = None
+
+    def append(self, timestamp, values):
+        """
+        :param timestamp: time of the tick, not lower than the one of the previous tick
+        :param values: field values, in the order of the fields
+        """
+        if self.last is not None and timestamp < self.last:
+            raise ValueError('Tick at %f is older than the latest one' % timestamp)
+        self.buffer[0, self.buffered] = timestamp
+        self.buffer[1:, self.buffered] = values
+        self.buffered += 1
+        self.last = timestamp
+        if self.buffered == self.buffer.shape[1]:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered ticks"""
+        if not self.buffered:
+            return
+        for i, f in enumerate(self.files):
+            f.write(self.buffer[i, :self.buffered].tobytes())
+            f.flush()
+        self.buffered = 0
+
+    def seal(self):
+        """Write the buffered ticks and the index, no more ticks can be appended"""
+        self.flush()
+        for f in self.files:
+            f.close()
+        write_index(self.prefix, Segment(self.prefix, self.fields).columns[TIMESTAMP], self.index_stride)
+
+
+class TickStorage:
+    """
+    Persistent, columnar tick history, see module description.
+    Safe to use from multiple threads.
+    """
+    def __init__(self, root, flush_size=DEFAULT_FLUSH_SIZE, index_stride=DEFAULT_INDEX_STRIDE):
+        """
+        Open storage, creating it if needed.
+
+        :param root: directory holding the storage
+        :param flush_size: ticks buffered in memory for each symbol before being written
+        :param index_stride: one timestamp out of index_stride is kept in the time index of a segment
+        """
+        self.logger = logging.getLogger('tick_storage')
+        self.root = root
+        self.flush_size = flush_size
+        self.index_stride = index_stride
+        os.makedirs(root, exist_ok=True)
+
+        # field names of each symbol
+        self.fields = {}
+        # open segment of each symbol
+        self.writers = {}
+        # sealed segments, which never change, indexed by (symbol, day) and number
+        self.sealed = {}
+
+        self.lock = threading.RLock()
+
+    def _symbol_path(self, symbol):
+        return os.path.join(self.root, symbol_directory(symbol))
+
+    def _get_fields(self, symbol, names=None):
+        # fields of a symbol are the ones of its first tick, stored along with its segments
+        fields = self.fields.get(symbol)
+        if fields is not None:
+            return fields
+        path = os.path.join(self._symbol_path(symbol), FIELDS_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                fields = tuple(json.load(f))
+        elif names is not None:
+            fields = tuple(name for name in names if name != TIMESTAMP)
+            os.makedirs(self._symbol_path(symbol), exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(fields, f)
+        else:
+            return None
+        self.fields[symbol] = fields
+        return fields
+
+    def _next_prefix(self, symbol, day):
+        directory = os.path.join(self._symbol_path(symbol), day)
+        os.makedirs(directory, exist_ok=True)
+        numbers = [int(name.split('.')[0]) for name in os.listdir(directory) if name.split('.')[0].isdigit()]
+        return os.path.join(directory, '%06d' % (max(numbers, default=0) + 1))
+
+    def _seal_writer(self, symbol):
+        writer = self.writers.pop(symbol, None)
+        if writer is not None:
+            writer.seal()
+
+    def append(self, symbol, data, timestamp=None):
+        """
+        Store a live tick. Ticks of a symbol must come in chronological order.
+
+        :param symbol: symbol of the tick
+        :param data: dict of numeric field values
+        :param timestamp: time of the tick, now if None
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            fields = self._get_fields(symbol, data.keys())
+            day = day_of(timestamp)
+            writer = self.writers.get(symbol)
+            if writer is None or writer.day != day:
+                self._seal_writer(symbol)
+                writer = SegmentWriter(self._next_prefix(symbol, day), day, fields,
+                                       self.flush_size, self.index_stride)
+                self.writers[symbol] = writer
+            writer.append(timestamp, [data[field] for field in fields])
+
+    def write(self, symbol, columns):
+        """
+        Store ticks in bulk, in new segments. They don't need to be sorted, nor to come after the stored ones.
+
+        :param symbol: symbol of the ticks
+        :param columns: dict of columns, the timestamps and one for each field
+        :return: number of ticks written
+        """
+        timestamps = np.asarray(columns[TIMESTAMP], dtype=DTYPE)
+        if not len(timestamps):
+            return 0
+        with self.lock:
+            fields = self._get_fields(symbol, columns.keys())
+            order = np.argsort(timestamps, kind='stable')
+            columns = {name: np.asarray(columns[name], dtype=DTYPE)[order] for name in (TIMESTAMP,) + fields}
+            timestamps = columns[TIMESTAMP]
+
+            # split by day
+            start = 0
+            while start < len(timestamps):
+                day = day_of(timestamps[start])
+                end = int(np.searchsorted(timestamps, day_bounds(day)[1], side='left'))
+                write_segment(self._next_prefix(symbol, day), fields,
+                              {name: column[start:end] for name, column in columns.items()},
+                              self.index_stride)
+                start = end
+        return len(timestamps)
+
+    def flush(self):
+        """Write the ticks buffered by the writers"""
+        with self.lock:
+            for writer in self.writers.values():
+                writer.flush()
+
+    def close(self):
+        """Seal the open segments"""
+        with self.lock:
+            for symbol in list(self.writers):
+                self._seal_writer(symbol)
+
+    def symbols(self):
+        return sorted(directory_symbol(name) for name in os.listdir(self.root)
+                      if os.path.exists(os.path.join(self.root, name, FIELDS_FILE)))
+
+    def days(self, symbol):
+        """
+        :param symbol: requested symbol
+        :return: sorted days with stored ticks
+        """
+        path = self._symbol_path(symbol)
+        if not os.path.isdir(path):
+            return []
+        return sorted(name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name)))
+
+    def segments(self, symbol, day):
+        """
+        :param symbol: requested symbol
+        :param day: requested day
+        :return: segments of the day, in order of first timestamp
+        """
+        with self.lock:
+            fields = self._get_fields(symbol)
+            directory = os.path.join(self._symbol_path(symbol), day)
+            if fields is None or not os.path.isdir(directory):
+                return []
+            writer = self.writers.get(symbol)
+            if writer is not None and writer.day == day:
+                # make the buffered ticks visible
+                writer.flush()
+
+            sealed = self.sealed.setdefault((symbol, day), {})
+            numbers = sorted({int(name.split('.')[0]) for name in os.listdir(directory)
+                              if name.split('.')[0].isdigit()})
+            segments = []
+            for number in numbers:
+                segment = sealed.get(number)
+                if segment is None:
+                    segment = Segment(os.path.join(directory, '%06d' % number), fields)
+                    # open segments grow, they are mapped again every time
+                    if segment.sealed:
+                        sealed[number] = segment
+                if len(segment):
+                    segments.append(segment)
+            return sorted(segments, key=lambda s: s.bounds())
+
+    def scan(self, symbol, start=None, end=None):
+        """
+        Get the ticks in a time range, without copying them.
+
+        :param symbol: requested symbol
+        :param start: lower bound of the timestamps, included, None for no bound
+        :param end: upper bound of the timestamps, included, None for no bound
+        :return: list of dicts of column views, in chronological order. Each run of segments overlapping
+                each other, which are not compacted yet, is merged in a single copy
+        """
+        parts = []
+        for day in self.days(symbol):
+            day_start, day_end = day_bounds(day)
+            if (start is not None and day_end <= start) or (end is not None and day_start > end):
+                continue
+            for segment in self.segments(symbol, day):
+                first, last = segment.bounds()
+                if (start is not None and last < start) or (end is not None and first > end):
+                    continue
+                part = segment.slice(start, end)
+                if len(part[TIMESTAMP]):
+                    parts.append(part)
+
+        # runs of overlapping parts, only those are copied
+        runs = []
+        run_end = None
+        for part in parts:
+            if runs and part[TIMESTAMP][0] < run_end:
+                runs[-1].append(part)
+                run_end = max(run_end, part[TIMESTAMP][-1])
+            else:
+                runs.append([part])
+                run_end = part[TIMESTAMP][-1]
+        return [run[0] if len(run) == 1 else merge(run) for run in runs]
+
+    def range(self, symbol, start=None, end=None):
+        """
+        :param symbol: requested symbol
+        :param start: lower bound of the timestamps, included, None for no bound
+        :param end: upper bound of the timestamps, included, None for no bound
+        :return: dict of arrays, the timestamps and one for each field, in chronological order,
+                None if the symbol is unknown
+        """
+        fields = self._get_fields(symbol)
+        if fields is None:
+            return None
+        parts = self.scan(symbol, start, end)
+        if not parts:
+            return {name: np.empty(0, DTYPE) for name in (TIMESTAMP,) + fields}
+        return merge(parts)
+
+    def coverage(self, symbol):
+        """
+        :param symbol: requested symbol
+        :return: sorted, disjoint [start, end] time ranges whose ticks are all stored
+        """
+        path = os.path.join(self._symbol_path(symbol), COVERAGE_FILE)
+        with self.lock:
+            if not os.path.exists(path):
+                return []
+            with open(path) as f:
+                return json.load(f)
+
+    def add_coverage(self, symbol, start, end):
+        """
+        Mark a time range as complete, e.g. after backfilling it, even if it holds no ticks.
+
+        :param symbol: symbol of the range
+        :param start: start of the range
+        :param end: end of the range
+        """
+        with self.lock:
+            ranges = sorted(self.coverage(symbol) + [[start, end]])
+            merged = [ranges[0]]
+            for lo, hi in ranges[1:]:
+                if lo <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], hi)
+                else:
+                    merged.append([lo, hi])
+
+            directory = self._symbol_path(symbol)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, COVERAGE_FILE)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(merged, f)
+            os.replace(path + '.tmp', path)
+
+    def compact(self, symbol, day):
+        """
+        Rewrite the segments of a day as a single sorted and sealed segment, dropping duplicate ticks.
+        The new segment is complete before the old ones are removed, so an interruption can leave
+        duplicates around, but never lose ticks; they are dropped by the next compaction.
+
+        :param symbol: symbol to compact
+        :param day: day to compact
+        :return: True if the day was rewritten
+        """
+        with self.lock:
+            writer = self.writers.get(symbol)
+            if writer is not None and writer.day == day:
+                self._seal_writer(symbol)
+            segments = self.segments(symbol, day)
+            if len(segments) == 1 and segments[0].sealed:
+                return False
+
+            fields = self._get_fields(symbol)
+            directory = os.path.join(self._symbol_path(symbol), day)
+            old = {name.split('.')[0] for name in os.listdir(directory)}
+            if segments:
+                columns = merge([s.columns for s in segments], unique=True)
+                write_segment(self._next_prefix(symbol, day), fields, columns, self.index_stride)
+            # also removes empty segments, and the leftovers of interrupted writes
+            for name in os.listdir(directory):
+                if name.split('.')[0] in old:
+                    os.remove(os.path.join(directory, name))
+            self.sealed.pop((symbol, day), None)
+            self.logger.info('Compacted %d segments of %s on %s' % (len(segments), symbol, day))
+            return True
+
+    def compact_all(self):
+        """
+        Compact every day of every symbol, except the ones still being written.
+
+        :return: number of days rewritten
+        """
+        compacted = 0
+        for symbol in self.symbols():
+            writer = self.writers.get(symbol)
+            for day in self.days(symbol):
+                if writer is None or writer.day != day:
+                    compacted += self.compact(symbol, day)
+        return compacted
+
+
+def merge(parts, unique=False):
+    """
+    Merge columnar parts into a single sorted copy.
+
+    :param parts: list of dicts of columns, with the same keys
+    :param unique: True to drop duplicate ticks, equal in all the columns
+    :return: dict of arrays
+    """
+    names = list(parts[0])
+    columns = {name: np.concatenate([part[name] for part in parts]) for name in names}
+    if unique:
+        # sort by all the columns, timestamp first, so that duplicates are next to each other
+        keys = [columns[name] for name in reversed(names) if name != TIMESTAMP] + [columns[TIMESTAMP]]
+        order = np.lexsort(keys)
+    else:
+        order = np.argsort(columns[TIMESTAMP], kind='stable')
+    columns = {name: column[order] for name, column in columns.items()}
+    if unique and len(order):
+        rows = np.column_stack([columns[name] for name in names])
+        keep = np.ones(len(rows), dtype=bool)
+        keep[1:] = np.any(rows[1:] != rows[:-1], axis=1)
+        columns = {name: column[keep] for name, column in columns.items()}
+    return columns
@@ -0,0 +1,143 @@
+import time
+import threading
+
+import numpy as np
+
+# default number of ticks kept for each symbol
+DEFAULT_CAPACITY = 100000
+
+
+class SymbolBuffer:
+    """
+    Fixed capacity ring buffer holding the latest ticks of a symbol.
+    Ticks are stored column-wise in preallocated arrays, a timestamp column and one column per
+    field, so appends don't allocate and time range queries are a couple of binary searches.
+    Timestamps must not decrease.
+    """
+    def __init__(self, fields, capacity=DEFAULT_CAPACITY):
+        """
+        Initialize buffer.
+
+        :param fields: names of the numeric fields of the ticks
+        :param capacity: maximum number of ticks kept, older ones get overwritten
+        """
+        self.fields = tuple(fields)
+        self.capacity = capacity
+
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros((capacity, len(self.fields)), dtype=np.float64)
+        # number of ticks appended so far, the next one goes in count % capacity
+        self.count = 0
+
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, data):
+        """
+        :param timestamp: time of the tick, not lower than the one of the previous tick
+        :param data: dict of field values, must contain all the fields of the buffer
+        """
+        with self.lock:
+            if self.count and timestamp < self.timestamps[(self.count - 1) % self.capacity]:
+                raise ValueError('Tick at %f is older than the latest one' % timestamp)
+            index = self.count % self.capacity
+            self.timestamps[index] = timestamp
+            self.values[index] = [data[field] for field in self.fields]
+            self.count += 1
+
+    def latest(self):
+        """
+        :return: dict with the timestamp and the fields of the latest tick, None if there is none
+        """
+        with self.lock:
+            if not self.count:
+                return None
+            index = (self.count - 1) % self.capacity
+            tick = dict(zip(self.fields, self.values[index].tolist()))
+            tick['timestamp'] = float(self.timestamps[index])
+            return tick
+
+    def _segments(self):
+        # slices of the arrays holding the ticks, in chronological order
+        if self.count <= self.capacity:
+            return [slice(0, self.count)]
+        start = self.count % self.capacity
+        return [slice(start, self.capacity), slice(0, start)]
+
+    def range(self, start=None, end=None):
+        """
+        Get the ticks in a time range.
+
+        :param start: lower bound of the timestamps, included, None for no bound
+        :param end: upper bound of the timestamps, included, None for no bound
+        :return: dict of arrays, the timestamps and one for each field, in chronological order
+        """
+        with self.lock:
+            timestamps, values = [], []
+            for segment in self._segments():
+                ts = self.timestamps[segment]
+                lo = 0 if start is None else np.searchsorted(ts, start, side='left')
+                hi = len(ts) if end is None else np.searchsorted(ts, end, side='right')
+                timestamps.append(ts[lo:hi])
+                values.append(self.values[segment][lo:hi])
+            timestamps = np.concatenate(timestamps)
+            values = np.concatenate(values)
+
+        result = {'timestamp': timestamps}
+        for i, field in enumerate(self.fields):
+            result[field] = values[:, i]
+        return result
+
+
+class TickStore:
+    """
+    In-memory history of the ticks received by a market interface, one SymbolBuffer per symbol.
+    The fields of a symbol are the ones of its first tick.
+    """
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        """
+        :param capacity: maximum number of ticks kept for each symbol
+        """
+        self.capacity = capacity
+        self.buffers = {}
+        self.lock = threading.Lock()
+
+    def append(self, symbol, data, timestamp=None):
+        """
+        Store a tick.
+
+        :param symbol: symbol of the tick
+        :param data: dict of numeric field values
+        :param timestamp: time of the tick, now if None
+        """
+        buffer = self.buffers.get(symbol)
+        if buffer is None:
+            with self.lock:
+                buffer = self.buffers.get(symbol)
+                if buffer is None:
+                    buffer = SymbolBuffer(data.keys(), self.capacity)
+                    self.buffers[symbol] = buffer
+        buffer.append(time.time() if timestamp is None else timestamp, data)
+
+    def latest(self, symbol):
+        """
+        :param symbol: requested symbol
+        :return: dict with the timestamp and fields of the latest tick, None if there is none
+        """
+        buffer = self.buffers.get(symbol)
+        return buffer.latest() if buffer is not None else None
+
+    def range(self, symbol, start=None, end=None):
+        """
+        :param symbol: requested symbol
+        :param start: lower bound of the timestamps, included, None for no bound
+        :param end: upper bound of the timestamps, included, None for no bound
+        :return: dict of arrays, see SymbolBuffer.range, None if the symbol is unknown
+        """
+        buffer = self.buffers.get(symbol)
+        return buffer.range(start, end) if buffer is not None else None
+
+    def symbols(self):
+        return list(self.buffers)
@@ -1,8 +1,8 @@
 import json
-import time
 import logging
 
 from common.logging import setup_logger
+from common.run_loop import RunLoop
 
 from portfolio_manager.portfolio_api import PortfolioApiServer
 from portfolio_manager.strategy_lifecycle import init, start, stop
@@ -33,6 +33,8 @@ class PortfolioManager:
         self.HOST = self.config['host']
         self.PORT = self.config['port']
         self.REFRESH_TIMEOUT = self.config['refresh_timeout']
+        # optional settings of the manager server, see ApiServer
+        self.SERVER_OPTIONS = self.config.get('api_server', {})
 
         self.TEST_MONEY_AMOUNT = 1000
 
@@ -51,15 +53,16 @@ class PortfolioManager:
         #   port: port of the server
         self.market_interfaces = {}
 
-        # set to true to kill main process
-        self.stop_manager = False
+        # checks the strategies and interfaces, in the main thread
+        self.run_loop = RunLoop('manager_loop')
 
         # start manager server
         try:
             self.logger.debug('Starting server...')
             portfolio_server = PortfolioApiServer(self.HOST,
                                                   self.PORT,
-                                                  self)
+                                                  self,
+                                                  **self.SERVER_OPTIONS)
             portfolio_server.start()
         except Exception as e:
             self.logger.error('Could not start server: %s' % e)
@@ -69,39 +72,41 @@ class PortfolioManager:
 
     def manager_main_cycle(self):
         """
-        Cycle that periodically checks registered strategies and interfaces.
+        Run the manager until shutdown: strategies and interfaces are checked every
+        REFRESH_TIMEOUT seconds, and right away when they register, see on_registration.
+        """
+        self.run_loop.call_every(self.REFRESH_TIMEOUT, self.check_strategies)
+        self.run_loop.run()
+
+    def shutdown(self):
+        """Stop the main cycle. Safe to call from any thread."""
+        self.run_loop.stop()
+
+    def on_registration(self):
+        """Called by the request handlers when a strategy or an interface registers"""
+        self.run_loop.call_soon(self.check_strategies)
+
+    def check_strategies(self):
+        """
+        Check up on the registered strategies.
         Handles sending lifecycle signals, resource reallocation commands and
         in the future pings to check availability.
         """
-        last_strats = None
-        last_interfs = None
-        while not self.stop_manager:
-            # debug, when strategies or interfaces structs change print them
-            if last_interfs != self.market_interfaces or last_strats != self.strategies:
-                print("Strategies: %r" % self.strategies)
-                print("Interfaces: %r" % self.market_interfaces)
-                last_strats = self.strategies.copy()
-                last_interfs = self.market_interfaces.copy()
-
-            # iterate over strategies, check up on them
-            for strat_id in self.strategies:
-                strategy = self.strategies[strat_id]
-                # try to initialize idle strategies
-                if strategy['status'] == 'IDLE':
-                    # initialize strategy with test amount of money
-                    strategy['allocated_resources'] = self.TEST_MONEY_AMOUNT
-                    if init(address=strategy['address'],
-                            port=strategy['port'],
-                            resources=strategy['allocated_resources']):
-                        strategy['status'] = 'INITIALIZING'
-                elif strategy['status'] == 'INITIALIZING':
-                    # TODO define behavior if strategy is initializing
-                    pass
-                elif strategy['status'] == 'RUNNING':
-                    # TODO define behavior if strategy is running
-                    pass
-
-            time.sleep(self.REFRESH_TIMEOUT)
+        for strat_id, strategy in list(self.strategies.items()):
+            # try to initialize idle strategies
+            if strategy['status'] == 'IDLE':
+                # initialize strategy with test amount of money
+                strategy['allocated_resources'] = self.TEST_MONEY_AMOUNT
+                if init(address=strategy['address'],
+                        port=strategy['port'],
+                        resources=strategy['allocated_resources']):
+                    strategy['status'] = 'INITIALIZING'
+            elif strategy['status'] == 'INITIALIZING':
+                # TODO define behavior if strategy is initializing
+                pass
+            elif strategy['status'] == 'RUNNING':
+                # TODO define behavior if strategy is running
+                pass
 
 
 # start manager
@@ -13,7 +13,7 @@ class PortfolioApiServer (ApiServer):
     Runs in parallel with the main portfolio manager thread and handles
     incoming requests.
     """
-    def __init__(self, host, port, portfolio_manager):
+    def __init__(self, host, port, portfolio_manager, **server_options):
         """
         Initializes the server thread with the parameters needed for operation.
 
@@ -21,8 +21,9 @@ class PortfolioApiServer (ApiServer):
         :param port: port of the server
         :param portfolio_manager: parent portfolio manager, containing the data concerning
                                 strategies and interfaces
+        :param server_options: ApiServer options (mode, max_workers, ...)
         """
-        super().__init__(host, port)
+        super().__init__(host, port, **server_options)
         self.logger = logging.getLogger('portfolio_api_server')
         self.logger.info('Portfolio api server created!')
 
@@ -1,20 +1,23 @@
 import logging
 
-from common.messaging import message_to_address
+from common.codec import negotiate, get_codec
+from common.messaging import message_to_address, get_connection, stream_from_address
 from common.request_handler import RequestHandler
 
 
 class PortfolioRequestHandler (RequestHandler):
     """
     Takes care of handling incoming requests.
-    Spawned by the main server thread, it runs parallel to the other threads and exits when the request
-    has been handled.
+    Spawned by the main server thread, it runs parallel to the other threads and exits when the
+    connection it serves is closed.
 
     Recognized requests:
         REGISTER_STRATEGY: register new strategy with the manager
         REGISTER_MARKET_INTERFACE: register new market interface with the manager
         SUBSCRIBE: subscribe to market interface data feed
         UNSUBSCRIBE: unsubscribe from data feed
+        FEED_RESYNC: get a full snapshot on a delta data feed
+        BULK_DATA: get the history of a symbol, streamed in chunks
     """
     def __init__(self, client_socket, portfolio_manager):
         """
@@ -33,7 +36,9 @@ class PortfolioRequestHandler (RequestHandler):
             'REGISTER_STRATEGY': self.register_strategy,
             'REGISTER_MARKET_INTERFACE': self.register_market_interface,
             'INTERFACE_SUBSCRIBE': self.subscribe,
-            'INTERFACE_UNSUBSCRIBE': self.unsubscribe
+            'INTERFACE_UNSUBSCRIBE': self.unsubscribe,
+            'FEED_RESYNC': self.resync,
+            'BULK_DATA': self.bulk_data
         }
 
     def register_strategy(self, request_data):
@@ -46,11 +51,14 @@ class PortfolioRequestHandler (RequestHandler):
             strategy_id: unique ID of the strategy
             strategy_address: IP address of the strategy server, to which the other components will send messages
             strategy_port: port of said strategy server
+            codecs: wire codecs supported by the strategy, in order of preference (optional)
+            hostname: host the strategy runs on, None to never use local transports (optional)
         """
 
         strategy_id = request_data['strategy_id']
         strategy_address = request_data['strategy_address']
         strategy_port = request_data['strategy_port']
+        codec = negotiate(request_data.get('codecs', []))
 
         # if strategy is already registered, a restart must have occurred,
         # so the sanest response for now is to refresh its entry
@@ -65,14 +73,20 @@ class PortfolioRequestHandler (RequestHandler):
             'address': strategy_address,
             'port': strategy_port,
             'status': 'IDLE',
-            'allocated_resources': '0'
+            'allocated_resources': '0',
+            'codec': codec,
+            'hostname': request_data.get('hostname')
         }
+        get_connection(strategy_address, strategy_port).codec = get_codec(codec)
+        self.MANAGER.on_registration()
 
-        # send successful response and close connection
-        self.logger.info("Strategy %s successfully registered" % strategy_id)
+        # send successful response, with the codec to use from now on
+        self.logger.info("Strategy %s successfully registered, using %s codec" % (strategy_id, codec))
         resp = {
             'status': 'SUCCESS',
-            'data': {}
+            'data': {
+                'codec': codec
+            }
         }
         return resp
 
@@ -86,10 +100,13 @@ class PortfolioRequestHandler (RequestHandler):
             interface_id: unique ID of the interface
             interface_address: IP address of the interface server, to which the other components will send messages
             interface_port: port of said interface server
+            codecs: wire codecs supported by the interface, in order of preference (optional)
+            hostname: host the interface runs on, None to never use local transports (optional)
         """
         interface_id = request_data['market_interface_id']
         interface_address = request_data['market_interface_address']
         interface_port = request_data['market_interface_port']
+        codec = negotiate(request_data.get('codecs', []))
 
         # if interface is already registered, a restart must have occurred,
         # so the sanest response for now is to refresh its entry
@@ -101,14 +118,20 @@ class PortfolioRequestHandler (RequestHandler):
         # enter initial information
         self.MANAGER.market_interfaces[interface_id] = {
             'address': interface_address,
-            'port': interface_port
+            'port': interface_port,
+            'codec': codec,
+            'hostname': request_data.get('hostname')
         }
+        get_connection(interface_address, interface_port).codec = get_codec(codec)
+        self.MANAGER.on_registration()
 
-        # send successful response and close connection
-        self.logger.info("Market interface %s successfully registered" % interface_id)
+        # send successful response, with the codec to use from now on
+        self.logger.info("Market interface %s successfully registered, using %s codec" % (interface_id, codec))
         resp = {
             'status': 'SUCCESS',
-            'data': {}
+            'data': {
+                'codec': codec
+            }
         }
         return resp
 
@@ -138,6 +161,10 @@ class PortfolioRequestHandler (RequestHandler):
             market_interface_id: ID identifying the requested market interface
             symbol: symbol on which to receive the data
             frequency: frequency of data feed
+            mode: feed mode, poll (default) or event (optional)
+            delta: True to receive the feed as deltas (optional)
+            granularity: seconds covered by each bar, or string like 5m, to receive OHLCV bars
+                    instead of ticks (optional)
         """
         # TODO: specify frequency format
         strategy_id = request_data['strategy_id']
@@ -165,9 +192,15 @@ class PortfolioRequestHandler (RequestHandler):
         # TODO: implement load balancing on market interfaces
         strategy_address = self.MANAGER.strategies[strategy_id]['address']
         strategy_port = self.MANAGER.strategies[strategy_id]['port']
+        strategy_codec = self.MANAGER.strategies[strategy_id]['codec']
         interface_address = self.MANAGER.market_interfaces[market_interface_id]['address']
         interface_port = self.MANAGER.market_interfaces[market_interface_id]['port']
 
+        # co-located components exchange feeds through shared memory
+        strategy_host = self.MANAGER.strategies[strategy_id].get('hostname')
+        interface_host = self.MANAGER.market_interfaces[market_interface_id].get('hostname')
+        transport = 'shm' if strategy_host is not None and strategy_host == interface_host else 'tcp'
+
         # query to the interface, specifying the subscription details
         query = {
             'query': 'INTERFACE_SUBSCRIBE',
@@ -175,8 +208,13 @@ class PortfolioRequestHandler (RequestHandler):
                 'strategy_id': strategy_id,
                 'strategy_address': strategy_address,
                 'strategy_port': strategy_port,
+                'codec': strategy_codec,
                 'symbol': symbol,
-                'frequency': frequency
+                'frequency': frequency,
+                'mode': request_data.get('mode', 'poll'),
+                'delta': request_data.get('delta', False),
+                'granularity': request_data.get('granularity'),
+                'transport': transport
             }
         }
 
@@ -246,3 +284,101 @@ class PortfolioRequestHandler (RequestHandler):
                            lambda res: self.unsubscribe_callback(response, res))
 
         return response
+
+    def resync_callback(self, response, res):
+        response['status'] = res['status']
+        if response['status'] == 'SUCCESS':
+            self.logger.debug('Resync requested successfully!')
+            response['data'] = res['data']
+        elif response['status'] == 'FAIL':
+            self.logger.error('Error during resync: %s' % res['message'])
+            response['message'] = res['message']
+        else:
+            self.logger.error('Invalid status in INTERFACE_RESYNC response: %s' % res['status'])
+
+    def resync(self, request_data):
+        """
+        Ask the interface to send a full snapshot to a delta feed subscription, after the
+        strategy missed part of the stream. Forwarded to the appropriate interface.
+
+        :param request_data: contains data specifying the subscription:
+            market_interface_id: ID of the market interface serving the subscription
+            subscription_handle: unique handle of the subscription
+        """
+        market_interface_id = request_data['market_interface_id']
+
+        # handle unknown market interface
+        if market_interface_id not in self.MANAGER.market_interfaces:
+            self.logger.error('Unknown market interface %s' % market_interface_id)
+            return {
+                'status': 'FAIL',
+                'message': 'Unknown market interface %s' % market_interface_id
+            }
+
+        interface_address = self.MANAGER.market_interfaces[market_interface_id]['address']
+        interface_port = self.MANAGER.market_interfaces[market_interface_id]['port']
+
+        query = {
+            'query': 'INTERFACE_RESYNC',
+            'data': {
+                'subscription_handle': request_data['subscription_handle']
+            }
+        }
+
+        response = {}
+
+        # relay resync request to the interface,
+        # then relay the response back to the strategy
+        message_to_address(interface_address,
+                           interface_port,
+                           query,
+                           True,
+                           lambda res: self.resync_callback(response, res))
+
+        return response
+
+    def bulk_data(self, request_data):
+        """
+        Get the history of a symbol from a market interface. Forwarded to the appropriate interface,
+        whose chunks are relayed to the strategy one at a time, as they arrive.
+
+        :param request_data: contains data specifying the request:
+            market_interface_id: ID of the market interface
+            symbol: requested symbol
+            start_time: lower bound of the tick timestamps (optional)
+            end_time: upper bound of the tick timestamps (optional)
+            frequency: requested data granularity, in seconds (optional)
+            chunk_size: maximum number of ticks in each chunk (optional)
+        :return: FAIL if the interface is unknown, otherwise a generator of the relayed chunks
+        """
+        market_interface_id = request_data['market_interface_id']
+
+        # handle unknown market interface
+        if market_interface_id not in self.MANAGER.market_interfaces:
+            self.logger.error('Unknown market interface %s' % market_interface_id)
+            return {
+                'status': 'FAIL',
+                'message': 'Unknown market interface %s' % market_interface_id
+            }
+
+        interface_address = self.MANAGER.market_interfaces[market_interface_id]['address']
+        interface_port = self.MANAGER.market_interfaces[market_interface_id]['port']
+
+        query = {
+            'query': 'BULK_DATA',
+            'data': {
+                'symbol': request_data['symbol'],
+                'start_time': request_data.get('start_time'),
+                'end_time': request_data.get('end_time'),
+                'frequency': request_data.get('frequency'),
+                'chunk_size': request_data.get('chunk_size')
+            }
+        }
+
+        return self._relay_chunks(stream_from_address(interface_address, interface_port, query))
+
+    @staticmethod
+    def _relay_chunks(stream):
+        # a failure to reach the interface is sent as is, otherwise the responses of the interface
+        for res in stream:
+            yield res['data'] if res['status'] == 'SUCCESS' else res
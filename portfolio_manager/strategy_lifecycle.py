@@ -1,7 +1,7 @@
-import json
-import socket
 import logging
 
+from common.messaging import message_to_address
+
 
 """
 Helper functions to handle lifecycle signals to strategies, used by manager.
@@ -24,18 +24,11 @@ def init(address, port, resources):
             'resources': resources
         }
     }
-    # connect to strategy
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    try:
-        sock.connect((address, port))
-    except ConnectionRefusedError:
-        logger.error('Could not initialize with strategy, could not connect to it')
-        return False
-    # send command
-    try:
-        sock.send(json.dumps(request).encode())
-    except socket.timeout:
-        logger.error('Could not initialize with strategy, connection timed out')
+    # send command, no response is expected
+    result = {}
+    message_to_address(address, port, request, False, result.update)
+    if result['status'] == 'FAIL':
+        logger.error('Could not initialize strategy: %s' % result['message'])
         return False
 
     logger.info("Initialization command sent")
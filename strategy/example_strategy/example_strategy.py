@@ -1,14 +1,17 @@
 import time
 import logging
+import threading
 import matplotlib.pyplot as plt
 
 from common.logging import setup_logger
 from strategy.strategy_template import Strategy
-from common.plot_manager import PlotManager
+from common.plot_manager import PlotManager, DEFERRED_RENDER
 
 setup_logger('example_strategy.log')
 
 MAX_PLOT_POINTS = 200
+# seconds between status checks
+STATUS_INTERVAL = 0.5
 
 
 class ExampleStrategy (Strategy):
@@ -18,18 +21,23 @@ class ExampleStrategy (Strategy):
         Strategy.__init__(self, strategy_id='TEST_STRATEGY', mode='TEST_LIVE', config_file='config.json')
         self.logger = logging.getLogger('example_strategy')
 
-        self.symbol_data = []
+        self.ticks_received = 0
 
-        self.plot_manager = PlotManager(max_elements=MAX_PLOT_POINTS)
+        # drawn at a capped frame rate by the GUI in the main thread, plotting never holds up the feeds
+        self.plot_manager = PlotManager(max_elements=MAX_PLOT_POINTS, render_mode=DEFERRED_RENDER)
 
         self.plot_manager.add_subplot('data_plot', 111)
         self.plot_manager.set_subplot_title('data_plot', 'Incoming Data')
+        self.plot_manager.add_line('data_plot', 'price_line')
 
         self.logger.info('Example strategy initialized')
 
     def run(self):
         self.logger.info('Starting example strategy...')
-        self.boot()
+        # events are handled by their own thread, the main one runs the GUI drawing the plot
+        events = threading.Thread(target=self.boot, name='strategy_events')
+        events.start()
+        self.plot_manager.run_gui(lambda: not events.is_alive())
         self.logger.info('Shutting down example strategy...')
 
     def on_init(self, data):
@@ -50,25 +58,19 @@ class ExampleStrategy (Strategy):
         super().on_funds_reallocation(data)
 
     def on_data_feed_recv(self, data):
-        self.symbol_data.append(data['value'])
+        self.ticks_received += 1
+        self.plot_manager.append_datapoint('data_plot', self.ticks_received, {
+            'price_line': data['value']
+        })
 
     def strategy_cycle(self):
-        last_status = None
-        last_plotted = 0
-        while self.RUN:
-            if last_status != self.STATUS:
-                self.logger.info("Test strategy is %s" % self.STATUS)
-                last_status = self.STATUS
-
-            if len(self.symbol_data) > last_plotted:
-                for i in range(last_plotted, len(self.symbol_data)):
-                    if i == 0:
-                        self.plot_manager.add_line('data_plot', 'price_line', [0], self.symbol_data[0:1])
-                    else:
-                        self.plot_manager.append_datapoint('data_plot', i+1, {
-                            'price_line': self.symbol_data[i]
-                        })
-                last_plotted = len(self.symbol_data)
+        self.last_status = None
+        self.run_loop.call_every(STATUS_INTERVAL, self.log_status)
+
+    def log_status(self):
+        if self.last_status != self.STATUS:
+            self.logger.info("Test strategy is %s" % self.STATUS)
+            self.last_status = self.STATUS
 
 
 test_strategy = ExampleStrategy()
@@ -0,0 +1,512 @@
+import math
+import collections
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+"""
+Technical indicators for strategies.
+
+Every indicator comes in two versions, which give the same values:
+    incremental, a class updated with one tick at a time in O(1), for on_data_feed_recv
+    batch, a function computing the indicator over a whole array at once with NumPy, e.g. over bulk history
+The windowed indicators cover the last window values, or all the values while there are fewer of them.
+The incremental indicators can be warmed up from history with warmup, before any update: it runs the
+batch version, and loads the state the indicator would have after updating with all the values.
+"""
+
+# maximum number of values in the temporaries of the batch variance, which is computed a few windows at a time
+VAR_CHUNK_SIZE = 1 << 20
+
+
+class RollingWindow:
+    """
+    Last window values of a series, in a ring buffer.
+    """
+    def __init__(self, window):
+        if window < 1:
+            raise ValueError('Invalid window %r' % window)
+        self.window = window
+        self.buffer = np.zeros(window)
+        self.pos = 0
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.window)
+
+    def push(self, value):
+        """
+        :param value: new value
+        :return: the value pushed out of the window, None if the window was not full
+        """
+        evicted = self.buffer[self.pos] if self.count >= self.window else None
+        self.buffer[self.pos] = value
+        self.pos = (self.pos + 1) % self.window
+        self.count += 1
+        return evicted
+
+    def values(self):
+        """
+        :return: the values in the window, oldest first
+        """
+        if self.count < self.window:
+            return self.buffer[:self.count].copy()
+        return np.roll(self.buffer, -self.pos)
+
+    def load(self, values):
+        """
+        Replace the window with the last values of a series.
+
+        :param values: series of values
+        """
+        values = np.asarray(values, dtype=float)[-self.window:]
+        self.buffer[:len(values)] = values
+        self.pos = len(values) % self.window
+        self.count = len(values)
+
+
+##################################
+#          BATCH VERSIONS        #
+##################################
+
+def _window_sums(values, window):
+    """
+    :return: sums of the values in the window ending at each position, and the number of values in it
+    """
+    sums = np.cumsum(values)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts = np.minimum(np.arange(1, len(values) + 1), window)
+    return sums, counts
+
+
+def sma(values, window):
+    """
+    :param values: series of values
+    :param window: number of values averaged
+    :return: simple moving average at each position
+    """
+    values = np.asarray(values, dtype=float)
+    sums, counts = _window_sums(values, window)
+    return sums / counts
+
+
+def ema(values, window=None, alpha=None):
+    """
+    :param values: series of values
+    :param window: span of the average, alpha is 2 / (window + 1)
+    :param alpha: smoothing factor, instead of window
+    :return: exponential moving average at each position, starting from the first value
+    """
+    alpha = _ema_alpha(window, alpha)
+    values = np.asarray(values, dtype=float)
+    result = np.empty(len(values))
+    if not len(values):
+        return result
+    decay = 1 - alpha
+    if decay == 0:
+        return values.copy()
+
+    # closed form over blocks short enough for the powers of decay not to overflow
+    block = max(1, int(-20 / math.log(decay))) if decay < 1 else len(values)
+    last = values[0]
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        powers = decay ** np.arange(1, len(chunk) + 1)
+        weighted = np.cumsum(alpha * chunk / powers)
+        result[start:start + block] = powers * (last + weighted)
+        last = result[start + len(chunk) - 1]
+    return result
+
+
+def rolling_var(values, window, ddof=0):
+    """
+    :param values: series of values
+    :param window: number of values covered
+    :param ddof: delta degrees of freedom, 1 for the sample variance
+    :return: variance at each position, NaN where there are not more than ddof values
+    """
+    values = np.asarray(values, dtype=float)
+    var = np.empty(len(values))
+    # running sums for the first, partial windows, two pass variance for the full ones
+    # (differences of running sums lose precision over long series)
+    head = min(window - 1, len(values))
+    counts = np.arange(1, head + 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        centered = values[:head] - values[:head].mean() if head else values[:head]
+        sums = np.cumsum(centered)
+        var[:head] = (np.cumsum(centered * centered) - sums * sums / counts) / (counts - ddof)
+    var[:head][counts <= ddof] = np.nan
+    if len(values) >= window and window <= ddof:
+        var[head:] = np.nan
+    elif len(values) >= window:
+        windows = sliding_window_view(values, window)
+        # the two passes copy the windows they cover, so memory stays bounded by the chunk size
+        rows = max(1, VAR_CHUNK_SIZE // window)
+        for start in range(0, len(windows), rows):
+            var[head + start:head + start + rows] = np.var(windows[start:start + rows], axis=1, ddof=ddof)
+    return np.maximum(var, 0)
+
+
+def rolling_std(values, window, ddof=0):
+    """
+    :return: standard deviation at each position, see rolling_var
+    """
+    return np.sqrt(rolling_var(values, window, ddof))
+
+
+def vwap(prices, volumes, window=None):
+    """
+    :param prices: series of prices
+    :param volumes: series of traded volumes
+    :param window: number of ticks covered, None for all of them
+    :return: volume weighted average price at each position, NaN while there is no volume
+    """
+    prices = np.asarray(prices, dtype=float)
+    volumes = np.asarray(volumes, dtype=float)
+    window = window or max(len(prices), 1)
+    amounts, _ = _window_sums(prices * volumes, window)
+    totals, _ = _window_sums(volumes, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(totals != 0, amounts / totals, np.nan)
+
+
+def _rolling_extreme(values, window, reduce, accumulate):
+    values = np.asarray(values, dtype=float)
+    result = np.empty(len(values))
+    head = min(window - 1, len(values))
+    result[:head] = accumulate(values[:head])
+    if len(values) >= window:
+        result[head:] = reduce(sliding_window_view(values, window), axis=1)
+    return result
+
+
+def rolling_min(values, window):
+    """
+    :param values: series of values
+    :param window: number of values covered
+    :return: minimum at each position
+    """
+    return _rolling_extreme(values, window, np.min, np.minimum.accumulate)
+
+
+def rolling_max(values, window):
+    """
+    :param values: series of values
+    :param window: number of values covered
+    :return: maximum at each position
+    """
+    return _rolling_extreme(values, window, np.max, np.maximum.accumulate)
+
+
+def zscore(values, window, ddof=0):
+    """
+    :param values: series of values
+    :param window: number of values covered by the mean and standard deviation
+    :param ddof: delta degrees of freedom of the standard deviation
+    :return: distance of each value from the rolling mean, in rolling standard deviations,
+            0 where the deviation is 0 and NaN where it is not defined
+    """
+    values = np.asarray(values, dtype=float)
+    std = rolling_std(values, window, ddof)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(std > 0, (values - sma(values, window)) / std, np.where(np.isnan(std), np.nan, 0.0))
+
+
+##################################
+#       INCREMENTAL VERSIONS     #
+##################################
+
+def _ema_alpha(window, alpha):
+    if alpha is None:
+        if window is None or window < 1:
+            raise ValueError('Invalid window %r' % window)
+        alpha = 2 / (window + 1)
+    if not 0 < alpha <= 1:
+        raise ValueError('Invalid alpha %r' % alpha)
+    return alpha
+
+
+class SMA:
+    """
+    Simple moving average.
+    """
+    def __init__(self, window):
+        self.values = RollingWindow(window)
+        self.sum = 0.0
+        self.value = None
+
+    def update(self, value):
+        """
+        :param value: new value of the series
+        :return: current average
+        """
+        evicted = self.values.push(value)
+        self.sum += value - (evicted if evicted is not None else 0)
+        if self.values.pos == 0:
+            # resummed once per window, rounding errors would build up otherwise
+            self.sum = float(self.values.buffer.sum())
+        self.value = self.sum / len(self.values)
+        return self.value
+
+    def warmup(self, values):
+        """
+        :param values: history of the series
+        :return: the batch indicator over it
+        """
+        result = sma(values, self.values.window)
+        if len(result):
+            self.values.load(values)
+            self.sum = float(self.values.buffer[:len(self.values)].sum())
+            self.value = result[-1]
+        return result
+
+
+class EMA:
+    """
+    Exponential moving average.
+    """
+    def __init__(self, window=None, alpha=None):
+        """
+        :param window: span of the average, alpha is 2 / (window + 1)
+        :param alpha: smoothing factor, instead of window
+        """
+        self.alpha = _ema_alpha(window, alpha)
+        self.value = None
+
+    def update(self, value):
+        """
+        :param value: new value of the series
+        :return: current average
+        """
+        if self.value is None:
+            self.value = float(value)
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+    def warmup(self, values):
+        """
+        :param values: history of the series
+        :return: the batch indicator over it
+        """
+        result = ema(values, alpha=self.alpha)
+        if len(result):
+            self.value = float(result[-1])
+        return result
+
+
+class RollingVariance:
+    """
+    Rolling variance and standard deviation, with Welford's updates.
+    """
+    def __init__(self, window, ddof=0):
+        """
+        :param window: number of values covered
+        :param ddof: delta degrees of freedom, 1 for the sample variance
+        """
+        self.values = RollingWindow(window)
+        self.ddof = ddof
+        self.mean = 0.0
+        # sum of the squared deviations from the mean
+        self.m2 = 0.0
+
+    def update(self, value):
+        """
+        :param value: new value of the series
+        :return: current variance
+        """
+        evicted = self.values.push(value)
+        if evicted is None:
+            delta = value - self.mean
+            self.mean += delta / len(self.values)
+            self.m2 += delta * (value - self.mean)
+        else:
+            mean = self.mean + (value - evicted) / self.values.window
+            self.m2 += (value - evicted) * (value - mean + evicted - self.mean)
+            self.mean = mean
+        if self.values.pos == 0:
+            # recomputed once per window, rounding errors would build up otherwise
+            window = self.values.buffer
+            self.mean = float(window.mean())
+            self.m2 = float(((window - self.mean) ** 2).sum())
+        self.m2 = max(self.m2, 0.0)
+        return self.var
+
+    @property
+    def var(self):
+        n = len(self.values)
+        return self.m2 / (n - self.ddof) if n > self.ddof else math.nan
+
+    @property
+    def std(self):
+        return math.sqrt(self.var)
+
+    @property
+    def value(self):
+        return self.var
+
+    def warmup(self, values):
+        """
+        :param values: history of the series
+        :return: the batch variance over it
+        """
+        result = rolling_var(values, self.values.window, self.ddof)
+        if len(result):
+            self.values.load(values)
+            window = self.values.values()
+            self.mean = float(window.mean())
+            self.m2 = float(((window - self.mean) ** 2).sum())
+        return result
+
+
+class VWAP:
+    """
+    Volume weighted average price, over a window of ticks or since the start.
+    """
+    def __init__(self, window=None):
+        """
+        :param window: number of ticks covered, None for all of them
+        """
+        self.window = window
+        self.amounts = RollingWindow(window) if window else None
+        self.volumes = RollingWindow(window) if window else None
+        self.amount = 0.0
+        self.volume = 0.0
+        self.value = math.nan
+
+    def update(self, price, volume):
+        """
+        :param price: price of the new tick
+        :param volume: volume traded in the new tick
+        :return: current VWAP, NaN while there is no volume
+        """
+        amount = price * volume
+        if self.window:
+            evicted = self.amounts.push(amount)
+            self.amount += amount - (evicted if evicted is not None else 0)
+            evicted = self.volumes.push(volume)
+            self.volume += volume - (evicted if evicted is not None else 0)
+            if self.amounts.pos == 0:
+                self.amount = float(self.amounts.buffer.sum())
+                self.volume = float(self.volumes.buffer.sum())
+        else:
+            self.amount += amount
+            self.volume += volume
+        self.value = self.amount / self.volume if self.volume != 0 else math.nan
+        return self.value
+
+    def warmup(self, prices, volumes):
+        """
+        :param prices: history of the prices
+        :param volumes: history of the volumes
+        :return: the batch VWAP over it
+        """
+        result = vwap(prices, volumes, self.window)
+        if len(result):
+            amounts = np.asarray(prices, dtype=float) * np.asarray(volumes, dtype=float)
+            if self.window:
+                self.amounts.load(amounts)
+                self.volumes.load(volumes)
+                amounts, volumes = self.amounts.values(), self.volumes.values()
+            self.amount = float(np.sum(amounts))
+            self.volume = float(np.sum(volumes))
+            self.value = result[-1]
+        return result
+
+
+class RollingExtreme:
+    """
+    Rolling minimum or maximum, with a monotonic deque of (position, value) candidates.
+    """
+    def __init__(self, window, maximum=False):
+        """
+        :param window: number of values covered
+        :param maximum: True for the maximum, False for the minimum
+        """
+        if window < 1:
+            raise ValueError('Invalid window %r' % window)
+        self.window = window
+        self.maximum = maximum
+        self.candidates = collections.deque()
+        self.count = 0
+        self.value = None
+
+    def update(self, value):
+        """
+        :param value: new value of the series
+        :return: current extreme
+        """
+        candidates = self.candidates
+        # values beaten by the new one can never be the extreme again
+        if self.maximum:
+            while candidates and candidates[-1][1] <= value:
+                candidates.pop()
+        else:
+            while candidates and candidates[-1][1] >= value:
+                candidates.pop()
+        candidates.append((self.count, value))
+        if candidates[0][0] <= self.count - self.window:
+            candidates.popleft()
+        self.count += 1
+        self.value = candidates[0][1]
+        return self.value
+
+    def warmup(self, values):
+        """
+        :param values: history of the series
+        :return: the batch indicator over it
+        """
+        result = (rolling_max if self.maximum else rolling_min)(values, self.window)
+        # only the last window values matter for the next updates
+        self.count = max(len(values) - self.window, 0)
+        self.candidates.clear()
+        for value in np.asarray(values, dtype=float)[-self.window:].tolist():
+            self.update(value)
+        return result
+
+
+class RollingMin (RollingExtreme):
+    def __init__(self, window):
+        RollingExtreme.__init__(self, window, maximum=False)
+
+
+class RollingMax (RollingExtreme):
+    def __init__(self, window):
+        RollingExtreme.__init__(self, window, maximum=True)
+
+
+class ZScore:
+    """
+    Distance of the latest value from the rolling mean, in rolling standard deviations.
+    """
+    def __init__(self, window, ddof=0):
+        """
+        :param window: number of values covered by the mean and standard deviation
+        :param ddof: delta degrees of freedom of the standard deviation
+        """
+        self.variance = RollingVariance(window, ddof)
+        self.value = None
+
+    def update(self, value):
+        """
+        :param value: new value of the series
+        :return: current z-score, 0 if the deviation is 0 and NaN if it is not defined
+        """
+        std = math.sqrt(self.variance.update(value))
+        if math.isnan(std):
+            self.value = math.nan
+        else:
+            self.value = (value - self.variance.mean) / std if std > 0 else 0.0
+        return self.value
+
+    def warmup(self, values):
+        """
+        :param values: history of the series
+        :return: the batch indicator over it
+        """
+        result = zscore(values, self.variance.values.window, self.variance.ddof)
+        self.variance.warmup(values)
+        if len(result):
+            self.value = result[-1]
+        return result
@@ -0,0 +1,258 @@
+import time
+import heapq
+import logging
+import operator
+import itertools
+
+import numpy as np
+
+from market_interface.bar_aggregator import BarAggregator, parse_granularity
+from market_interface.tick_storage import TIMESTAMP, TickStorage
+
+
+"""
+Historical replay of market data into a strategy, for the TEST_HISTORICAL mode.
+
+The replay runs in the strategy process, without sockets: the subscriptions of the strategy are
+served from stored history instead of market interfaces, and the feed messages are handed to
+on_data_feed_recv in timestamp order, as the strategy would receive them live:
+    poll feeds: the latest tick every frequency seconds
+    event feeds: every tick
+    bar feeds: every completed bar
+The feeds are set up when the strategy starts, subscriptions made later are not served.
+Each feed is a generator, building its messages only as the replay reaches them, and the feeds are
+merged on timestamp, so the memory used does not grow with the length of the replay. Stored history
+is read from the memory-mapped segments of the storage, without copying it.
+The clock of the strategy is simulated, it reads the timestamp of the message being replayed.
+By default the replay goes as fast as possible, a speed makes it paced, e.g. 10 for ten times
+faster than real time.
+"""
+
+# ticks converted to feed messages at once
+REPLAY_CHUNK_SIZE = 4096
+
+
+class SimulatedClock:
+    """
+    Clock of a replay, set to the timestamp of the message being replayed.
+    """
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class HistoricalReplay:
+    """
+    Replays stored history into a strategy, see module description.
+    """
+    def __init__(self, strategy, history, start_time=None, end_time=None, speed=None):
+        """
+        Initialize replay.
+
+        :param strategy: strategy to feed, its subscriptions are served by the replay while it runs
+        :param history: TickStorage, or dict of columns by symbol (timestamp and one column per field)
+        :param start_time: lower bound of the replayed timestamps, None for no bound
+        :param end_time: upper bound of the replayed timestamps, None for no bound
+        :param speed: None to replay as fast as possible, otherwise speed relative to real time
+        """
+        self.logger = logging.getLogger('historical_replay')
+
+        self.STRATEGY = strategy
+        self.history = history
+        self.start_time = start_time
+        self.end_time = end_time
+        self.speed = speed
+
+        self.clock = SimulatedClock()
+        # subscriptions served, indexed by handle
+        self.subscriptions = {}
+        self.handles = itertools.count(1)
+
+        self.running = False
+        self.events = 0
+
+    def load(self, symbol):
+        """
+        :param symbol: requested symbol
+        :return: list of dicts of column views, the timestamps and one for each field, in chronological
+                order and without empty ones, see TickStorage.scan. Empty if there is no history
+        """
+        if isinstance(self.history, TickStorage):
+            parts = self.history.scan(symbol, self.start_time, self.end_time)
+        else:
+            columns = self.history.get(symbol)
+            if columns is None:
+                return []
+            columns = {name: np.asarray(column) for name, column in columns.items()}
+            timestamps = columns[TIMESTAMP]
+            lo = 0 if self.start_time is None else np.searchsorted(timestamps, self.start_time, side='left')
+            hi = len(timestamps) if self.end_time is None else np.searchsorted(timestamps, self.end_time, side='right')
+            parts = [{name: column[lo:hi] for name, column in columns.items()}]
+        return [part for part in parts if len(part[TIMESTAMP])]
+
+    def subscribe(self, market_interface_id, symbol, frequency, mode='poll', granularity=None):
+        """
+        Serve a subscription of the strategy, called by Strategy.subscribe in TEST_HISTORICAL mode.
+
+        :param market_interface_id: ID of the market interface, ignored
+        :param symbol: requested symbol
+        :param frequency: seconds between poll feed messages
+        :param mode: poll or event
+        :param granularity: seconds covered by each bar, or string like 5m, for bar feeds
+        :return: handle of the subscription
+        """
+        sub_handle = 'replay_%s_%d' % (symbol, next(self.handles))
+        self.subscriptions[sub_handle] = {
+            'symbol': symbol,
+            'frequency': frequency,
+            'mode': mode,
+            'granularity': parse_granularity(granularity) if granularity is not None else None
+        }
+        self.STRATEGY.subscriptions[sub_handle] = {
+            'market_interface_id': market_interface_id
+        }
+        return sub_handle
+
+    def unsubscribe(self, subscription_handle):
+        """
+        Stop serving a subscription, called by Strategy.unsubscribe in TEST_HISTORICAL mode.
+
+        :param subscription_handle: handle of the subscription
+        """
+        self.subscriptions.pop(subscription_handle, None)
+        self.STRATEGY.subscriptions.pop(subscription_handle, None)
+
+    def feed(self, subscription):
+        """
+        Generate the feed messages of a subscription, a chunk of ticks at a time.
+
+        :param subscription: replayed subscription
+        :return: generator of (timestamp, message), in chronological order
+        """
+        parts = self.load(subscription['symbol'])
+        if not parts:
+            self.logger.warning('No history for %s' % subscription['symbol'])
+            return
+
+        if subscription['mode'] == 'poll' and subscription['frequency'] and subscription['granularity'] is None:
+            yield from self._polls(parts, subscription['frequency'])
+            return
+
+        aggregator = None
+        if subscription['granularity'] is not None:
+            aggregator = BarAggregator(subscription['symbol'], subscription['granularity'])
+        for part in parts:
+            for chunk in self._chunks(part):
+                for tick in chunk:
+                    if aggregator is None:
+                        yield tick[TIMESTAMP], tick
+                        continue
+                    bar = aggregator.update(tick[TIMESTAMP], tick)
+                    if bar is not None:
+                        # sent when the tick completing it arrives
+                        yield tick[TIMESTAMP], bar
+
+    def _polls(self, parts, frequency):
+        """
+        :param parts: ticks, as returned by load
+        :param frequency: seconds between polls
+        :return: generator of (timestamp, message), the latest tick at each poll
+        """
+        first, stop = float(parts[0][TIMESTAMP][0]), float(parts[-1][TIMESTAMP][-1]) + frequency
+        polls = int(np.ceil((stop - first) / frequency))
+        current = 0
+        for start in range(0, polls, REPLAY_CHUNK_SIZE):
+            times = first + np.arange(start, min(start + REPLAY_CHUNK_SIZE, polls)) * frequency
+            lo = 0
+            while lo < len(times):
+                # the part holding the latest tick at the next poll, and the polls it serves
+                while current + 1 < len(parts) and parts[current + 1][TIMESTAMP][0] <= times[lo]:
+                    current += 1
+                part = parts[current]
+                hi = len(times)
+                if current + 1 < len(parts):
+                    hi = np.searchsorted(times, parts[current + 1][TIMESTAMP][0], side='left')
+                indexes = np.searchsorted(part[TIMESTAMP], times[lo:hi], side='right') - 1
+                yield from zip(times[lo:hi].tolist(), self._rows(part, indexes))
+                lo = hi
+
+    @staticmethod
+    def _rows(ticks, indexes):
+        """
+        :param ticks: dict of columns
+        :param indexes: indexes, or slice, of the rows
+        :return: list of the rows, as dicts of python values
+        """
+        columns = {name: column[indexes].tolist() for name, column in ticks.items()}
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+    def _chunks(self, ticks):
+        for start in range(0, len(ticks[TIMESTAMP]), REPLAY_CHUNK_SIZE):
+            yield self._rows(ticks, slice(start, start + REPLAY_CHUNK_SIZE))
+
+    @staticmethod
+    def _tag(handle, feed):
+        for timestamp, message in feed:
+            yield timestamp, handle, message
+
+    def run(self, init_data=None):
+        """
+        Run the strategy over the history: INIT, during which it subscribes, START, all the feed
+        messages in chronological order, and STOP.
+
+        :param init_data: data of the INIT message
+        :return: dict with the stats of the replay
+        """
+        strategy_clock = self.STRATEGY.clock
+        self.STRATEGY.clock = self.clock.time
+        self.STRATEGY.replay = self
+        self.running = True
+        try:
+            self.STRATEGY.on_init(init_data if init_data is not None else {})
+            self.STRATEGY.on_start({})
+
+            # merge the feeds of all the subscriptions, ties in subscription order
+            feeds = [self._tag(handle, self.feed(subscription))
+                     for handle, subscription in list(self.subscriptions.items())]
+
+            wall_start = time.perf_counter()
+            first = None
+            on_data_feed_recv = self.STRATEGY.on_data_feed_recv
+            for timestamp, handle, message in heapq.merge(*feeds, key=operator.itemgetter(0)):
+                if not self.running:
+                    break
+                if first is None:
+                    first = timestamp
+                self.clock.now = timestamp
+                if self.speed:
+                    wait = wall_start + (timestamp - first) / self.speed - time.perf_counter()
+                    if wait > 0:
+                        time.sleep(wait)
+                if handle not in self.subscriptions:
+                    # unsubscribed meanwhile
+                    continue
+                on_data_feed_recv(message)
+                self.events += 1
+            wall_time = time.perf_counter() - wall_start
+
+            self.STRATEGY.on_stop({})
+        finally:
+            self.running = False
+            self.STRATEGY.clock = strategy_clock
+            self.STRATEGY.replay = None
+
+        stats = {
+            'events': self.events,
+            'wall_time': wall_time,
+            'events_per_second': self.events / wall_time if wall_time > 0 else 0,
+            'start_time': first,
+            'end_time': self.clock.now if first is not None else None
+        }
+        self.logger.info('Replayed %d messages in %.3fs' % (self.events, wall_time))
+        return stats
+
+    def stop(self):
+        """Stop the replay, from the strategy or another thread"""
+        self.running = False
@@ -0,0 +1,147 @@
+import time
+import logging
+import threading
+
+from common.codec import decode
+from common.shm_ring import ShmRing
+from strategy.strategy_request_handler import StrategyRequestHandler
+
+# busy polls without messages before the reader starts sleeping between polls
+DEFAULT_IDLE_SPINS = 1000
+# seconds slept between polls while idle, at first, doubling up to the maximum while no message comes
+DEFAULT_IDLE_SLEEP = 0.0005
+DEFAULT_MAX_IDLE_SLEEP = 0.02
+# maximum number of messages read from a ring in one go, so a busy ring can't starve the others
+MAX_READ = 256
+
+
+class ShmFeedReader (threading.Thread):
+    """
+    Reads the feed messages that co-located market interfaces write to shared memory rings,
+    and hands them to the strategy like the ones coming from the strategy server.
+
+    While messages keep coming the rings are polled without any syscall, after a while without
+    messages the reader falls back to sleeping between polls, longer and longer, so that an idle
+    reader barely wakes up.
+    """
+    def __init__(self, strategy, idle_spins=DEFAULT_IDLE_SPINS, idle_sleep=DEFAULT_IDLE_SLEEP,
+                 max_idle_sleep=DEFAULT_MAX_IDLE_SLEEP):
+        """
+        Initialize reader, it is started when the first ring is attached.
+
+        :param strategy: parent strategy
+        :param idle_spins: busy polls without messages before sleeping
+        :param idle_sleep: seconds slept between the first polls while idle
+        :param max_idle_sleep: seconds slept between polls after a long time idle
+        """
+        threading.Thread.__init__(self, name='shm_feed_reader', daemon=True)
+        self.logger = logging.getLogger('shm_feed_reader')
+
+        self.idle_spins = idle_spins
+        self.idle_sleep = idle_sleep
+        self.max_idle_sleep = max_idle_sleep
+
+        # query handlers of the messages, feeds have no response so the socket is never used
+        self.handler = StrategyRequestHandler(None, strategy)
+
+        # attached rings, indexed by name
+        self.rings = {}
+        # rings replaced by a new one with the same name, read one last time by the reader thread
+        self.retired = []
+        self.lock = threading.Lock()
+
+        self.running = False
+
+    def attach(self, name):
+        """
+        Start reading a ring, if not already doing so.
+        If the ring was destroyed and created again by its writer, the new one is read instead.
+
+        :param name: name of the shared memory ring
+        :return: True if the ring is being read
+        """
+        with self.lock:
+            try:
+                ring = ShmRing(name)
+            except OSError as e:
+                self.logger.error('Could not attach to shared memory ring %s: %s' % (name, e))
+                return False
+            current = self.rings.get(name)
+            if current is not None:
+                if current.ring_id == ring.ring_id:
+                    ring.close()
+                    return True
+                # the reader thread may be reading the old one, it closes it
+                self.logger.info('Shared memory ring %s was created again, reattaching' % name)
+                self.retired.append(current)
+                # written since it was created again, for the new subscription
+                ring.index = 0
+            self.rings[name] = ring
+            self.logger.info('Reading feeds from shared memory ring %s' % name)
+
+            if not self.running:
+                self.running = True
+                self.start()
+        return True
+
+    def poll(self):
+        """
+        Read and handle the messages available on all the rings.
+
+        :return: number of messages handled
+        """
+        with self.lock:
+            rings = list(self.rings.values())
+            retired, self.retired = self.retired, []
+
+        handled = 0
+        for ring in retired:
+            # the messages left in the old ring are handled before closing it
+            handled += self._handle(ring.read_available())
+            ring.close()
+        for ring in rings:
+            handled += self._handle(ring.read_available(MAX_READ))
+        return handled
+
+    def _handle(self, payloads):
+        handled = 0
+        for payload in payloads:
+            try:
+                request = decode(payload)
+            except ValueError as e:
+                self.logger.error('Could not decode feed message: %s' % e)
+                continue
+            query_handler = self.handler.query_handlers.get(request.get('query'))
+            if query_handler is None:
+                self.logger.error('Unknown feed message: %s' % request.get('query'))
+                continue
+            query_handler(request['data'])
+            handled += 1
+        return handled
+
+    def run(self):
+        idle = 0
+        sleep = self.idle_sleep
+        while self.running:
+            if self.poll():
+                idle = 0
+                sleep = self.idle_sleep
+                continue
+            idle += 1
+            if idle > self.idle_spins:
+                time.sleep(sleep)
+                sleep = min(sleep * 2, self.max_idle_sleep)
+
+    def stop(self):
+        self.running = False
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+        with self.lock:
+            for ring in list(self.rings.values()) + self.retired:
+                ring.close()
+            self.rings = {}
+            self.retired = []
+
+    def metrics(self):
+        with self.lock:
+            return [ring.metrics() for ring in self.rings.values()]
@@ -11,15 +11,16 @@ PONG_RESPONSE = {
 
 
 class StrategyApiServer (ApiServer):
-    def __init__(self, host, port, strategy):
+    def __init__(self, host, port, strategy, **server_options):
         """
         Initializes server, then starts listening for incoming connections.
 
         :param host: address of the server
         :param port: port of the server
         :param strategy: reference to the parent strategy, used to access its data
+        :param server_options: ApiServer options (mode, max_workers, ...)
         """
-        super().__init__(host, port)
+        super().__init__(host, port, **server_options)
 
         self.logger = logging.getLogger('strategy_server')
 
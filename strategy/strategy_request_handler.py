@@ -15,12 +15,15 @@ class StrategyRequestHandler(RequestHandler):
 
         self.STRATEGY = strategy
 
+        # everything but pings is handled by the single consumer of the strategy, see Strategy.post_event
         self.query_handlers = {
-            'INIT': self.STRATEGY.on_init,
-            'START': self.STRATEGY.on_start,
-            'STOP': self.STRATEGY.on_stop,
-            'REALLOCATE': self.STRATEGY.on_funds_reallocation,
+            'INIT': lambda data: self.STRATEGY.post_event('INIT', data),
+            'START': lambda data: self.STRATEGY.post_event('START', data),
+            'STOP': lambda data: self.STRATEGY.post_event('STOP', data),
+            'REALLOCATE': lambda data: self.STRATEGY.post_event('REALLOCATE', data),
             'PING': lambda data: PONG_RESPONSE,
 
-            'MARKET_DATA_FEED': self.STRATEGY.on_data_feed_recv
+            'MARKET_DATA_FEED': lambda data: self.STRATEGY.post_event('MARKET_DATA_FEED', data),
+            'MARKET_DATA_FEED_BATCH': lambda data: self.STRATEGY.post_event('MARKET_DATA_FEED_BATCH', data),
+            'MARKET_DATA_DELTA': lambda data: self.STRATEGY.post_event('MARKET_DATA_DELTA', data)
         }
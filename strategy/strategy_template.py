@@ -1,13 +1,24 @@
 import sys
 import json
+import time
+import socket
 import logging
 import threading
 
-from common.messaging import message_to_address
+from common.codec import SUPPORTED_CODECS, get_codec
+from common.messaging import message_to_address, get_connection, stream_from_address
+from common.run_loop import RunLoop
 from strategy.strategy_api import StrategyApiServer
+from strategy.shm_feed_reader import ShmFeedReader
+from strategy.replay import HistoricalReplay
+from market_interface.tick_storage import TickStorage
 
-lock = threading.Lock()
-
+# feed events waiting for the run loop at most, and seconds the thread receiving a feed waits for
+# room in the queue before dropping it: while it waits it stops reading, slowing the interface down
+MAX_PENDING_FEEDS = 10000
+FEED_QUEUE_TIMEOUT = 1
+# events whose queueing is bounded, commands are always queued
+FEED_EVENTS = ('MARKET_DATA_FEED', 'MARKET_DATA_FEED_BATCH', 'MARKET_DATA_DELTA')
 
 class Strategy:
     """
@@ -15,6 +26,12 @@ class Strategy:
     the hood.
     Exposes endpoints for the specific strategy implementations to override, mostly for
     incoming command or data feed handling.
+    Incoming commands and feeds are queued, and handed to the endpoints one at a time, in order
+    of arrival, by the run loop of the strategy, which also runs its timers: the endpoints never
+    run concurrently, and need no locks.
+    At most max_pending_feeds feeds are queued: when the strategy falls behind, the threads
+    receiving feeds wait for room, which holds up the interfaces sending them, so that their
+    subscriber queue policies apply, and feeds still not queued after a while are dropped.
     """
     def __init__(self, strategy_id, mode, config_file):
         """
@@ -23,22 +40,26 @@ class Strategy:
 
         :param strategy_id: identifying ID of the strategy
         :param mode: mode of operation, determines how the strategy is handled
-        :param config_file: filename of the configuration file
+        :param config_file: filename of the configuration file, or the configuration itself as a dict
 
-        Modes of operation (NOT YET IMPLEMENTED):
+        Modes of operation (REAL NOT YET IMPLEMENTED):
             REAL: orders get routed to real exchange, strategy handles real resources
             TEST_LIVE: mock orders, live real data from market
-            TEST_HISTORICAL: mock orders, data is supplied as in TEST_LIVE but from historical sources
+            TEST_HISTORICAL: mock orders, data is supplied as in TEST_LIVE but from historical sources,
+                replayed in process as fast as possible, see strategy.replay
         """
-        # TODO: implement backtest mode and real mode
+        # TODO: implement real mode
         self.logger = logging.getLogger('strategy_framework')
 
-        # set false to kill strategy
+        # false once the strategy is shut down, see shutdown
         self.RUN = True
 
         # load config
         try:
-            self.config = json.loads(open('config.json').read())
+            if isinstance(config_file, dict):
+                self.config = config_file
+            else:
+                self.config = json.loads(open(config_file).read())
         except FileNotFoundError:
             self.logger.error('Could not find config file %s, aborting...' % config_file)
             sys.exit(1)
@@ -49,32 +70,116 @@ class Strategy:
         self.PORT = self.config['port']
         self.MANAGER_ADDRESS = self.config['manager_address']
         self.MANAGER_PORT = self.config['manager_port']
+        # wire codecs offered to the other components, in order of preference
+        self.CODECS = self.config.get('codecs', SUPPORTED_CODECS)
+        # optional settings of the strategy server, see ApiServer
+        self.SERVER_OPTIONS = self.config.get('api_server', {})
+        # feed events queued at most, see class description
+        self.MAX_PENDING_FEEDS = self.config.get('max_pending_feeds', MAX_PENDING_FEEDS)
+        # host reported to the manager, interfaces on the same host send feeds through shared memory
+        self.HOSTNAME = socket.gethostname() if self.config.get('shm_transport', True) else None
 
         self.allocated_funds = 0
 
         # active subscriptions
         self.subscriptions = {}
+        # state of the delta feeds, indexed by stream ID
+        self.feed_streams = {}
+        # reads the feeds sent through shared memory
+        self.shm_reader = ShmFeedReader(self)
 
         # server listening to incoming queries
         self.strategy_server = None
 
+        # runs the endpoints and timers of the strategy, in the thread calling boot
+        self.run_loop = RunLoop('strategy_loop')
+        self.run_loop.add_shutdown_callback(self.shm_reader.stop)
+        self.event_handlers = {
+            'INIT': self.on_init,
+            'START': self.on_start,
+            'STOP': self.on_stop,
+            'REALLOCATE': self.on_funds_reallocation,
+            'MARKET_DATA_FEED': self.on_data_feed_recv,
+            'MARKET_DATA_FEED_BATCH': self.handle_feed_batch,
+            'MARKET_DATA_DELTA': self.handle_feed_delta
+        }
+        # feed events queued, guarded by feed_room, which is notified when one is handled
+        self.pending_feeds = 0
+        self.feed_room = threading.Condition()
+        self.feeds_dropped = 0
+        # seconds spent by the events in the queue
+        self.events_handled = 0
+        self.event_latency_total = 0.0
+        self.event_latency_max = 0.0
+
+        # source of the current time, simulated during historical replays, see now
+        self.clock = time.time
+        # historical replay serving the subscriptions, in TEST_HISTORICAL mode
+        self.replay = None
+        # settings of the historical replay: storage, start_time, end_time, speed, resources
+        self.REPLAY_OPTIONS = self.config.get('replay', {})
+
     def boot(self):
         """
         Start all the processes and do all the things needed to start rollin'
         """
+        if self.MODE == 'TEST_HISTORICAL':
+            # no manager nor interfaces involved
+            self.run_historical()
+            return
+
         # register strategy with manager
         self.register()
 
         # start listening server
-        self.strategy_server = StrategyApiServer(self.HOST, self.PORT, self)
+        self.strategy_server = StrategyApiServer(self.HOST, self.PORT, self, **self.SERVER_OPTIONS)
         self.strategy_server.start()
 
-        # start main strategy body
-        self.strategy_cycle()
+        # start main strategy body, and handle events until shutdown
+        self.run_loop.call_soon(self.strategy_cycle)
+        self.run_loop.run()
+        self.RUN = False
+
+    def shutdown(self):
+        """
+        Stop the strategy, once the events already received are handled. Safe to call from any thread.
+        """
+        self.RUN = False
+        self.run_loop.stop()
+
+    def run_historical(self, history=None):
+        """
+        Run the strategy over historical data, with the settings of the replay configuration.
+
+        :param history: TickStorage or dict of columns by symbol, by default the storage in the
+                replay configuration
+        :return: dict with the stats of the replay
+        """
+        if history is None:
+            history = TickStorage(self.REPLAY_OPTIONS['storage'])
+        replay = HistoricalReplay(self, history,
+                                  start_time=self.REPLAY_OPTIONS.get('start_time'),
+                                  end_time=self.REPLAY_OPTIONS.get('end_time'),
+                                  speed=self.REPLAY_OPTIONS.get('speed'))
+        self.STATUS = 'REPLAYING'
+        stats = replay.run({'resources': self.REPLAY_OPTIONS.get('resources', 0)})
+        self.logger.info('Historical replay done, %d messages at %.0f/s'
+                         % (stats['events'], stats['events_per_second']))
+        self.RUN = False
+        return stats
+
+    def now(self):
+        """
+        :return: current time, the time of the data being replayed during historical replays
+        """
+        return self.clock()
 
     def register_callback(self, resp):
         if resp['status'] == 'SUCCESS':
-            self.logger.info('Strategy registered')
+            # talk to the manager with the negotiated codec from now on
+            codec = get_codec(resp['data'].get('data', {}).get('codec'))
+            get_connection(self.MANAGER_ADDRESS, self.MANAGER_PORT).codec = codec
+            self.logger.info('Strategy registered, using %s codec' % codec.name)
         else:
             self.logger.error('Could not register strategy: %s', resp['message'])
             sys.exit(1)
@@ -90,6 +195,8 @@ class Strategy:
                 'strategy_address': self.HOST,
                 'strategy_port': self.PORT,
                 'mode': self.MODE,
+                'codecs': self.CODECS,
+                'hostname': self.HOSTNAME,
             }
         }
 
@@ -100,6 +207,86 @@ class Strategy:
                            True,
                            self.register_callback)
 
+    ##################################
+    #         INCOMING EVENTS        #
+    ##################################
+
+    def post_event(self, query, data):
+        """
+        Queue an incoming command or feed, called by the threads receiving them.
+        Wakes the run loop up, which hands it to its endpoint.
+        Feeds wait for room in the queue, and are dropped if there is none, see class description.
+
+        :param query: query of the message, see event_handlers
+        :param data: data of the message
+        """
+        if query in FEED_EVENTS:
+            with self.feed_room:
+                # the run loop itself can't wait for room, it is the one making it
+                if self.run_loop.thread is not threading.current_thread():
+                    self.feed_room.wait_for(lambda: self.pending_feeds < self.MAX_PENDING_FEEDS,
+                                            FEED_QUEUE_TIMEOUT)
+                if self.pending_feeds >= self.MAX_PENDING_FEEDS:
+                    self.feeds_dropped += 1
+                    if self.feeds_dropped == 1 or self.feeds_dropped % self.MAX_PENDING_FEEDS == 0:
+                        self.logger.warning('Strategy falling behind its feeds, %d dropped' % self.feeds_dropped)
+                    return
+                self.pending_feeds += 1
+        self.run_loop.call_soon(self.process_event, (query, data, time.perf_counter()))
+
+    def process_event(self, event):
+        """
+        Hand a queued event to its endpoint.
+
+        :param event: (query, data, time queued)
+        """
+        query, data, queued = event
+        if query in FEED_EVENTS:
+            with self.feed_room:
+                self.pending_feeds -= 1
+                self.feed_room.notify()
+        latency = time.perf_counter() - queued
+        self.events_handled += 1
+        self.event_latency_total += latency
+        if latency > self.event_latency_max:
+            self.event_latency_max = latency
+        try:
+            self.event_handlers[query](data)
+        except Exception as e:
+            self.logger.error('Error handling %s: %s' % (query, e))
+
+    def event_metrics(self):
+        """
+        :return: dict with the events handled, the events waiting, the feeds waiting and dropped,
+                and the mean and max seconds spent by the events in the queue
+        """
+        return {
+            'handled': self.events_handled,
+            'pending': self.run_loop.pending(),
+            'pending_feeds': self.pending_feeds,
+            'dropped_feeds': self.feeds_dropped,
+            'mean_latency': self.event_latency_total / self.events_handled if self.events_handled else 0.0,
+            'max_latency': self.event_latency_max
+        }
+
+    def handle_feed_delta(self, data):
+        data = self.apply_feed_delta(data)
+        if data is not None:
+            self.on_data_feed_recv(data)
+
+    def handle_feed_batch(self, data):
+        # the batch carries whole MARKET_DATA_FEED and MARKET_DATA_DELTA messages
+        batch = []
+        for feed in data:
+            if feed['query'] == 'MARKET_DATA_DELTA':
+                feed_data = self.apply_feed_delta(feed['data'])
+                if feed_data is not None:
+                    batch.append(feed_data)
+            else:
+                batch.append(feed['data'])
+        if batch:
+            self.on_data_feed_batch(batch)
+
     ##################################
     #        MARKET INTERFACE        #
     ##################################
@@ -111,25 +298,49 @@ class Strategy:
             self.subscriptions[sub_handle] = {
                 'market_interface_id': market_interface_id
             }
+            if 'shm_name' in resp['data']:
+                # the interface is on this host, and sends the feed through shared memory
+                self.shm_reader.attach(resp['data']['shm_name'])
+            if 'stream' in resp['data']:
+                # the first snapshot may have already arrived
+                stream = self.feed_streams.setdefault(resp['data']['stream'], {'seq': None, 'data': None})
+                stream['subscription_handle'] = sub_handle
+                stream['resyncing'] = False
         else:
             self.logger.error('Could not subscribe to data feed: %s' % resp['message'])
 
-    def subscribe(self, market_interface_id, symbol, frequency):
+    def subscribe(self, market_interface_id, symbol, frequency, mode='poll', delta=False, granularity=None):
         """
         Subscribe to data feed.
 
         :param market_interface_id: ID of the desired market interface
         :param symbol: requested symbol
-        :param frequency: number of seconds between feed messages
+        :param frequency: number of seconds between feed messages, in event mode the minimum
+                number of seconds between them (0 to receive every update)
+        :param mode: poll to receive data periodically, event to receive updates as soon as
+                the interface publishes them
+        :param delta: True to have the interface send only the fields that changed, the full
+                data is rebuilt before being handed to on_data_feed_recv
+        :param granularity: to receive OHLCV bars instead of ticks, seconds covered by each bar
+                or string like 1s, 1m, 5m. Bars are sent when complete in event mode, the bar
+                being built is sent in poll mode
         """
         self.logger.info("Subscribing to %s:%s..." % (market_interface_id, symbol))
+        if self.replay is not None:
+            # served from history, deltas make no difference in process
+            self.replay.subscribe(market_interface_id, symbol, frequency, mode, granularity)
+            return
+
         query = {
             'query': 'INTERFACE_SUBSCRIBE',
             'data': {
                 'strategy_id': self.STRATEGY_ID,
                 'market_interface_id': market_interface_id,
                 'symbol': symbol,
-                'frequency': frequency
+                'frequency': frequency,
+                'mode': mode,
+                'delta': delta,
+                'granularity': granularity
             }
         }
 
@@ -156,6 +367,9 @@ class Strategy:
         :param subscription_handle: handle of the deleted subscription
         """
         self.logger.info("Unsubscribing from %s..." % subscription_handle)
+        if self.replay is not None:
+            self.replay.unsubscribe(subscription_handle)
+            return
 
         market_interface_id = self.subscriptions[subscription_handle]['market_interface_id']
         query = {
@@ -182,20 +396,111 @@ class Strategy:
         for sub in all_subs:
             self.unsubscribe(sub)
 
-    def get_bulk_data(self, market_interface_id, symbol, start_time, end_time, frequency):
+    def apply_feed_delta(self, delta):
+        """
+        Apply a delta feed message to the state of its stream.
+        On a gap in the sequence numbers a resync is requested, and the deltas are ignored
+        until the snapshot arrives.
+
+        :param delta: data of the MARKET_DATA_DELTA message
+        :return: the full feed data, None if it is not known
+        """
+        stream = self.feed_streams.setdefault(delta['stream'], {'seq': None, 'data': None, 'resyncing': False})
+        if 'snapshot' in delta:
+            stream['seq'] = delta['seq']
+            stream['data'] = delta['snapshot']
+            stream['resyncing'] = False
+            return stream['data']
+
+        if stream['seq'] is None or delta['seq'] != stream['seq'] + 1:
+            if stream['seq'] is not None and delta['seq'] <= stream['seq']:
+                # stale
+                return None
+            stream['seq'] = None
+            if not stream['resyncing'] and 'subscription_handle' in stream:
+                self.logger.warning('Gap in feed stream %s, resyncing' % delta['stream'])
+                stream['resyncing'] = True
+                self.request_resync(stream['subscription_handle'])
+            return None
+
+        data = dict(stream['data'])
+        data.update(delta['changed'])
+        for field in delta['removed']:
+            data.pop(field, None)
+        stream['seq'] = delta['seq']
+        stream['data'] = data
+        return data
+
+    def resync_callback(self, resp, subscription_handle):
+        if resp['status'] == 'SUCCESS':
+            self.logger.info('Resync of %s requested successfully' % subscription_handle)
+        else:
+            self.logger.error('Could not resync %s: %s' % (subscription_handle, resp['message']))
+
+    def request_resync(self, subscription_handle):
+        """
+        Ask for a full snapshot on a delta subscription.
+
+        :param subscription_handle: handle of the subscription
+        """
+        query = {
+            'query': 'FEED_RESYNC',
+            'data': {
+                'strategy_id': self.STRATEGY_ID,
+                'market_interface_id': self.subscriptions[subscription_handle]['market_interface_id'],
+                'subscription_handle': subscription_handle
+            }
+        }
+
+        # send resync request to manager in separate thread
+        handler = threading.Thread(target=message_to_address,
+                                   args=(self.MANAGER_ADDRESS,
+                                         self.MANAGER_PORT,
+                                         query,
+                                         True,
+                                         lambda resp: self.resync_callback(resp, subscription_handle)))
+        handler.start()
+
+    def get_bulk_data(self, market_interface_id, symbol, start_time=None, end_time=None, frequency=None,
+                      chunk_size=None):
         """
         Get data in bulk for a certain symbol during a certain time period.
-        The market interface will send it in one, big response.
+        The market interface streams it in columnar chunks, which are yielded as they arrive,
+        so only a few of them are held in memory at any time.
         Useful for getting historical data during setup.
 
-        :param market_interface_id:
-        :param symbol:
-        :param start_time:
-        :param end_time:
-        :param frequency:
-        :return:
+        :param market_interface_id: ID of the concerned market interface
+        :param symbol: requested symbol
+        :param start_time: lower bound of the tick timestamps, None for no bound
+        :param end_time: upper bound of the tick timestamps, None for no bound
+        :param frequency: requested data granularity, in seconds
+        :param chunk_size: maximum number of ticks in each chunk, interface default if None
+        :return: generator of chunks, dicts with the symbol and the timestamp and field columns (lists).
+                Stops early if the request fails, the error is logged.
         """
-        pass
+        query = {
+            'query': 'BULK_DATA',
+            'data': {
+                'strategy_id': self.STRATEGY_ID,
+                'market_interface_id': market_interface_id,
+                'symbol': symbol,
+                'start_time': start_time,
+                'end_time': end_time,
+                'frequency': frequency,
+                'chunk_size': chunk_size
+            }
+        }
+
+        for res in stream_from_address(self.MANAGER_ADDRESS, self.MANAGER_PORT, query):
+            if res['status'] == 'SUCCESS':
+                res = res['data']
+            if res['status'] == 'FAIL':
+                self.logger.error('Bulk data request for %s failed: %s' % (symbol, res.get('message')))
+                return
+            if res['data'].get('backfilling'):
+                # keep-alive, sent while the interface fills the gaps of the range
+                continue
+            yield res['data']
 
     def get_current_data(self, market_interface_id, symbol):
         """
@@ -215,7 +520,11 @@ class Strategy:
     """
 
     def strategy_cycle(self):
-        """Main strategy body, should contain cycle with algorithm logic"""
+        """
+        Main strategy body, called in the run loop once the strategy is booted.
+        Should not block: periodic algorithm logic is scheduled with run_loop.call_every,
+        and reactions to data go in the event handlers.
+        """
         pass
 
     # lifecycle functions
@@ -232,6 +541,14 @@ class Strategy:
         """Called when stop command is received from the manager"""
         pass
 
+    def get_metrics(self):
+        """
+        Called at the end of historical replays, e.g. by parameter sweeps, see strategy.sweep
+
+        :return: dict of the performance metrics of the strategy, e.g. PnL
+        """
+        return {}
+
     # event handlers
 
     def on_funds_reallocation(self, data):
@@ -241,3 +558,13 @@ class Strategy:
     def on_data_feed_recv(self, data):
         """Called when the strategy receives a data feed message from one of its subscriptions"""
         pass
+
+    def on_data_feed_batch(self, batch):
+        """
+        Called when the strategy receives a batch of data feed messages, possibly from many subscriptions.
+        By default every message is handed to on_data_feed_recv, in order.
+
+        :param batch: list of the data of the feed messages
+        """
+        for data in batch:
+            self.on_data_feed_recv(data)
@@ -0,0 +1,125 @@
+import os
+import csv
+import time
+import shutil
+import logging
+import tempfile
+import itertools
+import concurrent.futures
+
+from market_interface.tick_storage import TickStorage
+
+
+"""
+Parallel parameter sweeps of strategies over historical data.
+
+Every combination of a parameter grid is a run: a strategy built from the parameters and replayed
+over the history, see Strategy.run_historical. Runs are spread over a pool of processes, one per
+core by default, and handed out one at a time so that slow runs do not hold up the others.
+The history is never sent to the workers: each of them opens the tick storage once, and reads it
+through memory maps, so all the processes share the same pages of the OS cache.
+The metrics of the runs are collected in a single table, one row per run.
+"""
+
+# storage of the worker process, opened by init_worker
+_storage = None
+
+
+def expand_grid(grid):
+    """
+    :param grid: dict of lists of values, by parameter name
+    :return: list of dicts of parameters, one for every combination of values
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def init_worker(root):
+    global _storage
+    _storage = TickStorage(root)
+
+
+def run_one(factory, params, options):
+    """
+    Replay a strategy in a worker process.
+
+    :param factory: callable building the strategy from the parameters, e.g. a Strategy subclass
+    :param params: dict of parameters, passed as keyword arguments
+    :param options: replay settings, see Strategy.REPLAY_OPTIONS
+    :return: dict with the replay stats and the metrics of the strategy
+    """
+    strategy = factory(**params)
+    strategy.REPLAY_OPTIONS.update(options)
+    stats = strategy.run_historical(_storage)
+    result = {
+        'events': stats['events'],
+        'wall_time': stats['wall_time']
+    }
+    result.update(strategy.get_metrics())
+    return result
+
+
+def run_sweep(factory, grid, history, start_time=None, end_time=None, resources=0, workers=None):
+    """
+    Replay a strategy for every combination of a parameter grid, in parallel.
+
+    :param factory: callable building the strategy from the parameters, e.g. a Strategy subclass.
+            Must be importable by the workers, i.e. defined at module level
+    :param grid: dict of lists of values, by parameter name, see expand_grid
+    :param history: root of a TickStorage, or dict of columns by symbol, which is written to a
+            temporary storage for the workers to share
+    :param start_time: lower bound of the replayed timestamps, None for no bound
+    :param end_time: upper bound of the replayed timestamps, None for no bound
+    :param resources: funds given to the strategies at INIT
+    :param workers: number of processes, one per core if None
+    :return: list of result rows, in grid order: the parameters, the replay events and wall time,
+            the metrics of the strategy (see Strategy.get_metrics), and the error if the run failed
+    """
+    logger = logging.getLogger('sweep')
+
+    root = history
+    if isinstance(history, dict):
+        root = tempfile.mkdtemp(prefix='sweep_')
+        storage = TickStorage(root)
+        for symbol, columns in history.items():
+            storage.write(symbol, columns)
+        storage.close()
+
+    runs = expand_grid(grid)
+    options = {'start_time': start_time, 'end_time': end_time, 'resources': resources}
+    rows = [dict(params) for params in runs]
+    start = time.perf_counter()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                                    initializer=init_worker,
+                                                    initargs=(root,)) as executor:
+            futures = {executor.submit(run_one, factory, params, options): i for i, params in enumerate(runs)}
+            for future in concurrent.futures.as_completed(futures):
+                row = rows[futures[future]]
+                try:
+                    row.update(future.result())
+                except Exception as e:
+                    logger.error('Run %s failed: %s' % (row, e))
+                    row['error'] = str(e)
+    finally:
+        if root is not history:
+            shutil.rmtree(root, ignore_errors=True)
+
+    logger.info('Swept %d runs in %.3fs' % (len(runs), time.perf_counter() - start))
+    return rows
+
+
+def write_csv(rows, path):
+    """
+    Save a result table.
+
+    :param rows: result rows, see run_sweep
+    :param path: filename of the CSV file
+    """
+    columns = []
+    for row in rows:
+        columns.extend(name for name in row if name not in columns)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
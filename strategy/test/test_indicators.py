@@ -0,0 +1,94 @@
+import math
+
+import pytest
+import numpy as np
+
+from strategy import indicators
+
+
+@pytest.fixture()
+def series():
+    rng = np.random.default_rng(7)
+    prices = 100 + np.cumsum(rng.normal(size=2000))
+    volumes = rng.integers(0, 10, size=2000).astype(float)
+    return prices, volumes
+
+
+def run(indicator, values, *others):
+    return np.array([indicator.update(*args) for args in zip(values, *others)], dtype=float)
+
+
+@pytest.mark.parametrize('window', [1, 5, 50])
+def test_incremental_matches_batch(series, window):
+    prices, volumes = series
+    cases = [
+        (indicators.SMA(window), indicators.sma(prices, window)),
+        (indicators.EMA(window), indicators.ema(prices, window)),
+        (indicators.RollingVariance(window), indicators.rolling_var(prices, window)),
+        (indicators.RollingVariance(window, ddof=1), indicators.rolling_var(prices, window, ddof=1)),
+        (indicators.RollingMin(window), indicators.rolling_min(prices, window)),
+        (indicators.RollingMax(window), indicators.rolling_max(prices, window)),
+        (indicators.ZScore(window), indicators.zscore(prices, window)),
+    ]
+    for indicator, expected in cases:
+        np.testing.assert_allclose(run(indicator, prices), expected, rtol=1e-7, atol=1e-7)
+
+    for vwap_window in (None, window):
+        np.testing.assert_allclose(run(indicators.VWAP(vwap_window), prices, volumes),
+                                   indicators.vwap(prices, volumes, vwap_window), rtol=1e-9)
+
+
+def test_batch_reference(series):
+    prices, _ = series
+    np.testing.assert_allclose(indicators.sma(prices, 20)[19:], np.convolve(prices, np.ones(20) / 20, 'valid'))
+    np.testing.assert_allclose(indicators.rolling_std(prices, 20)[-1], prices[-20:].std())
+    # EMA over a long series, through many blocks of its closed form
+    expected = prices[0]
+    for price in prices[1:]:
+        expected += 0.01 * (price - expected)
+    assert indicators.ema(prices, alpha=0.01)[-1] == pytest.approx(expected)
+
+
+def test_chunked_variance(series, monkeypatch):
+    prices, _ = series
+    expected = indicators.rolling_var(prices, 50, ddof=1)
+    # a few windows per chunk, and a single one when the window is bigger than the chunk
+    for chunk in (120, 10):
+        monkeypatch.setattr(indicators, 'VAR_CHUNK_SIZE', chunk)
+        np.testing.assert_array_equal(indicators.rolling_var(prices, 50, ddof=1), expected)
+
+
+def test_variance_does_not_drift():
+    # small moves on a large level, the incremental sums would lose precision over a long run
+    rng = np.random.default_rng(3)
+    prices = 1e6 + np.cumsum(rng.normal(size=200000)) * 0.01
+    actual = run(indicators.RollingVariance(20), prices)
+    expected = indicators.rolling_var(prices, 20)
+    np.testing.assert_allclose(actual[-20:], expected[-20:], rtol=1e-6)
+
+
+def test_warmup(series):
+    prices, volumes = series
+    history, live = prices[:1500], prices[1500:]
+    for make in (lambda: indicators.SMA(30), lambda: indicators.EMA(30), lambda: indicators.RollingVariance(30),
+                 lambda: indicators.RollingMin(30), lambda: indicators.RollingMax(30),
+                 lambda: indicators.ZScore(30)):
+        warm, cold = make(), make()
+        warm.warmup(history)
+        run(cold, history)
+        np.testing.assert_allclose(run(warm, live), run(cold, live), rtol=1e-7, atol=1e-7)
+
+    warm, cold = indicators.VWAP(30), indicators.VWAP(30)
+    warm.warmup(history, volumes[:1500])
+    run(cold, history, volumes[:1500])
+    np.testing.assert_allclose(run(warm, live, volumes[1500:]), run(cold, live, volumes[1500:]))
+
+
+def test_undefined_values():
+    assert math.isnan(indicators.RollingVariance(5, ddof=1).update(1))
+    assert indicators.ZScore(5).update(3) == 0
+    assert math.isnan(indicators.VWAP().update(10, 0))
+    with pytest.raises(ValueError):
+        indicators.SMA(0)
+    with pytest.raises(ValueError):
+        indicators.EMA(alpha=2)
@@ -0,0 +1,132 @@
+import shutil
+import tempfile
+
+import pytest
+import numpy as np
+
+from market_interface.tick_storage import TickStorage
+from strategy.replay import HistoricalReplay
+from strategy.strategy_template import Strategy
+
+CONFIG = {
+    "host": "TEST_HOST",
+    "port": 7357,
+    "manager_address": "TEST_HOST",
+    "manager_port": 7357
+}
+
+
+class RecordingStrategy (Strategy):
+    def __init__(self, subscriptions):
+        Strategy.__init__(self, 'TEST_STRAT', 'TEST_HISTORICAL', CONFIG)
+        self.to_subscribe = subscriptions
+        self.received = []
+        self.lifecycle = []
+
+    def on_init(self, data):
+        self.lifecycle.append(('init', data))
+        for args in self.to_subscribe:
+            self.subscribe('TEST_INTERFACE', *args)
+
+    def on_start(self, data):
+        self.lifecycle.append(('start', data))
+
+    def on_stop(self, data):
+        self.lifecycle.append(('stop', data))
+
+    def on_data_feed_recv(self, data):
+        self.received.append((self.now(), data))
+
+
+@pytest.fixture()
+def history():
+    timestamps = np.arange(0.0, 10.0)
+    return {
+        'A': {'timestamp': timestamps, 'value': timestamps * 10},
+        'B': {'timestamp': timestamps + 0.5, 'value': -timestamps}
+    }
+
+
+def test_event_replay(history):
+    strat = RecordingStrategy([('A', 0, 'event'), ('B', 0, 'event')])
+    stats = HistoricalReplay(strat, history, start_time=2, end_time=5).run({'resources': 100})
+
+    assert [name for name, _ in strat.lifecycle] == ['init', 'start', 'stop']
+    assert strat.lifecycle[0][1] == {'resources': 100}
+    # merged in timestamp order, the clock reads the replayed time
+    assert [t for t, _ in strat.received] == [2, 2.5, 3, 3.5, 4, 4.5, 5]
+    assert strat.received[0][1] == {'timestamp': 2, 'value': 20}
+    assert strat.received[1][1] == {'timestamp': 2.5, 'value': -2}
+    assert stats['events'] == 7
+    assert strat.replay is None and strat.now() > 1e9
+
+
+def test_poll_and_bars(history):
+    strat = RecordingStrategy([('A', 3)])
+    HistoricalReplay(strat, history).run()
+    assert [data['value'] for _, data in strat.received] == [0, 30, 60, 90]
+
+    strat = RecordingStrategy([('A', 0, 'event', False, 4)])
+    HistoricalReplay(strat, history).run()
+    bars = [data for _, data in strat.received]
+    assert [(bar['timestamp'], bar['open'], bar['close'], bar['count']) for bar in bars] == \
+        [(0, 0, 30, 4), (4, 40, 70, 4)]
+
+
+def test_unsubscribe(history):
+    class Unsubscribing (RecordingStrategy):
+        def on_data_feed_recv(self, data):
+            super().on_data_feed_recv(data)
+            if data['value'] == 30:
+                self.unsubscribe_all()
+
+    strat = Unsubscribing([('A', 0, 'event')])
+    HistoricalReplay(strat, history).run()
+    assert len(strat.received) == 4
+    assert strat.subscriptions == {}
+
+
+def test_historical_boot():
+    root = tempfile.mkdtemp()
+    try:
+        storage = TickStorage(root)
+        for t in range(5):
+            storage.append('A', {'value': t}, 1609459200.0 + t)
+        storage.close()
+
+        strat = RecordingStrategy([('A', 0, 'event')])
+        strat.REPLAY_OPTIONS = {'storage': root, 'resources': 5}
+        strat.boot()
+        assert [data['value'] for _, data in strat.received] == [0, 1, 2, 3, 4]
+        assert not strat.RUN
+    finally:
+        shutil.rmtree(root)
+
+
+def test_lazy_feeds():
+    # polls over a long span are built as they are replayed, not up front
+    history = {'A': {'timestamp': np.array([0.0, 1e12]), 'value': np.array([1.0, 2.0])}}
+    replay = HistoricalReplay(RecordingStrategy([]), history)
+    feed = replay.feed({'symbol': 'A', 'frequency': 1, 'mode': 'poll', 'granularity': None})
+    assert [next(feed) for _ in range(3)] == [(t, {'timestamp': 0.0, 'value': 1.0}) for t in (0.0, 1.0, 2.0)]
+
+
+def test_storage_views():
+    root = tempfile.mkdtemp()
+    try:
+        t0 = 1609459200.0
+        storage = TickStorage(root)
+        for t in [t0, t0 + 1, t0 + 86400, t0 + 86401]:
+            storage.append('A', {'value': t - t0}, t)
+        storage.close()
+
+        replay = HistoricalReplay(RecordingStrategy([]), storage)
+        parts = replay.load('A')
+        # one memory-mapped part per day, nothing copied
+        assert len(parts) == 2
+        assert all(isinstance(part['timestamp'].base, np.memmap) for part in parts)
+
+        feed = replay.feed({'symbol': 'A', 'frequency': 43200, 'mode': 'poll', 'granularity': None})
+        assert [message['value'] for _, message in feed] == [0, 1, 86400, 86401]
+    finally:
+        shutil.rmtree(root)
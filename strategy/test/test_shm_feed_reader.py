@@ -0,0 +1,82 @@
+import os
+import mock
+import pytest
+
+from common.codec import JSON_CODEC, BINARY_CODEC
+from common.shm_ring import ShmRing
+from strategy.shm_feed_reader import ShmFeedReader
+
+
+@pytest.fixture()
+def ring():
+    ring = ShmRing('hydra_test_reader_%d' % os.getpid(), create=True, slots=16, slot_size=256)
+    yield ring
+    ring.close()
+
+
+@pytest.fixture()
+def reader():
+    reader = ShmFeedReader(mock.Mock())
+    yield reader
+    reader.stop()
+
+
+def test_poll(ring, reader):
+    with mock.patch.object(reader, 'start'):
+        assert reader.attach(ring.name)
+    ring.write(JSON_CODEC.encode({'query': 'MARKET_DATA_FEED', 'data': {'value': 1}}))
+    ring.write(BINARY_CODEC.encode({'query': 'MARKET_DATA_FEED', 'data': {'value': 2.0}}))
+    ring.write(b'garbage')
+    assert reader.poll() == 2
+    reader.handler.STRATEGY.post_event.assert_has_calls([mock.call('MARKET_DATA_FEED', {'value': 1}),
+                                                        mock.call('MARKET_DATA_FEED', {'value': 2.0})])
+    assert reader.poll() == 0
+
+
+def test_attach_missing(reader):
+    assert not reader.attach('hydra_test_missing_ring')
+    assert not reader.running
+
+
+def test_running(ring, reader):
+    reader.idle_spins = 0
+    assert reader.attach(ring.name)
+    assert reader.attach(ring.name)
+    ring.write(JSON_CODEC.encode({'query': 'MARKET_DATA_FEED', 'data': {'value': 1}}))
+    for _ in range(200):
+        if reader.handler.STRATEGY.post_event.called:
+            break
+        reader.join(0.01)
+    reader.handler.STRATEGY.post_event.assert_called_once_with('MARKET_DATA_FEED', {'value': 1})
+
+
+def test_ring_created_again(ring, reader):
+    with mock.patch.object(reader, 'start'):
+        assert reader.attach(ring.name)
+        ring.write(JSON_CODEC.encode({'query': 'MARKET_DATA_FEED', 'data': {'value': 1}}))
+        # the writer releases the ring, and creates it again for a new subscription
+        name = ring.name
+        ring.close()
+        new_ring = ShmRing(name, create=True, slots=16, slot_size=256)
+        try:
+            new_ring.write(JSON_CODEC.encode({'query': 'MARKET_DATA_FEED', 'data': {'value': 2}}))
+            assert reader.attach(name)
+            assert reader.poll() == 2
+            reader.handler.STRATEGY.post_event.assert_has_calls([mock.call('MARKET_DATA_FEED', {'value': 1}),
+                                                                mock.call('MARKET_DATA_FEED', {'value': 2})])
+            assert reader.retired == [] and reader.rings[name].ring_id == new_ring.ring_id
+        finally:
+            new_ring.close()
+
+
+def test_idle_backoff(reader):
+    reader.idle_spins = 0
+    reader.running = True
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        reader.running = len(sleeps) < 8
+    with mock.patch('strategy.shm_feed_reader.time.sleep', side_effect=sleep):
+        reader.run()
+    assert sleeps == [0.0005, 0.001, 0.002, 0.004, 0.008, 0.016, 0.02, 0.02]
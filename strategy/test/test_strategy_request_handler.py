@@ -2,6 +2,23 @@ import pytest
 import json
 import mock
 import strategy.strategy_request_handler as strat_handler
+from common.framing import HEADER
+
+
+def frame(msg):
+    body = json.dumps(msg).encode()
+    return HEADER.pack(len(body)) + body
+
+
+def set_request(sock, msg):
+    pending = bytearray(frame(msg))
+
+    def recv_into(buf, size):
+        chunk = pending[:size]
+        buf[:len(chunk)] = chunk
+        del pending[:len(chunk)]
+        return len(chunk)
+    sock.recv_into.side_effect = recv_into
 
 
 @pytest.fixture
@@ -18,6 +35,7 @@ def req_handler(mock_strat, mock_logger, src_sock):
     mock_strat.on_start.return_value = "start called"
     mock_strat.on_resume.return_value = "resume called"
     mock_strat.on_stop.return_value = "stop called"
+    mock_strat.post_event.return_value = None
     mock_strat.logger = mock_logger
     req_handler = strat_handler.StrategyRequestHandler(src_sock, mock_strat)
     return req_handler
@@ -30,10 +48,10 @@ def test_handle_init(req_handler, src_sock):
             'message': 'TEST_INIT'
         }
     }
-    src_sock.recv.return_value.decode.return_value = json.dumps(msg)
+    set_request(src_sock, msg)
     req_handler.start()
     req_handler.join()
-    req_handler.STRATEGY.on_init.assert_called_with(msg['data'])
+    req_handler.STRATEGY.post_event.assert_called_with('INIT', msg['data'])
 
 
 def test_handle_start(req_handler, src_sock):
@@ -43,10 +61,10 @@ def test_handle_start(req_handler, src_sock):
             'message': 'TEST_START'
         }
     }
-    src_sock.recv.return_value.decode.return_value = json.dumps(msg)
+    set_request(src_sock, msg)
     req_handler.start()
     req_handler.join()
-    req_handler.STRATEGY.on_start.assert_called_with(msg['data'])
+    req_handler.STRATEGY.post_event.assert_called_with('START', msg['data'])
 
 
 def test_handle_stop(req_handler, src_sock):
@@ -56,10 +74,10 @@ def test_handle_stop(req_handler, src_sock):
             'message': 'TEST_STOP'
         }
     }
-    src_sock.recv.return_value.decode.return_value = json.dumps(msg)
+    set_request(src_sock, msg)
     req_handler.start()
     req_handler.join()
-    req_handler.STRATEGY.on_stop.assert_called_with(msg['data'])
+    req_handler.STRATEGY.post_event.assert_called_with('STOP', msg['data'])
 
 
 def test_handle_unknown(req_handler, src_sock):
@@ -69,7 +87,7 @@ def test_handle_unknown(req_handler, src_sock):
             'message': 'SOMETHING SOMETHING'
         }
     }
-    src_sock.recv.return_value.decode.return_value = json.dumps(msg)
+    set_request(src_sock, msg)
     req_handler.start()
     req_handler.join()
     req_handler.logger.error.assert_called_with('Unknown request: %s' % msg['query'])
@@ -80,10 +98,10 @@ def test_ping(req_handler, src_sock):
         'query': 'PING',
         'data': {}
     }
-    src_sock.recv.return_value.decode.return_value = json.dumps(msg)
+    set_request(src_sock, msg)
     req_handler.start()
     req_handler.join()
-    src_sock.send.assert_called_with(json.dumps(strat_handler.PONG_RESPONSE).encode())
+    src_sock.sendall.assert_called_with(frame(strat_handler.PONG_RESPONSE))
 
 
 def test_handle_feed_recv(req_handler, src_sock):
@@ -93,7 +111,30 @@ def test_handle_feed_recv(req_handler, src_sock):
             'message': 'TEST_FEED_RECV'
         }
     }
-    src_sock.recv.return_value.decode.return_value = json.dumps(msg)
+    set_request(src_sock, msg)
+    req_handler.start()
+    req_handler.join()
+    req_handler.STRATEGY.post_event.assert_called_with('MARKET_DATA_FEED', msg['data'])
+
+
+def test_handle_feed_batch(req_handler, src_sock):
+    feeds = [{'query': 'MARKET_DATA_FEED', 'data': {'value': i}} for i in range(3)]
+    msg = {
+        'query': 'MARKET_DATA_FEED_BATCH',
+        'data': feeds
+    }
+    set_request(src_sock, msg)
+    req_handler.start()
+    req_handler.join()
+    req_handler.STRATEGY.post_event.assert_called_with('MARKET_DATA_FEED_BATCH', feeds)
+
+
+def test_handle_feed_delta(req_handler, src_sock):
+    msg = {
+        'query': 'MARKET_DATA_DELTA',
+        'data': {'stream': 'S', 'seq': 1, 'snapshot': {'value': 1}}
+    }
+    set_request(src_sock, msg)
     req_handler.start()
     req_handler.join()
-    req_handler.STRATEGY.on_data_feed_recv.assert_called_with(msg['data'])
+    req_handler.STRATEGY.post_event.assert_called_with('MARKET_DATA_DELTA', msg['data'])
@@ -1,6 +1,7 @@
 import pytest
 import mock
 import json
+import threading
 
 from strategy.strategy_template import Strategy
 
@@ -32,6 +33,8 @@ def test_register(mock_send, strat):
                 'strategy_address': strat.HOST,
                 'strategy_port': strat.PORT,
                 'mode': strat.MODE,
+                'codecs': strat.CODECS,
+                'hostname': strat.HOSTNAME,
             }
         },
         True,
@@ -131,9 +134,114 @@ def test_unsubscribe_all(mock_send, strat):
     assert mock_send.call_count == sub_len
 
 
-def test_get_bulk_data(strat):
+def test_get_current_data(strat):
     pass
 
 
-def test_get_current_data(strat):
-    pass
+@pytest.fixture()
+def delta_strat():
+    s = Strategy.__new__(Strategy)
+    s.logger = mock.Mock()
+    s.subscriptions = {'TEST_SUB': {'market_interface_id': 'TEST_INTERFACE'}}
+    s.feed_streams = {}
+    s.request_resync = mock.Mock()
+    s.subscribe_callback({'status': 'SUCCESS', 'data': {'subscription_handle': 'TEST_SUB', 'stream': 'S'}},
+                         'TEST_INTERFACE')
+    return s
+
+
+def test_apply_feed_delta(delta_strat):
+    assert delta_strat.apply_feed_delta({'stream': 'S', 'seq': 1, 'snapshot': {'a': 1, 'b': 2}}) == {'a': 1, 'b': 2}
+    assert delta_strat.apply_feed_delta({'stream': 'S', 'seq': 2, 'changed': {'a': 3, 'c': 4}, 'removed': ['b']}) \
+        == {'a': 3, 'c': 4}
+    delta_strat.request_resync.assert_not_called()
+
+
+def test_apply_feed_delta_gap(delta_strat):
+    delta_strat.apply_feed_delta({'stream': 'S', 'seq': 1, 'snapshot': {'a': 1}})
+    assert delta_strat.apply_feed_delta({'stream': 'S', 'seq': 3, 'changed': {'a': 2}, 'removed': []}) is None
+    assert delta_strat.apply_feed_delta({'stream': 'S', 'seq': 4, 'changed': {'a': 3}, 'removed': []}) is None
+    # resync requested once, until the snapshot arrives
+    delta_strat.request_resync.assert_called_once_with('TEST_SUB')
+    assert delta_strat.apply_feed_delta({'stream': 'S', 'seq': 5, 'snapshot': {'a': 4}}) == {'a': 4}
+    assert delta_strat.apply_feed_delta({'stream': 'S', 'seq': 6, 'changed': {}, 'removed': ['a']}) == {}
+
+
+@mock.patch('strategy.strategy_template.stream_from_address')
+def test_get_bulk_data(mock_stream, delta_strat):
+    delta_strat.STRATEGY_ID = 'TEST_STRAT'
+    delta_strat.MANAGER_ADDRESS, delta_strat.MANAGER_PORT = 'localhost', 0
+    mock_stream.return_value = iter([
+        {'status': 'SUCCESS', 'data': {'status': 'SUCCESS', 'data': {'symbol': 'SYM', 'backfilling': True}}},
+        {'status': 'SUCCESS', 'data': {'status': 'SUCCESS', 'data': {'timestamp': [1, 2], 'value': [3, 4]}}},
+        {'status': 'SUCCESS', 'data': {'status': 'FAIL', 'message': 'gone'}},
+        {'status': 'SUCCESS', 'data': {'status': 'SUCCESS', 'data': {'timestamp': [5], 'value': [6]}}}
+    ])
+    chunks = list(delta_strat.get_bulk_data('TEST_INTERFACE', 'SYM', 0, 10))
+    # stops at the failure
+    assert chunks == [{'timestamp': [1, 2], 'value': [3, 4]}]
+    query = mock_stream.call_args[0][2]
+    assert query['query'] == 'BULK_DATA'
+    assert query['data']['market_interface_id'] == 'TEST_INTERFACE'
+    assert query['data']['start_time'] == 0
+
+
+def test_event_consumer(strat):
+    received = []
+
+    def on_data_feed_recv(data):
+        received.append(('FEED', data['value']))
+
+    strat.on_init = lambda data: received.append(('INIT', data))
+    strat.on_data_feed_recv = on_data_feed_recv
+    strat.on_data_feed_batch = lambda batch: received.append(('BATCH', batch))
+    strat.event_handlers.update({'INIT': strat.on_init, 'MARKET_DATA_FEED': strat.on_data_feed_recv})
+    strat.apply_feed_delta = lambda data: data['snapshot']
+
+    strat.post_event('INIT', {'resources': 1})
+    strat.post_event('MARKET_DATA_FEED', {'value': 1})
+    strat.post_event('MARKET_DATA_DELTA', {'stream': 'S', 'seq': 1, 'snapshot': {'value': 2}})
+    strat.post_event('MARKET_DATA_FEED_BATCH', [{'query': 'MARKET_DATA_FEED', 'data': {'value': 3}},
+                                                {'query': 'MARKET_DATA_DELTA', 'data': {'snapshot': {'value': 4}}}])
+    strat.post_event('MARKET_DATA_FEED', {})
+    strat.post_event('MARKET_DATA_FEED', {'value': 5})
+    assert received == []
+
+    # handled in order of arrival by the run loop, a failing handler does not stop it
+    strat.run_loop.start()
+    strat.shutdown()
+    strat.run_loop.stop(wait=True)
+    assert received == [('INIT', {'resources': 1}), ('FEED', 1), ('FEED', 2),
+                        ('BATCH', [{'value': 3}, {'value': 4}]), ('FEED', 5)]
+    metrics = strat.event_metrics()
+    assert metrics['handled'] == 6 and metrics['pending'] == 0
+    assert metrics['pending_feeds'] == 0 and metrics['dropped_feeds'] == 0
+    assert 0 < metrics['mean_latency'] <= metrics['max_latency']
+
+
+@mock.patch('strategy.strategy_template.FEED_QUEUE_TIMEOUT', 0.05)
+def test_bounded_feed_queue(strat):
+    received = []
+    strat.event_handlers['MARKET_DATA_FEED'] = lambda data: received.append(data['value'])
+    strat.MAX_PENDING_FEEDS = 2
+
+    # the request handlers send back what the endpoint returns, feeds have no response
+    assert strat.post_event('MARKET_DATA_FEED', {'value': 1}) is None
+    strat.post_event('MARKET_DATA_FEED', {'value': 2})
+    # no room, after waiting for it the feed is dropped, commands are still queued
+    assert strat.post_event('MARKET_DATA_FEED', {'value': 3}) is None
+    strat.post_event('STOP', {})
+    assert strat.event_metrics()['dropped_feeds'] == 1
+    assert strat.run_loop.pending() == 3
+
+    # a receiving thread waits until the run loop makes room
+    with mock.patch('strategy.strategy_template.FEED_QUEUE_TIMEOUT', 5):
+        receiver = threading.Thread(target=strat.post_event, args=('MARKET_DATA_FEED', {'value': 4}))
+        receiver.start()
+        strat.run_loop.start()
+        receiver.join()
+    strat.shutdown()
+    strat.run_loop.stop(wait=True)
+    assert received == [1, 2, 4]
+    metrics = strat.event_metrics()
+    assert metrics['pending_feeds'] == 0 and metrics['dropped_feeds'] == 1
@@ -0,0 +1,62 @@
+import csv
+
+import numpy as np
+
+from strategy.strategy_template import Strategy
+from strategy.sweep import expand_grid, run_sweep, write_csv
+
+CONFIG = {
+    "host": "TEST_HOST",
+    "port": 7357,
+    "manager_address": "TEST_HOST",
+    "manager_port": 7357
+}
+
+# midnight of 2021-01-01, UTC
+T0 = 1609459200.0
+
+
+class ThresholdStrategy (Strategy):
+    """Counts the ticks above a threshold"""
+    def __init__(self, threshold, scale=1):
+        Strategy.__init__(self, 'SWEEP_STRAT', 'TEST_HISTORICAL', CONFIG)
+        self.threshold = threshold
+        self.scale = scale
+        self.hits = 0
+        self.funds = None
+
+    def on_init(self, data):
+        self.funds = data['resources']
+        self.subscribe('TEST_INTERFACE', 'SYM', 0, 'event')
+
+    def on_data_feed_recv(self, data):
+        if data['value'] * self.scale > self.threshold:
+            self.hits += 1
+
+    def get_metrics(self):
+        if self.threshold < 0:
+            raise ValueError('negative threshold')
+        return {'hits': self.hits, 'funds': self.funds}
+
+
+def test_expand_grid():
+    assert expand_grid({'a': [1, 2], 'b': ['x']}) == [{'a': 1, 'b': 'x'}, {'a': 2, 'b': 'x'}]
+    assert expand_grid({}) == [{}]
+
+
+def test_sweep(tmp_path):
+    history = {'SYM': {'timestamp': T0 + np.arange(100.0), 'value': np.arange(100.0)}}
+    rows = run_sweep(ThresholdStrategy, {'threshold': [-1, 49, 89], 'scale': [1, 2]}, history,
+                     start_time=T0 + 10, resources=10, workers=2)
+
+    assert [(row['threshold'], row['scale']) for row in rows] == [(-1, 1), (-1, 2), (49, 1), (49, 2),
+                                                                  (89, 1), (89, 2)]
+    assert [row.get('hits') for row in rows] == [None, None, 50, 75, 10, 55]
+    assert all(row['events'] == 90 and row['funds'] == 10 for row in rows[2:])
+    assert 'negative threshold' in rows[0]['error']
+
+    path = str(tmp_path / 'results.csv')
+    write_csv(rows, path)
+    with open(path) as f:
+        table = list(csv.DictReader(f))
+    assert len(table) == 6 and table[2]['hits'] == '50'
@@ -0,0 +1,150 @@
+import time
+import socket
+import threading
+import unittest
+import mock
+
+from common.api_server import ApiServer, EXECUTOR_MODE, BUSY_MESSAGE
+from common.framing import HEADER
+from common.messaging import Connection
+from common.request_handler import RequestHandler
+from common.worker_pool import WorkerPool
+
+
+class BlockingRequestHandler(RequestHandler):
+    def __init__(self, client_socket, release):
+        super().__init__(client_socket)
+        self.query_handlers = {
+            'ECHO': lambda data: {'status': 'SUCCESS', 'data': data},
+            'BLOCK': lambda data: release.wait(5) and {'status': 'SUCCESS', 'data': data},
+            'BROKEN': lambda data: {'status': 'SUCCESS', 'data': data['missing']}
+        }
+
+
+class BlockingApiServer (ApiServer):
+    def __init__(self, release, **server_options):
+        super().__init__('localhost', 0, **server_options)
+        self.daemon = True
+        self.release = release
+
+    def get_handler(self, client_socket):
+        return BlockingRequestHandler(client_socket, self.release)
+
+
+class TestExecutorMode(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.server = BlockingApiServer(self.release, mode=EXECUTOR_MODE, max_workers=1, max_queue_len=1)
+        self.server.start()
+        self.port = self.server.socket.getsockname()[1]
+
+    def tearDown(self):
+        self.release.set()
+
+    def request(self, query, data, results):
+        connection = Connection('localhost', self.port, response_timeout=5)
+        connection.send_message({'query': query, 'data': data}, True, lambda r: results.append(r['data']))
+
+    def wait_for(self, condition):
+        for _ in range(500):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail('Condition never met')
+
+    def test_serves_requests(self):
+        results = []
+        connection = Connection('localhost', self.port, response_timeout=5)
+        for i in range(20):
+            connection.send_message({'query': 'ECHO', 'data': i}, True, lambda r: results.append(r['data']['data']))
+        self.assertEqual(results, list(range(20)))
+        self.assertEqual(self.server.get_metrics()['connections'], 1)
+
+    def test_busy(self):
+        results = []
+        threads = [threading.Thread(target=self.request, args=('BLOCK', 0, results))]
+        threads[0].start()
+        self.wait_for(lambda: self.server.get_metrics()['active_workers'] == 1)
+        threads.append(threading.Thread(target=self.request, args=('BLOCK', 1, results)))
+        threads[1].start()
+        self.wait_for(lambda: self.server.get_metrics()['queue_depth'] == 1)
+
+        # worker busy and queue full, next request is refused
+        self.request('ECHO', 2, results)
+        self.assertEqual(results, [{'status': 'FAIL', 'message': BUSY_MESSAGE}])
+        self.assertEqual(self.server.get_metrics()['rejected'], 1)
+
+        self.release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(results), 3)
+        self.wait_for(lambda: self.server.get_metrics()['completed'] == 2)
+
+    def test_slow_rejected_client(self):
+        results = []
+        threads = [threading.Thread(target=self.request, args=('BLOCK', i, results)) for i in range(2)]
+        threads[0].start()
+        self.wait_for(lambda: self.server.get_metrics()['active_workers'] == 1)
+        threads[1].start()
+        self.wait_for(lambda: self.server.get_metrics()['queue_depth'] == 1)
+
+        # only the header of the request arrives, refusing it waits for the rest
+        slow = socket.create_connection(('localhost', self.port))
+        slow.sendall(HEADER.pack(100))
+        self.wait_for(lambda: self.server.get_metrics()['rejected'] == 1)
+        # the selector keeps accepting connections meanwhile
+        other = socket.create_connection(('localhost', self.port))
+        self.wait_for(lambda: self.server.get_metrics()['connections'] == 4)
+
+        slow.close()
+        other.close()
+        self.release.set()
+        for t in threads:
+            t.join()
+
+    def test_failing_handler(self):
+        results = []
+        connection = Connection('localhost', self.port, response_timeout=5)
+        connection.send_message({'query': 'BROKEN', 'data': {}}, True, lambda r: results.append(r['data']))
+        connection.send_message({'query': 'ECHO', 'data': 1}, True, lambda r: results.append(r['data']))
+        self.assertEqual(results[0]['status'], 'FAIL')
+        self.assertEqual(results[1], {'status': 'SUCCESS', 'data': 1})
+        self.assertEqual(self.server.get_metrics()['connections'], 1)
+
+    def test_stalled_request(self):
+        with mock.patch('common.api_server.REQUEST_TIMEOUT', 0.2):
+            # only the header of the request arrives, the worker gives up on it
+            slow = socket.create_connection(('localhost', self.port))
+            slow.sendall(HEADER.pack(100))
+            self.wait_for(lambda: self.server.get_metrics()['completed'] == 1)
+        self.wait_for(lambda: self.server.get_metrics()['connections'] == 0)
+        self.assertEqual(slow.recv(1), b'')
+        slow.close()
+
+        results = []
+        self.request('ECHO', 2, results)
+        self.assertEqual(results, [{'status': 'SUCCESS', 'data': 2}])
+
+
+class TestWorkerPool(unittest.TestCase):
+    def test_submit(self):
+        done = threading.Event()
+        pool = WorkerPool('test', 2, 4)
+        self.assertTrue(pool.submit(done.set))
+        self.assertTrue(done.wait(5))
+
+    def test_queue_full(self):
+        release = threading.Event()
+        pool = WorkerPool('test', 1, 1)
+        pool.submit(release.wait)
+        while pool.metrics()['active_workers'] == 0:
+            time.sleep(0.01)
+        self.assertTrue(pool.submit(release.wait))
+        self.assertFalse(pool.submit(release.wait))
+        self.assertEqual(pool.metrics()['rejected'], 1)
+        self.assertEqual(pool.queue_depth, 1)
+        release.set()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import asyncio
+import unittest
+
+from common.api_server import ApiServer, ASYNCIO_MODE
+from common.async_messaging import AsyncMessageSender
+from common.messaging import Connection
+from common.request_handler import RequestHandler
+
+
+class MixedRequestHandler(RequestHandler):
+    def __init__(self, client_socket):
+        super().__init__(client_socket)
+        self.query_handlers = {
+            'ECHO': lambda data: {'status': 'SUCCESS', 'data': data},
+            'ASYNC_ECHO': self.async_echo,
+            'NOTIFY': lambda data: None,
+            'COUNT': lambda data: ({'status': 'SUCCESS', 'data': i} for i in range(data)),
+            'BROKEN': lambda data: {'status': 'SUCCESS', 'data': data['missing']},
+            'ASYNC_BROKEN': self.async_broken
+        }
+
+    async def async_echo(self, data):
+        await asyncio.sleep(0.01)
+        return {'status': 'SUCCESS', 'data': data}
+
+    async def async_broken(self, data):
+        raise RuntimeError('broken')
+
+
+class MixedApiServer (ApiServer):
+    def __init__(self):
+        super().__init__('localhost', 0, mode=ASYNCIO_MODE, max_workers=2)
+        self.daemon = True
+
+    def get_handler(self, client_socket):
+        return MixedRequestHandler(client_socket)
+
+
+class TestAsyncApiServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MixedApiServer()
+        cls.server.start()
+        cls.port = cls.server.socket.getsockname()[1]
+
+    def test_sync_client(self):
+        results = []
+        connection = Connection('localhost', self.port, response_timeout=5)
+        connection.send_message({'query': 'ECHO', 'data': 1}, True, lambda r: results.append(r))
+        connection.send_message({'query': 'ASYNC_ECHO', 'data': 2}, True, lambda r: results.append(r))
+        connection.send_message({'query': 'UNKNOWN', 'data': 3}, True, lambda r: results.append(r))
+        connection.close()
+        self.assertEqual([r['data'] for r in results], [
+            {'status': 'SUCCESS', 'data': 1},
+            {'status': 'SUCCESS', 'data': 2},
+            {'status': 'FAIL', 'message': 'API query not defined'}
+        ])
+
+    def test_failing_handlers(self):
+        results = []
+        connection = Connection('localhost', self.port, response_timeout=5)
+        for query in ('BROKEN', 'ASYNC_BROKEN', 'ECHO'):
+            connection.send_message({'query': query, 'data': {}}, True, lambda r: results.append(r))
+        connection.close()
+        self.assertEqual([r['status'] for r in results], ['SUCCESS'] * 3)
+        self.assertEqual([r['data']['status'] for r in results], ['FAIL', 'FAIL', 'SUCCESS'])
+        self.assertEqual(results[1]['data']['message'], 'Could not handle request: broken')
+
+    def test_stream(self):
+        connection = Connection('localhost', self.port, response_timeout=5)
+        responses = list(connection.stream_message({'query': 'COUNT', 'data': 100}))
+        connection.close()
+        self.assertEqual([r['data']['data'] for r in responses], list(range(100)))
+
+    def test_async_client(self):
+        async def run():
+            sender = AsyncMessageSender('localhost', self.port, response_timeout=5)
+            await sender.send_message({'query': 'NOTIFY', 'data': {}}, False)
+            responses = await asyncio.gather(*[
+                sender.send_message({'query': 'ASYNC_ECHO' if i % 2 else 'ECHO', 'data': i}, True)
+                for i in range(20)
+            ])
+            await sender.close()
+            return responses
+
+        responses = asyncio.run(run())
+        self.assertEqual([r['data']['data'] for r in responses], list(range(20)))
+
+    def test_async_client_connect_fail(self):
+        async def run():
+            sender = AsyncMessageSender('localhost', 1, response_timeout=5)
+            return await sender.send_message({'query': 'ECHO', 'data': 1}, True)
+
+        self.assertEqual(asyncio.run(run())['status'], 'FAIL')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+
+from common.codec import JSON_CODEC, BINARY_CODEC, ZLIB_CODEC, JSON, BINARY, MAX_LAYOUTS, BinaryCodec, decode, \
+    detect_codec, negotiate, get_codec, compress
+
+
+class TestCodec(unittest.TestCase):
+    def test_json_roundtrip(self):
+        msg = {'query': 'INIT', 'data': {'resources': 1000}, 'id': 3}
+        self.assertEqual(JSON_CODEC.decode(JSON_CODEC.encode(msg)), msg)
+
+    def test_binary_feed_roundtrip(self):
+        msg = {'query': 'MARKET_DATA_FEED', 'data': {'value': 100.5, 'volume': 12.0}, 'id': 42}
+        data = BINARY_CODEC.encode(msg)
+        self.assertIs(detect_codec(data), BINARY_CODEC)
+        self.assertEqual(BINARY_CODEC.decode(data), msg)
+        self.assertEqual(decode(bytearray(data)), msg)
+        self.assertLess(len(data), len(JSON_CODEC.encode(msg)))
+
+    def test_binary_feed_no_id(self):
+        msg = {'query': 'MARKET_DATA_FEED', 'data': {'value': 1.0}}
+        self.assertEqual(decode(BINARY_CODEC.encode(msg)), msg)
+
+    def test_binary_layout_cache(self):
+        codec = BinaryCodec()
+        for value in range(3):
+            msg = {'query': 'MARKET_DATA_FEED', 'data': {'value': float(value)}}
+            self.assertEqual(codec.decode(codec.encode(msg)), msg)
+        self.assertEqual(codec.encode_layout.cache_info().hits, 2)
+        self.assertEqual(codec.decode_layout.cache_info().hits, 2)
+        # a new field set per message does not grow the caches without bound
+        for i in range(MAX_LAYOUTS + 10):
+            codec.encode({'query': 'MARKET_DATA_FEED', 'data': {'field_%d' % i: 1.0}})
+        self.assertEqual(codec.encode_layout.cache_info().currsize, MAX_LAYOUTS)
+
+    def test_binary_ints(self):
+        msg = {'query': 'MARKET_DATA_FEED', 'data': {'price': 10.5, 'volume': 3, 'seq': 2 ** 53 + 1}}
+        data = BINARY_CODEC.encode(msg)
+        self.assertIs(detect_codec(data), BINARY_CODEC)
+        decoded = decode(data)
+        self.assertEqual(decoded, msg)
+        self.assertEqual([type(value) for value in decoded['data'].values()], [float, int, int])
+        # out of the 64 bit range
+        msg = {'query': 'MARKET_DATA_FEED', 'data': {'seq': 2 ** 64}}
+        data = BINARY_CODEC.encode(msg)
+        self.assertIs(detect_codec(data), JSON_CODEC)
+        self.assertEqual(decode(data), msg)
+
+    def test_binary_fallback(self):
+        for msg in [{'query': 'INIT', 'data': {'resources': 1000}},
+                    {'query': 'MARKET_DATA_FEED', 'data': None},
+                    {'query': 'MARKET_DATA_FEED', 'data': {'value': 'not a number'}},
+                    {'query': 'MARKET_DATA_FEED', 'data': {'flag': True}}]:
+            data = BINARY_CODEC.encode(msg)
+            self.assertIs(detect_codec(data), JSON_CODEC)
+            self.assertEqual(decode(data), msg)
+
+    def test_binary_malformed(self):
+        data = BINARY_CODEC.encode({'query': 'MARKET_DATA_FEED', 'data': {'value': 1.0}})
+        self.assertRaises(ValueError, decode, data[:-4])
+
+    def test_batch(self):
+        msgs = [{'query': 'MARKET_DATA_FEED', 'data': {'value': 1.0}},
+                {'query': 'MARKET_DATA_FEED', 'data': {'price': 2.0, 'volume': 3.0}},
+                {'query': 'MARKET_DATA_FEED', 'data': {'value': 'not a number'}}]
+        for codec in [JSON_CODEC, BINARY_CODEC]:
+            data = codec.encode_batch('MARKET_DATA_FEED_BATCH', [codec.encode(msg) for msg in msgs])
+            self.assertIs(detect_codec(data), codec)
+            self.assertEqual(decode(data), {'query': 'MARKET_DATA_FEED_BATCH', 'data': msgs})
+
+    def test_binary_batch_malformed(self):
+        msg = BINARY_CODEC.encode({'query': 'MARKET_DATA_FEED', 'data': {'value': 1.0}})
+        data = BINARY_CODEC.encode_batch('MARKET_DATA_FEED_BATCH', [msg, msg])
+        self.assertRaises(ValueError, decode, data[:-4])
+
+    def test_compress(self):
+        msg = {'query': 'MARKET_DATA_FEED', 'data': {'bids': [[100.0, 1.0]] * 100}}
+        for codec in [JSON_CODEC, BINARY_CODEC]:
+            data = compress(codec.encode(msg))
+            self.assertIs(detect_codec(data), ZLIB_CODEC)
+            self.assertLess(len(data), len(codec.encode(msg)))
+            self.assertEqual(decode(data), msg)
+        self.assertEqual(decode(ZLIB_CODEC.encode(msg)), msg)
+
+    def test_compress_malformed(self):
+        data = compress(JSON_CODEC.encode({'query': 'PING', 'data': {}}))
+        self.assertRaises(ValueError, decode, data[:-4])
+        self.assertRaises(ValueError, decode, data[:2] + b'garbage')
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate([BINARY, JSON]), BINARY)
+        self.assertEqual(negotiate(['msgpack', JSON]), JSON)
+        self.assertEqual(negotiate([]), JSON)
+        self.assertIs(get_codec('unknown'), JSON_CODEC)
+
+
+if __name__ == '__main__':
+    unittest.main()
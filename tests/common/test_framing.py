@@ -0,0 +1,61 @@
+import socket
+import threading
+import unittest
+
+from common.framing import send_frame, recv_frame, recv_exactly, HEADER, MAX_FRAME_SIZE
+
+
+class TestFraming(unittest.TestCase):
+    def setUp(self):
+        self.a, self.b = socket.socketpair()
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+
+    def test_roundtrip(self):
+        send_frame(self.a, b'test payload')
+        self.assertEqual(recv_frame(self.b), b'test payload')
+
+    def test_empty_frame(self):
+        send_frame(self.a, b'')
+        self.assertEqual(recv_frame(self.b), b'')
+
+    def test_large_frame(self):
+        payload = bytes(range(256)) * 4096
+        sender = threading.Thread(target=send_frame, args=(self.a, payload))
+        sender.start()
+        self.assertEqual(recv_frame(self.b), payload)
+        sender.join()
+
+    def test_consecutive_frames(self):
+        send_frame(self.a, b'first')
+        send_frame(self.a, b'second')
+        self.assertEqual(recv_frame(self.b), b'first')
+        self.assertEqual(recv_frame(self.b), b'second')
+
+    def test_split_frame(self):
+        frame = HEADER.pack(6) + b'abcdef'
+        self.a.sendall(frame[:3])
+        reader = threading.Thread(target=lambda: setattr(self, 'result', recv_frame(self.b)))
+        reader.start()
+        self.a.sendall(frame[3:])
+        reader.join()
+        self.assertEqual(self.result, b'abcdef')
+
+    def test_closed_mid_frame(self):
+        self.a.sendall(HEADER.pack(10) + b'abc')
+        self.a.close()
+        self.assertRaises(ConnectionError, recv_frame, self.b)
+
+    def test_recv_exactly_closed(self):
+        self.a.close()
+        self.assertRaises(ConnectionError, recv_exactly, self.b, 1)
+
+    def test_oversized_incoming_frame(self):
+        self.a.sendall(HEADER.pack(MAX_FRAME_SIZE + 1))
+        self.assertRaises(ConnectionError, recv_frame, self.b)
+
+
+if __name__ == '__main__':
+    unittest.main()
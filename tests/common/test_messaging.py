@@ -1,8 +1,11 @@
 import mock
 import json
+import time
 import socket
+import threading
 import unittest
-from common.messaging import log_result, MessageSender
+from common.messaging import log_result, MessageSender, Connection, ConnectionPool
+from common.request_handler import RequestHandler
 
 
 class TestLogResult(unittest.TestCase):
@@ -62,39 +65,42 @@ class TestMessageSender(unittest.TestCase):
 
     @mock.patch("json.dumps")
     def test__send_payload_timeout(self, mock_dumps):
-        self.messageSender.socket.send.side_effect = socket.timeout
+        self.messageSender.socket.sendall.side_effect = socket.timeout
         self.assertEqual(self.messageSender._send_payload("test"),
                          {'status': 'FAIL',
                           'message': 'Connection timed out with address:0 during request'})
 
     @mock.patch("json.dumps")
     def test__send_payload_connection_reset(self, mock_dumps):
-        self.messageSender.socket.send.side_effect = ConnectionResetError
+        self.messageSender.socket.sendall.side_effect = ConnectionResetError
         self.assertEqual(self.messageSender._send_payload("test"),
                          {'status': 'FAIL',
                           'message': 'Connection reset by address:0'})
 
     @mock.patch("json.dumps")
     def test__send_payload_broken_pipe(self, mock_dumps):
-        self.messageSender.socket.send.side_effect = BrokenPipeError
+        self.messageSender.socket.sendall.side_effect = BrokenPipeError
         self.assertEqual(self.messageSender._send_payload("test"),
                          {'status': 'FAIL',
                           'message': 'Connection failed with address:0 during communication'})
 
+    @mock.patch("common.messaging.recv_frame")
     @mock.patch("json.loads")
-    def test__get_response(self, mock_loads):
+    def test__get_response(self, mock_loads, mock_recv_frame):
         mock_loads.return_value = "test_data"
         self.assertEqual(self.messageSender._get_response(), {'status': 'SUCCESS', "data": "test_data"})
 
+    @mock.patch("common.messaging.recv_frame")
     @mock.patch("json.loads")
-    def test__get_response_socket_error(self, mock_loads):
-        self.messageSender.socket.recv.side_effect = socket.error("test error")
+    def test__get_response_socket_error(self, mock_loads, mock_recv_frame):
+        mock_recv_frame.side_effect = socket.error("test error")
         self.assertEqual(self.messageSender._get_response(),
                          {'status': 'FAIL',
                           'message': 'Could not get response from address:0: test error'})
 
+    @mock.patch("common.messaging.recv_frame")
     @mock.patch("json.loads")
-    def test__get_response_decoder_error(self, mock_loads):
+    def test__get_response_decoder_error(self, mock_loads, mock_recv_frame):
         m = mock.Mock()
         m.count.return_value = 0
         m.rfind.return_value = 0
@@ -224,5 +230,241 @@ class TestMessageSender(unittest.TestCase):
         self.messageSender.socket.close.assert_called_once()
         self.assertFalse(self.messageSender.connected)
 
+class EchoRequestHandler(RequestHandler):
+    def __init__(self, client_socket):
+        super().__init__(client_socket)
+        self.query_handlers = {
+            'ECHO': lambda data: {'status': 'SUCCESS', 'data': data},
+            'NOTIFY': lambda data: None,
+            'COUNT': self.count
+        }
+
+    @staticmethod
+    def count(data):
+        for i in range(data['n']):
+            yield {'status': 'SUCCESS', 'data': i}
+        if data.get('fail'):
+            raise ValueError('broken')
+
+
+class TestConnection(unittest.TestCase):
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(('localhost', 0))
+        self.server.listen(5)
+        self.accepted = 0
+        threading.Thread(target=self._serve, daemon=True).start()
+        self.connection = Connection('localhost', self.server.getsockname()[1], response_timeout=5)
+
+    def tearDown(self):
+        self.connection.close()
+        self.server.close()
+
+    def _serve(self):
+        while True:
+            try:
+                client_socket, _ = self.server.accept()
+            except OSError:
+                return
+            self.accepted += 1
+            EchoRequestHandler(client_socket).start()
+
+    def test_request_response(self):
+        callback = mock.Mock()
+        self.connection.send_message({'query': 'ECHO', 'data': {'value': 1}}, True, callback)
+        callback.assert_called_once_with({'status': 'SUCCESS', 'data': {'status': 'SUCCESS', 'data': {'value': 1}}})
+
+    def test_reuses_socket(self):
+        for i in range(10):
+            self.connection.send_message({'query': 'NOTIFY', 'data': {}}, False, mock.Mock())
+            self.connection.send_message({'query': 'ECHO', 'data': i}, True, mock.Mock())
+        self.assertEqual(self.accepted, 1)
+
+    def test_concurrent_requests(self):
+        results = {}
+
+        def request(i):
+            self.connection.send_message({'query': 'ECHO', 'data': i}, True,
+                                         lambda r: results.__setitem__(i, r['data']['data']))
+        threads = [threading.Thread(target=request, args=(i,)) for i in range(50)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, {i: i for i in range(50)})
+        self.assertEqual(self.accepted, 1)
+        self.assertEqual(self.connection.pending, {})
+
+    def test_reconnect(self):
+        callback = mock.Mock()
+        self.connection.send_message({'query': 'ECHO', 'data': 1}, True, callback)
+        self.connection.close()
+        self.assertFalse(self.connection.connected)
+        self.connection.send_message({'query': 'ECHO', 'data': 2}, True, callback)
+        self.assertEqual(callback.call_args[0][0]['data']['data'], 2)
+        self.assertEqual(self.accepted, 2)
+
+    def test_stream(self):
+        responses = list(self.connection.stream_message({'query': 'COUNT', 'data': {'n': 50}}))
+        self.assertEqual([r['data']['data'] for r in responses], list(range(50)))
+        self.assertEqual(self.connection.pending, {})
+
+    def test_stream_single_response(self):
+        responses = list(self.connection.stream_message({'query': 'ECHO', 'data': 1}))
+        self.assertEqual(responses, [{'status': 'SUCCESS', 'data': {'status': 'SUCCESS', 'data': 1}}])
+
+    def test_stream_handler_error(self):
+        responses = list(self.connection.stream_message({'query': 'COUNT', 'data': {'n': 2, 'fail': True}}))
+        self.assertEqual([r['data']['status'] for r in responses], ['SUCCESS', 'SUCCESS', 'FAIL'])
+
+    def test_stream_closed_early(self):
+        # the rest of the stream is discarded, and the connection keeps working
+        stream = self.connection.stream_message({'query': 'COUNT', 'data': {'n': 1000}})
+        next(stream)
+        stream.close()
+        self.assertEqual(self.connection.pending, {})
+        callback = mock.Mock()
+        self.connection.send_message({'query': 'ECHO', 'data': 1}, True, callback)
+        self.assertEqual(callback.call_args[0][0]['data']['data'], 1)
+
+    def test_connect_fail(self):
+        # bound but never listening, so connections are refused
+        closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        closed.bind(('localhost', 0))
+        connection = Connection('localhost', closed.getsockname()[1])
+        callback = mock.Mock()
+        connection.send_message({'query': 'ECHO', 'data': 1}, True, callback)
+        closed.close()
+        self.assertEqual(callback.call_args[0][0]['status'], 'FAIL')
+
+    def test_send_only(self):
+        connection = Connection('localhost', self.server.getsockname()[1], read_responses=False, send_timeout=1)
+        try:
+            callback = mock.Mock()
+            connection.send_message({'query': 'NOTIFY', 'data': {}}, False, callback)
+            callback.assert_called_once_with({'status': 'SUCCESS'})
+            # the timeout applies to the socket, which has no reader thread
+            self.assertEqual(connection.socket.gettimeout(), 1)
+        finally:
+            connection.close()
+        self.assertRaises(ValueError, Connection, 'localhost', 1, send_timeout=1)
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(max_size=2, idle_timeout=60, health_check_interval=60)
+
+    def tearDown(self):
+        self.pool.close_all()
+
+    def get(self, address, port):
+        connection = self.pool.get(address, port)
+        self.pool.release(connection)
+        return connection
+
+    def test_hit_miss(self):
+        first = self.get('localhost', 1)
+        self.assertIs(self.get('localhost', 1), first)
+        self.get('localhost', 2)
+        stats = self.pool.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 2, 2))
+
+    def test_max_size_evicts_lru(self):
+        self.get('localhost', 1)
+        self.get('localhost', 2)
+        self.get('localhost', 1)
+        self.get('localhost', 3)
+        self.assertEqual(list(self.pool.connections), [('localhost', 1), ('localhost', 3)])
+        self.assertEqual(self.pool.stats()['evictions'], 1)
+
+    def test_busy_connections_not_evicted(self):
+        self.pool.get('localhost', 1)
+        self.pool.get('localhost', 2)
+        self.get('localhost', 3)
+        self.assertEqual(len(self.pool.connections), 3)
+        self.assertEqual(self.pool.stats()['evictions'], 0)
+
+    def test_connection_in_use_until_released(self):
+        self.pool.idle_timeout = 0
+        connection = self.pool.get('localhost', 1)
+        self.assertTrue(connection.busy)
+        self.pool.health_check()
+        self.assertEqual(len(self.pool.connections), 1)
+        self.pool.release(connection)
+        self.assertFalse(connection.busy)
+        self.pool.health_check()
+        self.assertEqual(len(self.pool.connections), 0)
+
+    def test_health_check_idle_timeout(self):
+        self.pool.idle_timeout = 0
+        self.get('localhost', 1)
+        self.pool.health_check()
+        self.assertEqual(len(self.pool.connections), 0)
+        self.assertEqual(self.pool.stats()['evictions'], 1)
+
+    def test_health_check_dead_connection(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('localhost', 0))
+        server.listen(1)
+        connection = self.get('localhost', server.getsockname()[1])
+        connection._connect_socket()
+        client_socket, _ = server.accept()
+        self.pool.health_check()
+        self.assertEqual(len(self.pool.connections), 1)
+        client_socket.close()
+        server.close()
+        # give the close time to arrive
+        for _ in range(100):
+            if not connection.is_healthy():
+                break
+            time.sleep(0.01)
+        self.pool.health_check()
+        self.assertEqual(len(self.pool.connections), 0)
+
+    def test_stream_dedicated_connection(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(('localhost', 0))
+        server.listen(5)
+        port = server.getsockname()[1]
+
+        def serve():
+            while True:
+                try:
+                    client_socket, _ = server.accept()
+                except OSError:
+                    return
+                EchoRequestHandler(client_socket).start()
+        threading.Thread(target=serve, daemon=True).start()
+        try:
+            # the consumer stops reading, the stream reader thread waits for it
+            stream = self.pool.stream_message('localhost', port, {'query': 'COUNT', 'data': {'n': 1000}})
+            self.assertEqual(next(stream)['data']['data'], 0)
+            time.sleep(0.1)
+            # other requests to the same destination are not held up
+            callback = mock.Mock()
+            self.pool.send_message('localhost', port, {'query': 'ECHO', 'data': 1}, True, callback)
+            self.assertEqual(callback.call_args[0][0]['data']['data'], 1)
+            self.assertEqual(len(self.pool.connections), 1)
+            stream.close()
+        finally:
+            server.close()
+
+    @mock.patch('socket.create_connection')
+    def test_reconnect_backoff(self, mock_create_connection):
+        mock_create_connection.side_effect = ConnectionRefusedError
+        callback = mock.Mock()
+        self.pool.send_message('localhost', 1, {'query': 'TEST', 'data': {}}, True, callback)
+        self.pool.send_message('localhost', 1, {'query': 'TEST', 'data': {}}, True, callback)
+        self.assertEqual(mock_create_connection.call_count, 1)
+        self.assertEqual(callback.call_args[0][0]['status'], 'FAIL')
+
+        connection = self.get('localhost', 1)
+        connection.retry_at = 0
+        self.pool.send_message('localhost', 1, {'query': 'TEST', 'data': {}}, True, callback)
+        self.assertEqual(mock_create_connection.call_count, 2)
+        self.assertEqual(connection.failed_attempts, 2)
+        self.assertAlmostEqual(connection.retry_at - time.monotonic(), 2 * connection.backoff_base, 1)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,157 @@
+import time
+import random
+import unittest
+import threading
+import mock
+
+import matplotlib
+matplotlib.use('Agg')
+
+from common.plot_manager import DEFERRED_RENDER, LineBuffer, PlotManager
+
+
+class TestLineBuffer(unittest.TestCase):
+    def test_window(self):
+        buffer = LineBuffer(50)
+        points = []
+        rng = random.Random(3)
+        for x in range(500):
+            y = rng.uniform(-10, 10)
+            buffer.append(x, y)
+            points.append(y)
+            window = points[-50:]
+            self.assertEqual(buffer.y.tolist(), window)
+            self.assertEqual(buffer.x.tolist(), list(range(max(0, x - 49), x + 1)))
+            self.assertEqual((buffer.min(), buffer.max()), (min(window), max(window)))
+        self.assertEqual(buffer.latest, 499)
+
+    def test_update(self):
+        buffer = LineBuffer(4)
+        buffer.extend([1, 2, 4, 5, 6], [10, 20, 40, 50, 60])
+        self.assertTrue(buffer.update(4, -1))
+        self.assertEqual(buffer.y.tolist(), [20, -1, 50, 60])
+        self.assertEqual(buffer.min(), -1)
+        # inserted, the oldest point is dropped
+        self.assertTrue(buffer.update(3, 100))
+        self.assertEqual(buffer.x.tolist(), [3, 4, 5, 6])
+        self.assertEqual(buffer.max(), 100)
+        self.assertTrue(buffer.update(7, 0))
+        self.assertEqual(buffer.x.tolist(), [4, 5, 6, 7])
+        self.assertFalse(buffer.update(1, 0))
+        buffer.append(8, 5)
+        self.assertEqual((buffer.min(), buffer.max()), (0, 60))
+
+    def test_update_latest(self):
+        buffer = LineBuffer(20)
+        points = []
+        rng = random.Random(5)
+        for x in range(300):
+            buffer.append(x, rng.uniform(-10, 10))
+            points.append(buffer.y[-1])
+            # the latest point moves up and down, as a bar being built
+            for _ in range(3):
+                y = rng.uniform(-20, 20)
+                with mock.patch.object(buffer, '_reset') as reset:
+                    self.assertTrue(buffer.update(x, y))
+                    reset.assert_not_called()
+                points[-1] = y
+                window = points[-20:]
+                self.assertEqual(buffer.y.tolist(), window)
+                self.assertEqual((buffer.min(), buffer.max()), (min(window), max(window)))
+
+
+@mock.patch.object(PlotManager, 'refresh')
+class TestPlotManager(unittest.TestCase):
+    def test_lines(self, _):
+        manager = PlotManager(max_elements=10)
+        manager.add_subplot('plot', 111)
+        manager.add_line('plot', 'line', [0], [5])
+        for x in range(1, 100):
+            manager.append_datapoint('plot', x, {'line': x % 7})
+        line = manager.plot_lines['line']
+        self.assertEqual(list(line.get_xdata()), list(range(90, 100)))
+        self.assertEqual(manager.subplots['plot'].get_ylim(), (0, 6))
+
+        manager.update_line('line', 95, 20)
+        self.assertEqual(line.get_ydata()[5], 20)
+        self.assertEqual(manager.subplots['plot'].get_ylim(), (0, 20))
+
+
+class TestDeferredRendering(unittest.TestCase):
+    def setUp(self):
+        self.manager = PlotManager(max_elements=100, render_mode=DEFERRED_RENDER, max_fps=50)
+        self.manager.add_subplot('plot', 111)
+        self.manager.add_line('plot', 'line', [0], [0])
+
+    def tearDown(self):
+        self.manager.stop_renderer()
+
+    def test_blitting(self):
+        manager = self.manager
+        manager.stop_renderer()
+        manager.frames = manager.full_redraws = 0
+        manager.mark_full_redraw()
+        manager.render()
+        self.assertEqual(manager.render_metrics(), {'frames': 1, 'full_redraws': 1})
+
+        # the data fits in the limits, only the line is redrawn
+        for x in range(1, 10):
+            manager.append_datapoint('plot', x, {'line': 0.5})
+        with mock.patch.object(manager.fig.canvas, 'draw') as draw:
+            manager.render()
+            draw.assert_not_called()
+        self.assertEqual(manager.render_metrics()['full_redraws'], 1)
+        self.assertEqual(list(manager.plot_lines['line'].get_xdata()), list(range(10)))
+
+        # the plot scrolls
+        manager.append_datapoint('plot', 1000, {'line': 0})
+        manager.render()
+        self.assertEqual(manager.render_metrics(), {'frames': 3, 'full_redraws': 2})
+        self.assertGreaterEqual(manager.subplots['plot'].get_xlim()[1], 1000)
+
+    def test_run_gui(self):
+        manager = self.manager
+        threads = set()
+        render = manager.render
+
+        def tracked_render():
+            threads.add(threading.current_thread())
+            render()
+        manager.render = tracked_render
+
+        def feed():
+            for x in range(1, 2001):
+                manager.append_datapoint('plot', x, {'line': x % 13})
+        feeder = threading.Thread(target=feed)
+
+        def event_loop(timeout):
+            # the Agg canvas has no GUI event loop, the timer fires once per frame
+            time.sleep(timeout)
+            manager.renderer._on_timer()
+
+        feeder.start()
+        with mock.patch.object(manager.fig.canvas, 'start_event_loop', side_effect=event_loop):
+            manager.run_gui(lambda: not feeder.is_alive() and not manager.dirty.is_set())
+        feeder.join()
+
+        self.assertEqual(list(manager.plot_lines['line'].get_xdata()), list(range(1901, 2001)))
+        # drawn by the GUI thread only, and frames are capped, not one per point
+        self.assertEqual(threads, {threading.current_thread()})
+        self.assertLess(manager.render_metrics()['frames'], 100)
+
+    def test_canvas_timer(self):
+        manager = self.manager
+        timer = manager.renderer
+        self.assertEqual(timer.interval, 20)
+        with mock.patch.object(manager, 'render') as render:
+            manager.render_if_dirty()
+            render.assert_called_once_with()
+            manager.dirty.clear()
+            manager.render_if_dirty()
+            render.assert_called_once_with()
+        with mock.patch.object(timer, 'stop') as stop:
+            manager.stop_renderer()
+            stop.assert_called_once_with()
+
+if __name__ == '__main__':
+    unittest.main()
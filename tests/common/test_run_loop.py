@@ -0,0 +1,79 @@
+import time
+import threading
+import unittest
+
+from common.run_loop import RunLoop
+
+
+class TestRunLoop(unittest.TestCase):
+    def setUp(self):
+        self.loop = RunLoop()
+        self.calls = []
+
+    def tearDown(self):
+        self.loop.stop(wait=True)
+
+    def test_call_soon(self):
+        for i in range(5):
+            self.loop.call_soon(self.calls.append, i)
+        self.loop.call_soon(self.loop.stop)
+        self.loop.call_soon(self.calls.append, 5)
+        self.loop.add_shutdown_callback(self.calls.append, 'shutdown')
+        # callbacks already posted run before stopping
+        self.loop.run()
+        self.assertEqual(self.calls, [0, 1, 2, 3, 4, 5, 'shutdown'])
+        self.assertFalse(self.loop.running)
+
+    def test_wake_up(self):
+        done = threading.Event()
+        thread = self.loop.start()
+        time.sleep(0.05)
+        start = time.monotonic()
+        self.loop.call_soon(done.set)
+        self.assertTrue(done.wait(1))
+        # the idle loop reacts at once, it does not poll
+        self.assertLess(time.monotonic() - start, 0.05)
+        self.loop.stop(wait=True)
+        self.assertFalse(thread.is_alive())
+
+    def test_timers(self):
+        start = time.monotonic()
+        self.loop.call_later(0.05, lambda: self.calls.append(('later', time.monotonic() - start)))
+        cancelled = self.loop.call_later(0.01, self.calls.append, 'cancelled')
+        cancelled.cancel()
+        ticks = []
+        timer = self.loop.call_every(0.01, lambda: ticks.append(time.monotonic()))
+        self.loop.call_later(0.1, timer.cancel)
+        self.loop.call_later(0.15, self.loop.stop)
+        self.loop.run()
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.calls[0][0], 'later')
+        self.assertGreaterEqual(self.calls[0][1], 0.05)
+        self.assertTrue(5 <= len(ticks) <= 10)
+        self.assertLess(ticks[-1] - start, 0.12)
+
+    def test_slow_timer(self):
+        # the callback takes longer than the interval, the timer is always due
+        timer = self.loop.call_every(0.05, time.sleep, 0.06)
+        thread = self.loop.start()
+        time.sleep(0.1)
+        done = threading.Event()
+        self.loop.call_soon(done.set)
+        self.assertTrue(done.wait(1))
+        # timers don't hold up stopping either
+        self.loop.stop()
+        thread.join(1)
+        timer.cancel()
+        self.assertFalse(thread.is_alive())
+
+    def test_errors_logged(self):
+        self.loop.call_soon(lambda: 1 / 0)
+        self.loop.call_soon(self.calls.append, 'after')
+        self.loop.stop()
+        self.loop.run()
+        self.assertEqual(self.calls, ['after'])
+
+
+if __name__ == '__main__':
+    unittest.main()
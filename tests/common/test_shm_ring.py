@@ -0,0 +1,63 @@
+import os
+import unittest
+
+from common.shm_ring import ShmRing
+
+
+class TestShmRing(unittest.TestCase):
+    def setUp(self):
+        self.name = 'hydra_test_ring_%d' % os.getpid()
+        self.writer = ShmRing(self.name, create=True, slots=4, slot_size=16)
+        self.reader = ShmRing(self.name)
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+
+    def test_write_read(self):
+        self.assertEqual(self.reader.read_available(), [])
+        for i in range(3):
+            self.assertTrue(self.writer.write(b'msg%d' % i))
+        self.assertEqual(self.reader.read_available(), [b'msg0', b'msg1', b'msg2'])
+        self.assertEqual(self.reader.read_available(), [])
+        self.writer.write(bytearray(b'again'))
+        self.assertEqual(self.reader.read_available(), [b'again'])
+
+    def test_max_messages(self):
+        for i in range(3):
+            self.writer.write(b'msg%d' % i)
+        self.assertEqual(self.reader.read_available(2), [b'msg0', b'msg1'])
+        self.assertEqual(self.reader.read_available(2), [b'msg2'])
+
+    def test_overrun(self):
+        for i in range(10):
+            self.writer.write(b'msg%d' % i)
+        self.assertEqual(self.reader.read_available(), [b'msg6', b'msg7', b'msg8', b'msg9'])
+        self.assertEqual(self.reader.overruns, 6)
+
+    def test_torn_slot(self):
+        self.writer.write(b'msg0')
+        # slot rewritten by the writer while the reader was behind
+        self.writer.index = 4
+        self.writer.write(b'msg4')
+        self.writer.index = 1
+        self.writer.write(b'msg1')
+        self.assertEqual(self.reader.read_available(), [b'msg1'])
+        self.assertEqual(self.reader.overruns, 1)
+
+    def test_oversized(self):
+        self.assertFalse(self.writer.write(b'x' * 17))
+        self.assertTrue(self.writer.write(b'x' * 16))
+        self.assertEqual(self.reader.read_available(), [b'x' * 16])
+
+    def test_late_reader(self):
+        self.writer.write(b'old')
+        late = ShmRing(self.name)
+        self.writer.write(b'new')
+        self.assertEqual(late.read_available(), [b'new'])
+        self.assertEqual(late.slots, 4)
+        late.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+from market_interface.backfill import Backfiller, Fetcher, RateLimiter, find_gaps, split, subtract
+from market_interface.tick_storage import TickStorage
+
+# midnight of 2021-01-01, UTC
+T0 = 1609459200.0
+
+
+class FakeFetcher (Fetcher):
+    """Serves a tick every second, value equal to the seconds since T0"""
+    def __init__(self, delay=0.0, fail=()):
+        self.delay = delay
+        self.fail = fail
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def fetch(self, symbol, start, end):
+        with self.lock:
+            self.requests.append((start, end))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        if start in self.fail:
+            return None
+        timestamps = np.arange(np.ceil(start), np.floor(end) + 1)
+        return {'timestamp': timestamps, 'value': timestamps - T0}
+
+
+class TestGaps(unittest.TestCase):
+    def test_find_gaps(self):
+        timestamps = np.array([T0 + 10, T0 + 11, T0 + 50, T0 + 51])
+        self.assertEqual(find_gaps(timestamps, T0, T0 + 100, 20), [(T0 + 11, T0 + 50), (T0 + 51, T0 + 100)])
+        self.assertEqual(find_gaps(np.empty(0), T0, T0 + 100, 20), [(T0, T0 + 100)])
+        self.assertEqual(find_gaps(timestamps, T0, T0 + 100, 20, [[T0 + 60, T0 + 200]]),
+                         [(T0 + 11, T0 + 50), (T0 + 51, T0 + 60)])
+
+    def test_subtract(self):
+        self.assertEqual(subtract([(0, 10)], [[2, 3], [5, 7], [9, 12]]), [(0, 2), (3, 5), (7, 9)])
+        self.assertEqual(subtract([(0, 10)], [[-1, 11]]), [])
+
+    def test_split(self):
+        self.assertEqual(split([(0, 25)], 10), [(0, 10), (10, 20), (20, 25)])
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_rate(self):
+        limiter = RateLimiter(rate=100, burst=5)
+        start = time.monotonic()
+        for _ in range(15):
+            limiter.acquire()
+        # the burst is free, the other 10 tokens take 0.1s
+        self.assertGreater(time.monotonic() - start, 0.08)
+
+
+class TestBackfiller(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.storage = TickStorage(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_backfill(self):
+        fetcher = FakeFetcher(delay=0.01)
+        backfiller = Backfiller(self.storage, fetcher, workers=3, rate=1000, burst=1000, max_gap=5, max_span=100)
+        for t in range(400, 500):
+            self.storage.append('SYM', {'value': t}, T0 + t)
+
+        self.assertEqual(backfiller.backfill('SYM', T0, T0 + 1000), 901)
+        np.testing.assert_array_equal(self.storage.range('SYM')['value'], np.arange(1001))
+        # gaps split in requests of at most max_span seconds, at most 3 at the same time
+        self.assertEqual(len(fetcher.requests), 10)
+        self.assertLessEqual(fetcher.max_active, 3)
+
+        # nothing left to fetch
+        self.assertEqual(backfiller.backfill('SYM', T0, T0 + 1000), 0)
+        self.assertEqual(len(fetcher.requests), 10)
+        # the bounds of the ranges are fetched twice, and the ticks around the gaps were already stored
+        self.assertEqual(backfiller.metrics()['dropped'], 10)
+
+    def test_failed_range_retried(self):
+        fetcher = FakeFetcher(fail=(T0 + 100,))
+        backfiller = Backfiller(self.storage, fetcher, rate=1000, burst=1000, max_gap=5, max_span=100)
+        self.assertEqual(backfiller.backfill('SYM', T0, T0 + 300), 202)
+        self.assertEqual(backfiller.metrics()['failures'], 1)
+
+        fetcher.fail = ()
+        self.assertEqual(backfiller.backfill('SYM', T0, T0 + 300), 99)
+        self.assertEqual(fetcher.requests[-1], (T0 + 100, T0 + 200))
+        np.testing.assert_array_equal(self.storage.range('SYM')['value'], np.arange(301))
+
+    def test_empty_range_covered(self):
+        fetcher = FakeFetcher()
+        fetcher.fetch = lambda symbol, start, end: {'timestamp': [], 'value': []}
+        backfiller = Backfiller(self.storage, fetcher, rate=1000, burst=1000, max_gap=5)
+        self.assertEqual(backfiller.backfill('SYM', T0, T0 + 100), 0)
+        self.assertEqual(backfiller.gaps('SYM', T0, T0 + 100), [])
+        self.assertEqual(backfiller.gaps('SYM', T0, T0 + 200), [(T0 + 100, T0 + 200)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import time
+import threading
+import unittest
+import mock
+
+from market_interface.bar_aggregator import BarAggregator, parse_granularity
+from market_interface.data_feed import EVENT_FEED, POLL_FEED, SHM_TRANSPORT, TCP_TRANSPORT
+from market_interface.market_interface_template import MarketInterface
+from market_interface.tick_store import TickStore
+
+
+class TestBarAggregator(unittest.TestCase):
+    def test_parse_granularity(self):
+        self.assertEqual(parse_granularity('1s'), 1)
+        self.assertEqual(parse_granularity('5m'), 300)
+        self.assertEqual(parse_granularity('1h'), 3600)
+        self.assertEqual(parse_granularity(0.5), 0.5)
+        self.assertEqual(parse_granularity('30'), 30)
+        for invalid in ('0m', '-1', 'abc', '5x'):
+            self.assertRaises(ValueError, parse_granularity, invalid)
+
+    def test_bars(self):
+        aggregator = BarAggregator('SYM', 60)
+        ticks = [(0, 10, 1), (10, 12, 2), (20, 9, 1), (59, 11, 3)]
+        for t, price, volume in ticks:
+            self.assertIsNone(aggregator.update(t, {'value': price, 'volume': volume}))
+        self.assertEqual(aggregator.current_bar()['close'], 11)
+
+        bar = aggregator.update(125, {'value': 13})
+        self.assertEqual(bar, {'symbol': 'SYM', 'granularity': 60, 'timestamp': 0, 'open': 10, 'high': 12,
+                               'low': 9, 'close': 11, 'volume': 7, 'count': 4, 'complete': True})
+        self.assertEqual(aggregator.last, bar)
+        # the bar of the minute without ticks is skipped
+        current = aggregator.current_bar()
+        self.assertEqual((current['timestamp'], current['open'], current['volume']), (120, 13, 0))
+
+    def test_ignored_ticks(self):
+        aggregator = BarAggregator('SYM', 60)
+        aggregator.update(100, {'value': 1})
+        self.assertIsNone(aggregator.update(30, {'value': 5}))
+        self.assertIsNone(aggregator.update(110, {'other': 5}))
+        self.assertEqual(aggregator.current_bar()['count'], 1)
+
+
+class TestInterfaceBars(unittest.TestCase):
+    def setUp(self):
+        interface = MarketInterface.__new__(MarketInterface)
+        interface.subscriptions = {}
+        interface.feed_groups = {}
+        interface.event_groups = {}
+        interface.subscriptions_lock = threading.Lock()
+        interface.bar_aggregators = {}
+        interface.bars_lock = threading.Lock()
+        interface.bar_refs = {}
+        interface.BAR_PRICE_FIELD = 'value'
+        interface.BAR_VOLUME_FIELD = 'volume'
+        interface.tick_store = TickStore()
+        interface.tick_storage = None
+        interface.feed_scheduler = mock.Mock()
+        interface.run_loop = mock.Mock()
+        self.interface = interface
+
+    def subscribe(self, handle, granularity, mode=EVENT_FEED):
+        self.interface.add_subscription(handle, {'symbol': 'SYM', 'frequency': 0, 'mode': mode,
+                                                 'granularity': granularity})
+
+    def test_shared_aggregator(self):
+        self.subscribe('a', 60)
+        self.subscribe('b', 60)
+        self.subscribe('c', 60, POLL_FEED)
+        self.subscribe('ticks', None)
+        self.assertEqual(list(self.interface.bar_aggregators['SYM']), [60])
+
+        self.interface.record_tick('SYM', {'value': 1}, 10)
+        self.interface.record_tick('SYM', {'value': 2}, 70)
+        published = [c[0] for c in self.interface.feed_scheduler.publish.call_args_list]
+        # ticks to the tick group, the completed bar once to the event bar group
+        self.assertEqual([key for key, _ in published], [('SYM', 0, EVENT_FEED, None)] * 2 +
+                         [('SYM', 0, EVENT_FEED, 60)])
+        self.assertEqual(published[-1][1]['close'], 1)
+        self.assertEqual(self.interface.get_current_bar('SYM', 60)['open'], 2)
+
+        for handle in ('a', 'b', 'c'):
+            self.interface.remove_subscription(handle)
+        self.assertEqual(self.interface.bar_aggregators['SYM'], {})
+        self.assertEqual(self.interface.bar_refs, {})
+
+    def test_concurrent_add_remove(self):
+        # the last subscription to the bars going away while another one is added
+        for i in range(200):
+            self.subscribe('old', 60)
+            threads = [threading.Thread(target=self.interface.remove_subscription, args=('old',)),
+                       threading.Thread(target=self.subscribe, args=('new', 60, POLL_FEED))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertIn(60, self.interface.bar_aggregators['SYM'])
+            self.interface.remove_subscription('new')
+            self.assertNotIn(60, self.interface.bar_aggregators['SYM'])
+
+    def test_ring_released_with_last_shm_subscription(self):
+        for handle, transport in [('a', SHM_TRANSPORT), ('b', SHM_TRANSPORT), ('c', TCP_TRANSPORT)]:
+            self.interface.add_subscription(handle, {'symbol': 'SYM', 'frequency': 1, 'strategy_address': 'host',
+                                                     'strategy_port': 1, 'transport': transport})
+        self.interface.remove_subscription('a')
+        self.interface.feed_scheduler.release_ring.assert_not_called()
+        self.interface.remove_subscription('b')
+        self.interface.feed_scheduler.release_ring.assert_called_once_with('host', 1)
+        self.interface.remove_subscription('c')
+        self.interface.feed_scheduler.release_ring.assert_called_once()
+
+    def test_aggregator_added_while_recording(self):
+        now = time.time()
+        self.interface.record_tick('SYM', {'value': 1, 'volume': 1}, now)
+        subscriber = threading.Thread(target=self.subscribe, args=('bars', 60))
+        append = self.interface.tick_store.append
+
+        def append_and_subscribe(*args):
+            # the subscription arrives once the tick is in the tick store
+            append(*args)
+            subscriber.start()
+            subscriber.join(0.1)
+        with mock.patch.object(self.interface.tick_store, 'append', side_effect=append_and_subscribe):
+            self.interface.record_tick('SYM', {'value': 2, 'volume': 1}, now)
+        subscriber.join()
+        self.assertEqual(self.interface.get_current_bar('SYM', 60)['volume'], 2)
+
+        self.interface.record_tick('SYM', {'value': 3, 'volume': 1}, now)
+        bar = self.interface.get_current_bar('SYM', 60)
+        self.assertEqual((bar['volume'], bar['count'], bar['close']), (3, 3, 3))
+
+    def test_storage_failure(self):
+        self.subscribe('ticks', None)
+        self.interface.logger = mock.Mock()
+        self.interface.tick_storage = mock.Mock()
+        self.interface.tick_storage.append.side_effect = ValueError('Out of order tick')
+        self.interface.record_tick('SYM', {'value': 1}, 10)
+        self.interface.logger.error.assert_called_once()
+        self.interface.feed_scheduler.publish.assert_called_once_with(('SYM', 0, EVENT_FEED, None), {'value': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,16 @@
+import os
+import time
+import socket
+import threading
 import unittest
 import mock
 
-from market_interface.data_feed import push_feed, feed_callback
+from common.codec import JSON_CODEC, ZLIB_CODEC, detect_codec, decode
+from common.shm_ring import ShmRing
+from common.worker_pool import WorkerPool
+from market_interface.data_feed import send_group_feed, feed_callback, next_due_time, FeedScheduler, \
+    POLL_FEED, EVENT_FEED, SHM_TRANSPORT, SubscriberQueue, DeltaStream, CONFLATE, DROP_OLDEST, DISCONNECT, \
+    FULL_MESSAGE, SNAPSHOT_MESSAGE, DELTA_MESSAGE, DEFAULT_SEND_TIMEOUT
 
 
 class TestDataFeed(unittest.TestCase):
@@ -10,43 +19,434 @@ class TestDataFeed(unittest.TestCase):
         self.logger = mock.Mock()
         mock_get_logger.return_value = self.logger
 
-    @mock.patch("market_interface.data_feed.MessageSender")
-    @mock.patch("time.sleep")
-    def test_push_feed(self, mock_sleep, mock_message_sender):
-        def side_effect(*args, **kwargs):
-            del interface.subscriptions["test_sub"]
-        mock_send_message = mock_message_sender.return_value.send_message
-        mock_send_message.side_effect = side_effect
+    @mock.patch("market_interface.data_feed.get_connection")
+    def test_send_group_feed(self, mock_get_connection):
+        interface = mock.Mock()
+        interface.subscriptions = {
+            "sub_a": {"strategy_address": "a", "strategy_port": 0},
+            "sub_b": {"strategy_address": "b", "strategy_port": 0}
+        }
+        interface.get_feed_group.return_value = ["sub_a", "sub_b"]
+        interface.get_symbol_data.return_value = "test_data"
+        connection = mock_get_connection.return_value
+        connection.codec = JSON_CODEC
+
+        send_group_feed(interface, ("SYM", 1, POLL_FEED, None))
 
+        # data computed and encoded once for the whole group
+        interface.get_symbol_data.assert_called_once_with("SYM", "sub_a")
+        enqueue = interface.feed_scheduler.enqueue
+        self.assertEqual(enqueue.call_count, 2)
+        sent = [c[0][2] for c in enqueue.call_args_list]
+        self.assertIs(sent[0], sent[1])
+        self.assertEqual(JSON_CODEC.decode(sent[0]), {'query': 'MARKET_DATA_FEED', 'data': "test_data"})
+
+    @mock.patch("market_interface.data_feed.get_connection")
+    def test_send_group_feed_delta(self, mock_get_connection):
         interface = mock.Mock()
         interface.subscriptions = {
-            "test_sub": {
-                "strategy_address": 0,
-                "strategy_port": 0,
-                "frequency": 0
-            }
+            "sub_full": {"strategy_address": "a", "strategy_port": 0},
+            "sub_delta": {"strategy_address": "b", "strategy_port": 0, "delta": True, "needs_snapshot": True}
         }
-        interface.get_data.return_value = "test_data"
+        interface.get_feed_group.return_value = ["sub_full", "sub_delta"]
+        interface.feed_scheduler.get_stream.return_value = DeltaStream('S')
+        mock_get_connection.return_value.codec = JSON_CODEC
 
-        push_feed(interface, "test_sub")
+        def sent():
+            messages = [JSON_CODEC.decode(c[0][2]) for c in interface.feed_scheduler.enqueue.call_args_list]
+            interface.feed_scheduler.enqueue.reset_mock()
+            return messages
 
-        mock_send_message.assert_called_once()
-        mock_message_sender.return_value.close.assert_called_once()
-        self.assertTupleEqual(({'query': 'MARKET_DATA_FEED', 'data': "test_data"}, False), mock_send_message.call_args[0][:-1])
+        send_group_feed(interface, ("SYM", 1, POLL_FEED, None), {'a': 1, 'b': 2})
+        self.assertEqual(sent(), [{'query': 'MARKET_DATA_FEED', 'data': {'a': 1, 'b': 2}},
+                                  {'query': 'MARKET_DATA_DELTA', 'data': {'stream': 'S', 'seq': 1,
+                                                                          'snapshot': {'a': 1, 'b': 2}}}])
+        # snapshots are sent until one is dequeued
+        self.assertTrue(interface.subscriptions['sub_delta']['needs_snapshot'])
+        interface.subscriptions['sub_delta']['needs_snapshot'] = False
+        send_group_feed(interface, ("SYM", 1, POLL_FEED, None), {'a': 1, 'c': 3})
+        self.assertEqual(sent()[1], {'query': 'MARKET_DATA_DELTA', 'data': {'stream': 'S', 'seq': 2,
+                                                                            'changed': {'c': 3}, 'removed': ['b']}})
+        # resync
+        interface.subscriptions['sub_delta']['needs_snapshot'] = True
+        send_group_feed(interface, ("SYM", 1, POLL_FEED, None), {'a': 1, 'c': 3})
+        self.assertEqual(sent()[1]['data'], {'stream': 'S', 'seq': 3, 'snapshot': {'a': 1, 'c': 3}})
 
-    def test_feed_callback_success(self):
+    @mock.patch("market_interface.data_feed.get_connection")
+    def test_send_group_feed_empty(self, mock_get_connection):
         interface = mock.Mock()
-        interface.subscriptions = {"test_sub": {}}
+        interface.get_feed_group.return_value = []
+        send_group_feed(interface, ("SYM", 1, POLL_FEED, None))
+        interface.get_symbol_data.assert_not_called()
+        mock_get_connection.assert_not_called()
+
+    def test_feed_callback_success(self):
+        queue = mock.Mock()
         resp = {"status": "SUCCESS", "message": "test"}
-        feed_callback(interface, "test_sub", resp, self.logger)
-        self.assertEqual(interface.subscriptions, {"test_sub": {}})
+        feed_callback(queue, resp, self.logger)
+        self.assertTrue(queue.record_result.call_args[0][0])
 
     def test_feed_callback_fail(self):
-        interface = mock.Mock()
-        interface.subscriptions = {"test_sub": {}}
+        queue = mock.Mock()
         resp = {"status": "FAIL", "message": "test"}
-        feed_callback(interface, "test_sub", resp, self.logger)
-        self.assertEqual(interface.subscriptions, {})
+        feed_callback(queue, resp, self.logger)
+        self.assertFalse(queue.record_result.call_args[0][0])
+
+
+class TestNextDueTime(unittest.TestCase):
+    def test_on_time(self):
+        self.assertEqual(next_due_time(10, 1, 10.5), 11)
+
+    def test_late_send_does_not_drift(self):
+        self.assertEqual(next_due_time(10, 1, 10.99), 11)
+
+    def test_skips_missed_ticks(self):
+        self.assertEqual(next_due_time(10, 1, 13.5), 14)
+        self.assertEqual(next_due_time(10, 1, 11), 12)
+
+    def test_zero_frequency(self):
+        self.assertGreater(next_due_time(10, 0, 10), 10)
+
+
+class TestSubscriberQueue(unittest.TestCase):
+    def test_conflate(self):
+        queue = SubscriberQueue('a', 0, CONFLATE)
+        self.assertTrue(queue.put('A', b'a1', 0))
+        self.assertFalse(queue.put('B', b'b1', 1))
+        self.assertFalse(queue.put('A', b'a2', 2))
+        self.assertEqual([item[:3] for item in queue.pop(3)], [('A', b'a2', 0), ('B', b'b1', 1)])
+        self.assertEqual(queue.pop(3), [])
+        self.assertFalse(queue.draining)
+        self.assertEqual(queue.conflated, 1)
+        self.assertEqual(queue.max_lag, 3)
+
+    def test_conflate_delta_stream(self):
+        queue = SubscriberQueue('a', 0, CONFLATE)
+        subscription = {'needs_snapshot': True}
+        queue.put('A', b's1', 0, SNAPSHOT_MESSAGE, subscription, lambda: b's1')
+        # a delta does not replace the pending snapshot, a fresh snapshot does
+        queue.put('A', b'd2', 1, DELTA_MESSAGE, subscription, lambda: b's2')
+        queue.put('A', b'full', 1)
+        self.assertTrue(subscription['needs_snapshot'])
+        self.assertEqual([item[1:4] for item in queue.pop(2)],
+                         [(b's2', 0, SNAPSHOT_MESSAGE), (b'full', 1, FULL_MESSAGE)])
+        # cleared once the snapshot is dequeued
+        self.assertFalse(subscription['needs_snapshot'])
+
+        queue.put('A', b'd3', 3, DELTA_MESSAGE, subscription, lambda: b's3')
+        queue.put('A', b'd4', 4, DELTA_MESSAGE, subscription, lambda: b's4')
+        self.assertEqual([item[1] for item in queue.pop(5)], [b's4'])
+
+    def test_drop_delta(self):
+        queue = SubscriberQueue('a', 0, DROP_OLDEST, max_len=1)
+        subscription = {'needs_snapshot': False}
+        queue.put('A', b'd1', 0, DELTA_MESSAGE, subscription, lambda: b's1')
+        queue.put('B', b'b', 1)
+        self.assertTrue(subscription['needs_snapshot'])
+
+    def test_requeue_snapshot(self):
+        queue = SubscriberQueue('a', 0, CONFLATE)
+        subscription = {'needs_snapshot': True}
+        queue.put('A', b's1', 0, SNAPSHOT_MESSAGE, subscription, lambda: b's1')
+        items = queue.pop(1)
+        self.assertFalse(subscription['needs_snapshot'])
+        # send failed
+        queue.requeue(items)
+        self.assertTrue(subscription['needs_snapshot'])
+
+    def test_drop_oldest(self):
+        queue = SubscriberQueue('a', 0, DROP_OLDEST, max_len=2, max_batch=1)
+        for i in range(4):
+            queue.put('A', i, i)
+        self.assertEqual(queue.dropped, 2)
+        self.assertEqual([queue.pop(4)[0][1], queue.pop(4)[0][1]], [2, 3])
+
+    def test_disconnect_on_lag(self):
+        queue = SubscriberQueue('a', 0, DISCONNECT, disconnect_after=10)
+        self.assertFalse(queue.lagging(0))
+        queue.put('A', b'a', 0)
+        self.assertFalse(queue.lagging(5))
+        self.assertTrue(queue.lagging(11))
+        # other policies only disconnect failing subscribers
+        queue = SubscriberQueue('a', 0, DROP_OLDEST, disconnect_after=10)
+        queue.put('A', b'a', 0)
+        self.assertFalse(queue.lagging(11))
+
+    def test_disconnect_on_failures(self):
+        queue = SubscriberQueue('a', 0, CONFLATE, disconnect_after=10)
+        queue.record_result(False, 0)
+        queue.record_result(False, 5)
+        self.assertFalse(queue.lagging(9))
+        self.assertTrue(queue.lagging(11))
+        # a successful send resets the streak
+        queue.record_result(True, 11)
+        self.assertFalse(queue.lagging(30))
+
+    def test_requeue(self):
+        queue = SubscriberQueue('a', 0, DROP_OLDEST, max_batch=2)
+        for i in range(3):
+            queue.put('A', i, i)
+        items = queue.pop(2)
+        self.assertEqual(len(items), 2)
+        queue.requeue(items)
+        self.assertFalse(queue.draining)
+        self.assertEqual([item[1] for item in queue.pop(2)], [0, 1])
+        self.assertEqual(queue.metrics(3)['lag'], 1)
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, SubscriberQueue, 'a', 0, 'ignore')
+
+
+FAST = ('F', 1, POLL_FEED)
+SLOW = ('S', 3, POLL_FEED)
+EVENT = ('E', 1, EVENT_FEED)
+
+
+class TestFeedScheduler(unittest.TestCase):
+    def setUp(self):
+        self.interface = mock.Mock()
+        self.interface.feed_groups = {
+            FAST: {'sub_fast'},
+            SLOW: {'sub_slow'}
+        }
+        self.interface.get_feed_group.side_effect = lambda key: list(self.interface.feed_groups.get(key, ()))
+        self.scheduler = FeedScheduler(self.interface)
+        self.scheduler.workers = mock.Mock()
+        self.scheduler.workers.submit.return_value = True
+        self.sent = []
+        self.scheduler._dispatch = self.sent.append
+
+    def schedule(self, now):
+        with mock.patch('time.monotonic', return_value=now):
+            self.scheduler.add(FAST)
+            self.scheduler.add(SLOW)
+
+    def test_schedule(self):
+        self.schedule(0)
+        self.assertEqual(self.scheduler.run_pending(0), 1)
+        self.assertEqual(self.sent, [FAST, SLOW])
+        self.assertEqual(self.scheduler.run_pending(0.5), 0.5)
+        for now in [1, 2, 3]:
+            self.scheduler.run_pending(now)
+        self.assertEqual(self.sent, [FAST, SLOW, FAST, FAST, SLOW, FAST])
+
+    def test_add_scheduled_group(self):
+        self.schedule(0)
+        self.schedule(0)
+        self.assertEqual(len(self.scheduler.heap), 2)
+
+    def test_empty_group(self):
+        self.schedule(0)
+        self.scheduler.run_pending(0)
+        del self.interface.feed_groups[SLOW]
+        self.scheduler.run_pending(3)
+        self.assertEqual(self.sent, [FAST, SLOW, FAST])
+        self.assertEqual(len(self.scheduler.heap), 1)
+        del self.interface.feed_groups[FAST]
+        self.assertIsNone(self.scheduler.run_pending(4))
+        # groups can be scheduled again once dropped
+        self.interface.feed_groups[FAST] = {'sub_fast'}
+        self.schedule(5)
+        self.assertEqual(len(self.scheduler.heap), 2)
+
+    def test_skip_in_flight(self):
+        del self.scheduler._dispatch
+        self.schedule(0)
+        self.scheduler.run_pending(0)
+        self.scheduler.run_pending(1)
+        self.assertEqual(self.scheduler.workers.submit.call_count, 2)
+        self.assertEqual(self.scheduler.skipped, 1)
+        self.scheduler._send = mock.Mock()
+        self.scheduler.in_flight.clear()
+        self.scheduler.run_pending(2)
+        self.assertEqual(self.scheduler.workers.submit.call_count, 3)
+
+    @mock.patch("market_interface.data_feed.send_group_feed")
+    def test_event_feed(self, mock_send_feed):
+        del self.scheduler._dispatch
+        self.scheduler.workers.submit.side_effect = lambda fn, *args: fn(*args) or True
+        self.interface.feed_groups[EVENT] = {'sub_event'}
+        self.scheduler.add(EVENT)
+        self.assertEqual(self.scheduler.heap, [])
+
+        # first update sent right away
+        with mock.patch('time.monotonic', return_value=0):
+            self.scheduler.publish(EVENT, 'first')
+        mock_send_feed.assert_called_once_with(self.interface, EVENT, 'first')
+
+        # updates within the interval are conflated
+        with mock.patch('time.monotonic', return_value=0.5):
+            self.scheduler.publish(EVENT, 'second')
+            self.scheduler.publish(EVENT, 'third')
+        self.assertEqual(mock_send_feed.call_count, 1)
+        self.assertEqual(self.scheduler.conflated, 1)
+        self.assertEqual(self.scheduler.heap[0][0], 1)
+
+        # latest update sent at the end of the interval
+        with mock.patch('time.monotonic', return_value=1):
+            self.assertIsNone(self.scheduler.run_pending(1))
+        mock_send_feed.assert_called_with(self.interface, EVENT, 'third')
+        self.assertEqual(mock_send_feed.call_count, 2)
+
+        # quiet feeds send nothing
+        self.scheduler.run_pending(5)
+        self.assertEqual(mock_send_feed.call_count, 2)
+
+    @mock.patch("market_interface.data_feed.send_group_feed")
+    def test_event_feed_in_flight(self, mock_send_feed):
+        del self.scheduler._dispatch
+        self.interface.feed_groups[('E', 0, EVENT_FEED)] = {'sub_event'}
+        self.scheduler.publish(('E', 0, EVENT_FEED), 'first')
+        # published while the first one is being sent
+        self.scheduler.publish(('E', 0, EVENT_FEED), 'second')
+        self.assertEqual(self.scheduler.workers.submit.call_count, 1)
+        self.scheduler._send(('E', 0, EVENT_FEED))
+        mock_send_feed.assert_called_once_with(self.interface, ('E', 0, EVENT_FEED), 'second')
+        # resubmitted once the send completed, with nothing left to send
+        self.assertEqual(self.scheduler.workers.submit.call_count, 1)
+
+    @mock.patch("market_interface.data_feed.Connection")
+    @mock.patch("market_interface.data_feed.connection_pool")
+    def test_enqueue(self, mock_pool, mock_connection):
+        self.scheduler.workers.submit.side_effect = lambda fn, *args: fn(*args) or True
+        connection = mock_connection.return_value
+        connection.send_encoded.side_effect = lambda data, cb: cb({'status': 'SUCCESS'})
+        subscription = {'strategy_address': 'a', 'strategy_port': 0}
+        self.scheduler.enqueue(subscription, FAST, b'data')
+        self.scheduler.enqueue(subscription, FAST, b'data')
+        # sent over a feed connection with a send timeout, with the codec of the pooled one
+        mock_connection.assert_called_once_with('a', 0, read_responses=False, send_timeout=DEFAULT_SEND_TIMEOUT)
+        self.assertIs(connection.codec, mock_pool.get.return_value.codec)
+        self.assertEqual(connection.send_encoded.call_count, 2)
+        mock_pool.get.return_value.send_encoded.assert_not_called()
+        metrics = self.scheduler.metrics()['subscribers']['a:0']
+        self.assertEqual(metrics['sent'], 2)
+        self.assertEqual(metrics['queued'], 0)
+
+    @mock.patch("market_interface.data_feed.Connection")
+    @mock.patch("market_interface.data_feed.connection_pool")
+    def test_enqueue_batch(self, mock_pool, mock_connection):
+        mock_pool.get.return_value.codec = JSON_CODEC
+        connection = mock_connection.return_value
+        connection.send_encoded.side_effect = lambda data, cb: cb({'status': 'SUCCESS'})
+        subscription = {'strategy_address': 'a', 'strategy_port': 0}
+        msgs = [{'query': 'MARKET_DATA_FEED', 'data': i} for i in range(3)]
+        # queued while the drain task waits for a worker
+        for msg in msgs:
+            self.scheduler.enqueue(subscription, (msg['data'], 1, POLL_FEED), JSON_CODEC.encode(msg))
+        self.assertEqual(self.scheduler.workers.submit.call_count, 1)
+        self.scheduler._drain(self.scheduler.queues[('a', 0)])
+
+        connection.send_encoded.assert_called_once()
+        self.assertEqual(JSON_CODEC.decode(connection.send_encoded.call_args[0][0]),
+                         {'query': 'MARKET_DATA_FEED_BATCH', 'data': msgs})
+        self.assertEqual(self.scheduler.metrics()['subscribers']['a:0']['sent'], 3)
+
+    @mock.patch("market_interface.data_feed.Connection")
+    @mock.patch("market_interface.data_feed.connection_pool")
+    def test_enqueue_compressed(self, mock_pool, mock_connection):
+        self.scheduler.queue_options = {'compress_threshold': 100}
+        self.scheduler.workers.submit.side_effect = lambda fn, *args: fn(*args) or True
+        connection = mock_connection.return_value
+        connection.send_encoded.side_effect = lambda data, cb: cb({'status': 'SUCCESS'})
+        subscription = {'strategy_address': 'a', 'strategy_port': 0}
+        small = {'query': 'MARKET_DATA_FEED', 'data': {'value': 1}}
+        big = {'query': 'MARKET_DATA_FEED', 'data': {'bids': [1.0] * 100}}
+        for msg in [small, big]:
+            self.scheduler.enqueue(subscription, FAST, JSON_CODEC.encode(msg))
+        sent = [c[0][0] for c in connection.send_encoded.call_args_list]
+        self.assertIs(detect_codec(sent[0]), JSON_CODEC)
+        self.assertIs(detect_codec(sent[1]), ZLIB_CODEC)
+        self.assertEqual([decode(data) for data in sent], [small, big])
+
+    @mock.patch("market_interface.data_feed.connection_pool")
+    def test_enqueue_shm(self, mock_pool):
+        self.interface.INTERFACE_ID = 'TEST_%d' % os.getpid()
+        self.scheduler.ring_options = {'slots': 4, 'slot_size': 64}
+        ring = self.scheduler.get_ring('localhost', 1234)
+        self.assertIs(self.scheduler.get_ring('localhost', 1234), ring)
+        reader = ShmRing(ring.name)
+        try:
+            subscription = {'strategy_address': 'localhost', 'strategy_port': 1234, 'transport': SHM_TRANSPORT}
+            self.scheduler.enqueue(subscription, FAST, b'small')
+            self.assertEqual(reader.read_available(), [b'small'])
+            self.scheduler.workers.submit.assert_not_called()
+
+            # messages that don't fit in a slot go through the socket
+            self.scheduler.enqueue(subscription, FAST, b'x' * 65)
+            self.assertEqual(reader.read_available(), [])
+            self.scheduler.workers.submit.assert_called_once()
+            self.assertEqual(self.scheduler.metrics()['ring_fallbacks'], 1)
+
+            # destroyed once the subscriber is done with it
+            self.scheduler.release_ring('localhost', 1234)
+            self.assertEqual(self.scheduler.rings, {})
+            self.assertRaises(FileNotFoundError, ShmRing, ring.name)
+        finally:
+            reader.close()
+            self.scheduler.stop()
+
+    @mock.patch("market_interface.data_feed.Connection")
+    @mock.patch("market_interface.data_feed.connection_pool")
+    def test_enqueue_failing(self, mock_pool, mock_connection):
+        self.scheduler.queue_options = {'disconnect_after': 10}
+        self.scheduler.workers.submit.side_effect = lambda fn, *args: fn(*args) or True
+        mock_connection.return_value.send_encoded.side_effect = \
+            lambda data, cb: cb({'status': 'FAIL', 'message': 'test'})
+        subscription = {'strategy_address': 'a', 'strategy_port': 0}
+        self.interface.subscriptions = {'sub_a': subscription, 'sub_b': {'strategy_address': 'b', 'strategy_port': 0}}
+
+        # transient failures keep the subscription, and the message
+        with mock.patch('time.monotonic', return_value=0):
+            self.scheduler.enqueue(subscription, FAST, b'data')
+        self.interface.remove_subscription.assert_not_called()
+        self.assertEqual(self.scheduler.metrics()['subscribers']['a:0']['queued'], 1)
+
+        with mock.patch('time.monotonic', return_value=11):
+            self.scheduler.enqueue(subscription, FAST, b'data')
+        self.interface.remove_subscription.assert_called_once_with('sub_a')
+        self.assertEqual(self.scheduler.queues, {})
+        # only the feed connection is closed, not the pooled one
+        mock_connection.return_value.close.assert_called_once_with()
+        mock_pool.get.return_value.close.assert_not_called()
+
+    def test_non_reading_subscriber(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        server.bind(('localhost', 0))
+        server.listen(1)
+        port = server.getsockname()[1]
+        self.scheduler.workers = WorkerPool('test_senders', 1, 8)
+        self.scheduler.queue_options = {'send_timeout': 0.1, 'disconnect_after': 0.2}
+        subscription = {'strategy_address': 'localhost', 'strategy_port': port}
+        self.interface.subscriptions = {'sub_a': subscription}
+        drained = threading.Event()
+        drain = self.scheduler._drain
+        self.scheduler._drain = lambda queue: drain(queue) or drained.set()
+        try:
+            # more than the socket buffers can hold, the send blocks since nobody reads
+            self.scheduler.enqueue(subscription, FAST, b'x' * (32 * 1024 * 1024))
+            self.assertTrue(drained.wait(5))
+            self.assertEqual(self.scheduler.metrics()['subscribers']['localhost:%d' % port]['failed'], 1)
+
+            time.sleep(0.3)
+            self.scheduler.enqueue(subscription, FAST, b'data')
+            self.interface.remove_subscription.assert_called_once_with('sub_a')
+        finally:
+            server.close()
+
+    @mock.patch("market_interface.data_feed.send_group_feed")
+    def test_running(self, mock_send_feed):
+        del self.scheduler._dispatch
+        self.interface.feed_groups = {('F', 0.01, POLL_FEED): {'sub_fast'}}
+        self.scheduler.start()
+        self.scheduler.add(('F', 0.01, POLL_FEED))
+        for _ in range(200):
+            if mock_send_feed.call_count >= 5:
+                break
+            time.sleep(0.01)
+        self.scheduler.stop()
+        self.assertGreaterEqual(mock_send_feed.call_count, 5)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,53 @@
+import time
+import unittest
+import mock
+
+from market_interface.market_interface_template import MarketInterface
+from market_interface.market_interface_request_handler import MarketInterfaceRequestHandler
+from market_interface.tick_store import TickStore
+
+
+class TestBulkData(unittest.TestCase):
+    def setUp(self):
+        self.interface = MarketInterface.__new__(MarketInterface)
+        self.interface.INTERFACE_ID = 'test_interface'
+        self.interface.tick_store = TickStore(capacity=100)
+        self.interface.BULK_CHUNK_SIZE = 4
+        self.interface.tick_storage = None
+        self.interface.backfiller = None
+        for i in range(10):
+            self.interface.tick_store.append('SYM', {'value': i * 2}, timestamp=float(i))
+        self.handler = MarketInterfaceRequestHandler(mock.Mock(), self.interface)
+
+    def test_chunks(self):
+        responses = list(self.handler.bulk_data_request({'symbol': 'SYM', 'start_time': 1, 'end_time': 8}))
+        self.assertEqual([r['status'] for r in responses], ['SUCCESS'] * 2)
+        self.assertEqual(responses[0]['data'], {'symbol': 'SYM',
+                                                'timestamp': [1.0, 2.0, 3.0, 4.0],
+                                                'value': [2.0, 4.0, 6.0, 8.0]})
+        self.assertEqual(responses[1]['data']['timestamp'], [5.0, 6.0, 7.0, 8.0])
+
+    def test_chunk_size(self):
+        responses = list(self.handler.bulk_data_request({'symbol': 'SYM', 'chunk_size': 3}))
+        self.assertEqual([len(r['data']['value']) for r in responses], [3, 3, 3, 1])
+
+    @mock.patch('market_interface.market_interface_request_handler.BACKFILL_KEEPALIVE_INTERVAL', 0.01)
+    def test_backfill_in_background(self):
+        self.interface.backfiller = mock.Mock()
+        self.interface.backfill = mock.Mock(side_effect=lambda *args: time.sleep(0.2))
+        responses = self.handler.bulk_data_request({'symbol': 'SYM', 'start_time': 1, 'end_time': 8})
+        # answered right away, while the gaps are fetched
+        self.assertEqual(next(responses)['data'], {'symbol': 'SYM', 'backfilling': True})
+        responses = list(responses)
+        self.assertGreater(len(responses), 2)
+        self.assertTrue(all(r['data'].get('backfilling') for r in responses[:-2]))
+        self.assertEqual([r['data']['timestamp'][0] for r in responses[-2:]], [1.0, 5.0])
+        self.interface.backfill.assert_called_once_with('SYM', 1, 8)
+
+    def test_unknown_symbol(self):
+        response = self.handler.bulk_data_request({'symbol': 'NOPE'})
+        self.assertEqual(response['status'], 'FAIL')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from market_interface.tick_storage import TickStorage, Segment, day_of, day_bounds
+
+DAY = 86400
+# midnight of 2021-01-01, UTC
+T0 = 1609459200.0
+
+
+class TestTickStorage(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.storage = TickStorage(self.root, flush_size=4, index_stride=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def fill(self, symbol, timestamps):
+        for t in timestamps:
+            self.storage.append(symbol, {'bid': t - T0, 'ask': t - T0 + 0.5}, t)
+
+    def test_days(self):
+        self.assertEqual(day_of(T0 + 10), '2021-01-01')
+        self.assertEqual(day_bounds('2021-01-01'), (T0, T0 + DAY))
+
+    def test_append_range(self):
+        self.fill('SYM', [T0 + i for i in range(10)])
+        # buffered ticks are visible to reads
+        ticks = self.storage.range('SYM', T0 + 2, T0 + 7.5)
+        np.testing.assert_array_equal(ticks['timestamp'], [T0 + i for i in range(2, 8)])
+        np.testing.assert_array_equal(ticks['ask'], [i + 0.5 for i in range(2, 8)])
+        self.assertEqual(self.storage.symbols(), ['SYM'])
+        self.assertIsNone(self.storage.range('NOPE'))
+
+    def test_day_segments(self):
+        self.fill('SYM', [T0 + 10, T0 + DAY - 1, T0 + DAY, T0 + 2 * DAY + 5])
+        self.assertEqual(self.storage.days('SYM'), ['2021-01-01', '2021-01-02', '2021-01-03'])
+        parts = self.storage.scan('SYM', T0 + DAY - 1, T0 + DAY)
+        self.assertEqual([p['timestamp'].tolist() for p in parts], [[T0 + DAY - 1], [T0 + DAY]])
+        # sealed segments are read without copies
+        self.assertIsInstance(parts[0]['timestamp'].base, np.memmap)
+
+    def test_reopen(self):
+        self.fill('SYM', [T0 + i for i in range(10)])
+        self.storage.close()
+        storage = TickStorage(self.root)
+        np.testing.assert_array_equal(storage.range('SYM')['bid'], np.arange(10))
+
+    def test_index_search(self):
+        self.fill('SYM', [T0 + i for i in range(20)])
+        self.storage.close()
+        segment = self.storage.segments('SYM', '2021-01-01')[0]
+        self.assertTrue(segment.sealed)
+        for start in np.arange(-1, 21, 0.5):
+            for end in np.arange(start, 21, 1.5):
+                expected = [T0 + i for i in range(20) if start <= i <= end]
+                self.assertEqual(segment.slice(T0 + start, T0 + end)['timestamp'].tolist(), expected)
+
+    def test_write_overlap_compact(self):
+        self.fill('SYM', [T0 + i for i in range(0, 10, 2)])
+        # out of order and partly duplicate ticks, written in bulk
+        timestamps = np.array([T0 + 5, T0 + 1, T0 + 4, T0 + DAY + 1])
+        self.storage.write('SYM', {'timestamp': timestamps, 'bid': timestamps - T0, 'ask': timestamps - T0 + 0.5})
+        self.assertEqual(len(self.storage.segments('SYM', '2021-01-01')), 2)
+
+        merged = self.storage.range('SYM', T0, T0 + 9)
+        self.assertEqual((merged['timestamp'] - T0).tolist(), [0, 1, 2, 4, 4, 5, 6, 8])
+        # only the overlapping segments are merged, the next day is still a view
+        parts = self.storage.scan('SYM')
+        self.assertEqual([(p['timestamp'] - T0).tolist() for p in parts], [[0, 1, 2, 4, 4, 5, 6, 8], [DAY + 1]])
+        self.assertIsInstance(parts[1]['timestamp'].base, np.memmap)
+
+        # the day still being written is left alone
+        self.assertEqual(self.storage.compact_all(), 0)
+        self.storage.close()
+        self.assertEqual(self.storage.compact_all(), 1)
+        segments = self.storage.segments('SYM', '2021-01-01')
+        self.assertEqual(len(segments), 1)
+        self.assertEqual((segments[0].columns['timestamp'] - T0).tolist(), [0, 1, 2, 4, 5, 6, 8])
+        np.testing.assert_array_equal(segments[0].columns['bid'], [0, 1, 2, 4, 5, 6, 8])
+        # nothing left to compact
+        self.assertEqual(self.storage.compact_all(), 0)
+        self.assertEqual(len(os.listdir(os.path.join(self.root, 'SYM', '2021-01-01'))), 4)
+
+    def test_interrupted_write(self):
+        self.fill('SYM', [T0 + i for i in range(8)])
+        self.storage.flush()
+        # a value column shorter than the others, as after a crash
+        path = os.path.join(self.root, 'SYM', '2021-01-01', '000001.bid')
+        with open(path, 'r+b') as f:
+            f.truncate(5 * 8 + 3)
+        self.assertEqual(len(Segment(path[:-4], ('bid', 'ask'))), 5)
+
+    def test_out_of_order(self):
+        self.fill('SYM', [T0 + 5])
+        self.assertRaises(ValueError, self.storage.append, 'SYM', {'bid': 0, 'ask': 0}, T0 + 4)
+
+    def test_invalid_symbol(self):
+        for symbol in ('', '.', '..'):
+            self.assertRaises(ValueError, self.storage.append, symbol, {'bid': 0}, T0)
+
+    def test_escaped_symbols(self):
+        symbols = ['BTC/USD', '../x', 'a%2Fb', 'x\\y']
+        for symbol in symbols:
+            self.fill(symbol, [T0, T0 + 1])
+        self.storage.flush()
+        # stored in directories of the root, and read back under their names
+        self.assertEqual(sorted(os.listdir(self.root)), ['..%2Fx', 'BTC%2FUSD', 'a%252Fb', 'x%5Cy'])
+        self.assertEqual(self.storage.symbols(), sorted(symbols))
+        for symbol in symbols:
+            self.assertEqual(list(self.storage.range(symbol, T0, T0 + 1)['timestamp']), [T0, T0 + 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+import numpy as np
+
+from market_interface.tick_store import SymbolBuffer, TickStore
+
+
+class TestSymbolBuffer(unittest.TestCase):
+    def setUp(self):
+        self.buffer = SymbolBuffer(['bid', 'ask'], capacity=4)
+
+    def fill(self, n):
+        for i in range(n):
+            self.buffer.append(float(i), {'bid': i, 'ask': i + 0.5})
+
+    def test_latest(self):
+        self.assertIsNone(self.buffer.latest())
+        self.fill(3)
+        self.assertEqual(self.buffer.latest(), {'timestamp': 2.0, 'bid': 2.0, 'ask': 2.5})
+        self.assertEqual(len(self.buffer), 3)
+
+    def test_wraparound(self):
+        self.fill(10)
+        self.assertEqual(len(self.buffer), 4)
+        self.assertEqual(self.buffer.latest()['bid'], 9.0)
+        ticks = self.buffer.range()
+        np.testing.assert_array_equal(ticks['timestamp'], [6, 7, 8, 9])
+        np.testing.assert_array_equal(ticks['ask'], [6.5, 7.5, 8.5, 9.5])
+
+    def test_range(self):
+        self.fill(6)
+        np.testing.assert_array_equal(self.buffer.range(3, 4)['timestamp'], [3, 4])
+        np.testing.assert_array_equal(self.buffer.range(start=4.5)['bid'], [5])
+        np.testing.assert_array_equal(self.buffer.range(end=2.5)['timestamp'], [2])
+        self.assertEqual(len(self.buffer.range(10, 20)['timestamp']), 0)
+
+    def test_out_of_order(self):
+        self.fill(2)
+        self.assertRaises(ValueError, self.buffer.append, 0.5, {'bid': 0, 'ask': 0})
+        # same timestamp is fine
+        self.buffer.append(1.0, {'bid': 0, 'ask': 0})
+
+    def test_missing_field(self):
+        self.assertRaises(KeyError, self.buffer.append, 0, {'bid': 1})
+
+
+class TestTickStore(unittest.TestCase):
+    def test_store(self):
+        store = TickStore(capacity=8)
+        self.assertIsNone(store.latest('A'))
+        self.assertIsNone(store.range('A'))
+        store.append('A', {'value': 1.0}, 10)
+        store.append('A', {'value': 2.0}, 11)
+        store.append('B', {'price': 5.0})
+        self.assertEqual(store.latest('A'), {'timestamp': 11.0, 'value': 2.0})
+        np.testing.assert_array_equal(store.range('A', 10, 10)['value'], [1.0])
+        self.assertEqual(sorted(store.symbols()), ['A', 'B'])
+
+
+if __name__ == '__main__':
+    unittest.main()